@@ -2,8 +2,11 @@
 import os
 import json
 import logging
-from typing import List, Dict, Any
+import argparse
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Any, Set, Tuple
 from pydantic import BaseModel
+from tqdm import tqdm
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 # from embeddings_openai import embed_large as get_embedding
 # from embeddings_openai import embed_small as get_embedding
@@ -11,6 +14,8 @@ from voyage import embed as get_embedding
 from voyage import count_tokens
 from voyage import tokenize
 # from modules.embedding_model import get_embeddings as get_embedding
+from real_shit.embeddings.embedders import VoyageEmbedder, batch_by_tokens
+from real_shit.embeddings.cache import CachedEmbedder, flush_all
 
 import os
 os.environ['HF_TOKEN'] = 'your_hugging_face_token'
@@ -123,12 +128,170 @@ def process_all_files(data_dir: str, db_dir: str, chunk_size: int, chunk_overlap
         
         logging.debug(f"File processed and saved: {output_filename}")
 
+# Split one entry into the texts to embed: name, introduction, then the description chunks
+def split_entry(entry: Dict[str, Any], text_splitter: RecursiveCharacterTextSplitter) -> List[str]:
+    return [entry['name'], entry['detail']['introduction']] + text_splitter.split_text(entry['detail']['description'])
+
+
+def build_entry(texts: List[str], embeddings: List[List[float]]) -> ProcessedEntry:
+    return ProcessedEntry(
+        name=ChunkedData(text=texts[0], embedding=embeddings[0]),
+        introduction=ChunkedData(text=texts[1], embedding=embeddings[1]),
+        chunks={f'chunk_{i:04d}': ChunkedData(text=chunk, embedding=embedding)
+                for i, (chunk, embedding) in enumerate(zip(texts[2:], embeddings[2:]))}
+    )
+
+
+# Indices (in the input file) of the entries already written to the partial output of an interrupted
+# run. A line cut short by a crash is truncated first, so new records start on a line of their own.
+def load_partial(partial_path: str) -> Set[int]:
+    done = set()
+    if not os.path.exists(partial_path):
+        return done
+    with open(partial_path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            logging.debug(f"Dropping a cut-off last line of {partial_path}")
+            f.truncate(end)
+    for line in data[:end].decode('utf-8').splitlines():
+        if line.strip():
+            done.add(json.loads(line)['index'])
+    return done
+
+
+# Chunk and embed one input file. Chunks of all its entries are embedded in token-budgeted batches on
+# the shared pool. Entries are appended to <output>.partial in input order as soon as they and all
+# entries before them are embedded, so only the entries waiting for an earlier one stay in memory;
+# the finished partial file becomes the output, one {"index", "entry"} record per line.
+def process_file_parallel(file_path: str, output_path: str, text_splitter: RecursiveCharacterTextSplitter,
+                          embedder, pool: ThreadPoolExecutor, workers: int) -> bool:
+    data = load_from_json(file_path)
+    partial_path = f"{output_path}.partial"
+    done = load_partial(partial_path)
+    if done:
+        logging.debug(f"Resuming {file_path} with {len(done)}/{len(data)} entries done")
+
+    texts: Dict[int, List[str]] = {}
+    embeddings: Dict[int, List[Any]] = {}
+    remaining: Dict[int, int] = {}
+    flat: List[Tuple[int, int, str]] = []
+    for index, entry in enumerate(data):
+        if index in done:
+            continue
+        texts[index] = split_entry(entry, text_splitter)
+        embeddings[index] = [None] * len(texts[index])
+        remaining[index] = len(texts[index])
+        flat.extend((index, position, text) for position, text in enumerate(texts[index]))
+    order = sorted(texts)
+    del data
+
+    failed = 0
+    failed_entries: Set[int] = set()
+    # Finished entries waiting for an earlier one, and the position in `order` of the next to write
+    ready: Dict[int, Dict[str, Any]] = {}
+    next_position = 0
+    token_counts = embedder.count_tokens([text for _, _, text in flat]) if flat else []
+    progress = tqdm(total=len(flat), desc=os.path.basename(file_path), leave=False)
+    with open(partial_path, 'a', encoding='utf-8') as partial:
+        pending = {}
+
+        def write_ready():
+            nonlocal next_position
+            while next_position < len(order):
+                index = order[next_position]
+                if index in failed_entries:
+                    # Left for the next run, texts and embeddings of it are not needed any more
+                    texts.pop(index, None)
+                    embeddings.pop(index, None)
+                elif index in ready:
+                    partial.write(json.dumps({'index': index, 'entry': ready.pop(index)}, ensure_ascii=False) + '\n')
+                else:
+                    break
+                next_position += 1
+            partial.flush()
+
+        def collect(return_when):
+            nonlocal failed
+            finished, _ = wait(list(pending), return_when=return_when)
+            for future in finished:
+                batch = pending.pop(future)
+                try:
+                    vectors = future.result()
+                except Exception as e:
+                    failed += len(batch)
+                    failed_entries.update(index for index, _, _ in batch)
+                    logging.error(f"Error embedding a batch of {len(batch)} chunks from {file_path}: {e}")
+                    continue
+                for (index, position, _), vector in zip(batch, vectors):
+                    if index in failed_entries:
+                        continue
+                    embeddings[index][position] = list(vector)
+                    remaining[index] -= 1
+                    if remaining[index] == 0:
+                        ready[index] = build_entry(texts.pop(index), embeddings.pop(index)).dict()
+                progress.update(len(batch))
+            write_ready()
+
+        for indices in batch_by_tokens(token_counts, embedder.max_batch_tokens, embedder.max_batch_size):
+            # Bound the number of batches in flight to the worker count
+            while len(pending) >= workers:
+                collect(FIRST_COMPLETED)
+            batch = [flat[i] for i in indices]
+            pending[pool.submit(embedder.embed, [text for _, _, text in batch], 'document')] = batch
+        while pending:
+            collect(FIRST_COMPLETED)
+    progress.close()
+
+    if failed:
+        logging.error(f"{failed} chunks of {file_path} failed, run again to resume from {partial_path}")
+        return False
+    os.replace(partial_path, output_path)
+    return True
+
+
+# Parallel variant of process_all_files. Files whose output exists are skipped, so an interrupted
+# run can be restarted with the same arguments.
+def process_all_files_parallel(data_dir: str, db_dir: str, chunk_size: int, chunk_overlap: int,
+                               embedder=None, workers: int = 4) -> None:
+    logging.debug(f"Processing all files in directory: {data_dir} with {workers} workers")
+    os.makedirs(db_dir, exist_ok=True)
+    embedder = embedder or CachedEmbedder(VoyageEmbedder())
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+    filenames = sorted(f for f in os.listdir(data_dir) if f.endswith('.json'))
+    failed = []
+    try:
+        with ThreadPoolExecutor(workers) as pool:
+            for filename in tqdm(filenames, desc="Files"):
+                output_filename = f"{os.path.splitext(filename)[0]}_chunked.jsonl"
+                output_path = os.path.join(db_dir, output_filename)
+                if os.path.exists(output_path):
+                    logging.debug(f"Skipping {filename}, {output_filename} already exists")
+                    continue
+                if process_file_parallel(os.path.join(data_dir, filename), output_path, text_splitter, embedder, pool, workers):
+                    logging.debug(f"File processed and saved: {output_filename}")
+                else:
+                    failed.append(filename)
+    finally:
+        flush_all()
+    if failed:
+        print(f"{len(failed)} files did not finish, run again to resume: {', '.join(failed)}")
+
+
 # Example usage
 if __name__ == "__main__":
-    chunk_size = 20000  # Set your desired chunk size
-    chunk_overlap = 2000  # Set your desired chunk overlap
-    data_dir = 'data'
-    db_dir = f'db/db_VOYAGE_MULTILINGUAL_embed_{chunk_size}_{chunk_overlap}'
-    
-    process_all_files(data_dir, db_dir, chunk_size, chunk_overlap)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chunk-size', type=int, default=20000)  # Set your desired chunk size
+    parser.add_argument('--chunk-overlap', type=int, default=2000)  # Set your desired chunk overlap
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--db-dir', help="defaults to db/db_VOYAGE_MULTILINGUAL_embed_<chunk size>_<chunk overlap>")
+    parser.add_argument('--workers', type=int, default=4, help="embedding requests in flight")
+    parser.add_argument('--sequential', action='store_true', help="embed one chunk at a time, as before")
+    args = parser.parse_args()
+    db_dir = args.db_dir or f'db/db_VOYAGE_MULTILINGUAL_embed_{args.chunk_size}_{args.chunk_overlap}'
 
+    if args.sequential:
+        process_all_files(args.data_dir, db_dir, args.chunk_size, args.chunk_overlap)
+    else:
+        process_all_files_parallel(args.data_dir, db_dir, args.chunk_size, args.chunk_overlap, workers=args.workers)
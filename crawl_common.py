@@ -0,0 +1,131 @@
+# Pieces shared by the crawlers (obory.py, scrape_laws.py, crawl_zakony_pro_lidi.py): a pool of headless
+# Chrome browsers and a resumable JSONL writer. Importing this module has no side effects, selenium is
+# only imported when the first browser is started and logging is left to the scripts.
+from contextlib import contextmanager
+from typing import Any, Dict, Set
+import queue
+import logging
+import threading
+import json
+import os
+
+WAIT_TIMEOUT = 15
+
+CHROME_ARGUMENTS = ["--window-size=1080,1920", "--disable-extensions", "--proxy-server='direct://'",
+                    "--proxy-bypass-list=*", "--start-maximized", "--headless", "--disable-gpu",
+                    "--disable-dev-shm-usage", "--no-sandbox", "--ignore-certificate-errors"]
+
+
+def new_driver():
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from webdriver_manager.chrome import ChromeDriverManager
+    options = webdriver.ChromeOptions()
+    for argument in CHROME_ARGUMENTS:
+        options.add_argument(argument)
+    # Return once the DOM is ready, the crawlers wait explicitly for the content they read
+    options.page_load_strategy = 'eager'
+    return webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+
+
+# Errors after which a browser is unusable: Chrome crashed or the session is gone. Timeouts, missing
+# elements and script errors belong to the page and leave the browser in the pool.
+def is_dead_driver_error(error: Exception) -> bool:
+    from selenium.common.exceptions import (InvalidSessionIdException, NoSuchWindowException,
+                                            SessionNotCreatedException, WebDriverException)
+    from urllib3.exceptions import HTTPError
+    # A dead chromedriver surfaces as a plain WebDriverException or as a failed request to it
+    return (type(error) is WebDriverException or isinstance(error, (ConnectionError, HTTPError))
+            or isinstance(error, (InvalidSessionIdException, NoSuchWindowException, SessionNotCreatedException)))
+
+
+# A fixed number of browsers shared by the worker threads, started on first use. A browser that fails
+# with a dead-driver error is quit and replaced by a new one on demand.
+class DriverPool:
+    def __init__(self, size: int):
+        self.size = size
+        self.idle = queue.Queue()
+        self.drivers = []
+        # Discarded browsers whose replacement has not been started yet
+        self.replacing = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def driver(self):
+        with self.lock:
+            if self.idle.empty() and len(self.drivers) + self.replacing < self.size:
+                self.drivers.append(new_driver())
+                self.idle.put(self.drivers[-1])
+        driver = self.idle.get()
+        if driver is None:
+            # The place of a discarded browser
+            try:
+                driver = new_driver()
+            except Exception:
+                self.idle.put(None)
+                raise
+            with self.lock:
+                self.drivers.append(driver)
+                self.replacing -= 1
+        try:
+            yield driver
+        except Exception as e:
+            if is_dead_driver_error(e):
+                self._discard(driver)
+            else:
+                self.idle.put(driver)
+            raise
+        else:
+            self.idle.put(driver)
+
+    def _discard(self, driver):
+        logging.warning("Replacing a browser after a WebDriver error")
+        with self.lock:
+            self.drivers.remove(driver)
+            self.replacing += 1
+            # Threads already waiting for a browser start the replacement
+            self.idle.put(None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def close(self):
+        for driver in self.drivers:
+            driver.quit()
+
+
+# Appends one JSON record per line. Keys (the `key` field of a record) already in the file are skipped,
+# so documents fetched again after a crash between a write and the checkpoint are not duplicated.
+class JsonlWriter:
+    def __init__(self, path: str, key: str = "key"):
+        self.path = path
+        self.key = key
+        self.keys: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, 'rb+') as f:
+                data = f.read()
+                # Drop a line cut short by a crash
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    f.truncate(end)
+            for line in data[:end].decode('utf-8').splitlines():
+                if line.strip():
+                    self.keys.add(json.loads(line)[key])
+        self.file = open(path, 'a', encoding='utf-8')
+        self.written = 0
+
+    def write(self, record: Dict[str, Any]):
+        if record[self.key] in self.keys:
+            return
+        self.file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        self.keys.add(record[self.key])
+        self.written += 1
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush()
+        self.file.close()
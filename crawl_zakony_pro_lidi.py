@@ -1,32 +1,36 @@
-from selenium import webdriver
+# Crawler of the Supreme, Supreme Administrative and Constitutional Court decisions published on
+# zakonyprolidi.cz. The search is walked in date windows: every window lists its decisions, their
+# texts are fetched by a pool of browsers and appended to data/judgments/<court>.jsonl as they come.
+# A checkpoint of the finished windows lets an interrupted crawl resume and a later run continue
+# from where the last one ended; windows of the last --recheck-days are listed again on every run
+# because decisions are published with a delay. real_shit/judgments.py chunks and embeds the output.
+#   python crawl_zakony_pro_lidi.py --courts ustavni_soud --from 2020-01-01 --browsers 4
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.common.exceptions import InvalidArgumentException, WebDriverException, NoSuchElementException
-from time import sleep
-import json
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List, Tuple
+import argparse
 import logging
+import json
+import os
+from crawl_common import DriverPool, JsonlWriter, WAIT_TIMEOUT
 
+COURTS = {"nejvyssi_soud": 1, "nejvyssi_spravni_soud": 2, "ustavni_soud": 3}
+SEARCH_URL = 'https://www.zakonyprolidi.cz/judikaty-hledani?a={court}&from={start}&to={end}'
+RESULT_SELECTOR = '.ResultList .Item.Jud'
+NEXT_SELECTOR = '#Main > div.pg-body > div.PageMain > div > div.ContentBody > div.Paper > div.grid-body > div.grid-main > div.grid-footer > div > a.btn.btn-secondary.command.next'
+TEXT_XPATH = '//*[@id="idBody_idCtn"]'
+OUTPUT_DIR = os.path.join('data', 'judgments')
+# The courts of the Czech Republic decide since 1993
+FIRST_DATE = date(1993, 1, 1)
+WINDOW_DAYS = 30
+RECHECK_DAYS = 90
 
-# Set up Selenium WebDriver
-options = webdriver.ChromeOptions()
-options.add_argument("--window-size=1080,1920")
-options.add_argument("--disable-extensions")
-options.add_argument("--proxy-server='direct://'")
-options.add_argument("--proxy-bypass-list=*")
-options.add_argument("--start-maximized")
-options.add_argument('--headless')
-options.add_argument('--disable-gpu')
-options.add_argument('--disable-dev-shm-usage')
-options.add_argument('--no-sandbox')
-options.add_argument('--ignore-certificate-errors')
-
-
-logging.basicConfig(
-    filename='logs.log',  # Log file path
-    filemode='a',            # Append to the log file on each run
-    format='%(asctime)s - %(levelname)s - %(message)s'  # Log message format
-)
+# Links of all decisions of a result page in one round trip
+LINKS_JS = "return Array.from(document.querySelectorAll(arguments[0] + ' a.dos')).map(a => a.href);"
 
 
 def log_to_file(message):
@@ -34,62 +38,128 @@ def log_to_file(message):
         file.write(message + '\n')
 
 
-def fetch_data():
-    driver = webdriver.Chrome(service=Service(
-        ChromeDriverManager().install()), options=options)
-    courts = {"nejvyssi_soud": 1,
-              "nejvyssi_spravni_soud": 2, "ustavni_soud": 3}
+# (first day, last day) of consecutive windows covering start .. end
+def date_windows(start: date, end: date, days: int = WINDOW_DAYS) -> Iterator[Tuple[date, date]]:
+    while start <= end:
+        last = min(start + timedelta(days=days - 1), end)
+        yield start, last
+        start = last + timedelta(days=1)
+
+
+# Per court the first day not crawled yet and the decisions whose text failed, retried on the next run
+class Checkpoint:
+    def __init__(self, path: str):
+        self.path = path
+        self.state: Dict[str, Any] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def court(self, court: str, first_date: date) -> Dict[str, Any]:
+        return self.state.setdefault(court, {"next": first_date.isoformat(), "failed": []})
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+# Links of every decision in a date window, following the result pages
+def fetch_window_links(driver, court_id: int, start: date, end: date) -> List[str]:
+    driver.get(SEARCH_URL.format(court=court_id, start=start.isoformat(), end=end.isoformat()))
+    links = []
+    while True:
+        try:
+            first = WebDriverWait(driver, WAIT_TIMEOUT).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, RESULT_SELECTOR)))
+        except TimeoutException:
+            # No decisions in this window
+            return links
+        links.extend(link for link in driver.execute_script(LINKS_JS, RESULT_SELECTOR) if link not in links)
+        buttons = driver.find_elements(By.CSS_SELECTOR, NEXT_SELECTOR)
+        if not buttons or "disabled" in buttons[0].get_attribute("class"):
+            return links
+        driver.execute_script("arguments[0].click();", buttons[0])
+        WebDriverWait(driver, WAIT_TIMEOUT).until(EC.staleness_of(first))
+
+
+def fetch_decision(pool: DriverPool, court: str, link: str) -> Dict[str, Any]:
+    with pool.driver() as driver:
+        driver.get(link)
+        element = WebDriverWait(driver, WAIT_TIMEOUT).until(EC.presence_of_element_located((By.XPATH, TEXT_XPATH)))
+        text = element.text
+    return {"key": link.rstrip('/').split('/')[-1], "court": court, "link": link, "text": text}
+
+
+# Fetch the texts of the links not in the output yet; returns the links that failed
+def fetch_decisions(pool: DriverPool, court: str, links: List[str], writer: JsonlWriter, workers: int) -> List[str]:
+    pending = [link for link in links if link.rstrip('/').split('/')[-1] not in writer.keys]
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch_decision, pool, court, link): link for link in pending}
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+            except Exception as e:
+                logging.error(f"Failed to fetch {futures[future]}: {e}")
+                failed.append(futures[future])
+                continue
+            writer.write(record)
+    writer.flush()
+    return failed
+
+
+def crawl_court(pool: DriverPool, checkpoint: Checkpoint, court: str, first_date: date, last_date: date,
+                workers: int, recheck_days: int = RECHECK_DAYS, window_days: int = WINDOW_DAYS) -> int:
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    writer = JsonlWriter(os.path.join(OUTPUT_DIR, f'{court}.jsonl'))
+    state = checkpoint.court(court, first_date)
+    # Windows ending after this day can still get decisions, they are not marked as done
+    settled = date.today() - timedelta(days=recheck_days)
     try:
-        driver = webdriver.Chrome(service=Service(
-            ChromeDriverManager().install()), options=options)
-        for court in courts:
-            button_selector = '#Main > div.pg-body > div.PageMain > div > div.ContentBody > div.Paper > div.grid-body > div.grid-main > div.grid-footer > div > a.btn.btn-secondary.command.next'
-            data = {}
-            url = f'https://www.zakonyprolidi.cz/judikaty-hledani?a={courts[court]}&to=2021-05-27'
-            driver.get(url)
-            sleep(1)
-            while True:
-                try:
-                    link_elements = driver.find_elements(
-                        By.CSS_SELECTOR, '.ResultList .Item.Jud a.dos')
-                    links = []
-                    for link in link_elements:
-                        links.append(link.get_attribute('href'))
-                    for link in links:
-                        print(link)
-                        driver.get(link)
-                        sleep(0.1)
-                        div_element = driver.find_element(
-                            By.XPATH, '//*[@id="idBody_idCtn"]')
-                        div_text = div_element.text
-                        parts = link.split("/")
-                        last_part = parts[-1]
-                        data[last_part] = div_text
-                        driver.back()
-                        sleep(0.1)
-                    sleep(0.5)
-                    element = driver.find_element(
-                        By.CSS_SELECTOR, button_selector)
-                    class_name = element.get_attribute("class")
-                    if "disabled" in class_name:
-                        raise NoSuchElementException
-                    driver.execute_script("arguments[0].click();", element)
-                    sleep(1)
-                except NoSuchElementException:
-                    log_to_file("Ending for court "+court)
-                    save_data_to_json(data, court+"_rozhodnuti.json")
-                    break
-
-    except Exception as e:
-        print(f"Unexpected error occurred: {str(e)}")
+        if state["failed"]:
+            state["failed"] = fetch_decisions(pool, court, state["failed"], writer, workers)
+            checkpoint.save()
+        start = max(date.fromisoformat(state["next"]), first_date)
+        for window_start, window_end in date_windows(start, last_date, window_days):
+            with pool.driver() as driver:
+                links = fetch_window_links(driver, COURTS[court], window_start, window_end)
+            failed = fetch_decisions(pool, court, links, writer, workers)
+            state["failed"] = sorted(set(state["failed"] + failed))
+            if window_end <= settled:
+                state["next"] = (window_end + timedelta(days=1)).isoformat()
+            checkpoint.save()
+            log_to_file(f"{court}: {window_start} - {window_end}, {len(links)} decisions, {len(failed)} failed")
     finally:
-        driver.quit()
+        writer.close()
+    return writer.written
 
 
-def save_data_to_json(data: dict, filename: str):
-    with open(f'{filename}', 'w', encoding='utf-8-sig') as file:
-        json.dump(data, file, ensure_ascii=False, indent=4)
+def fetch_data(courts: List[str] = tuple(COURTS), first_date: date = FIRST_DATE, last_date: date = None,
+               browsers: int = 4, checkpoint_path: str = os.path.join(OUTPUT_DIR, 'checkpoint.json'),
+               recheck_days: int = RECHECK_DAYS, window_days: int = WINDOW_DAYS):
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    last_date = last_date or date.today()
+    checkpoint = Checkpoint(checkpoint_path)
+    pool = DriverPool(browsers)
+    try:
+        for court in courts:
+            written = crawl_court(pool, checkpoint, court, first_date, last_date, browsers, recheck_days, window_days)
+            print(f"{court}: {written} new decisions, {len(checkpoint.court(court, first_date)['failed'])} failed")
+    finally:
+        pool.close()
 
 
 if __name__ == "__main__":
-    fetch_data()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--courts", nargs="+", default=list(COURTS), choices=list(COURTS))
+    parser.add_argument("--from", dest="first_date", type=date.fromisoformat, default=FIRST_DATE)
+    parser.add_argument("--to", dest="last_date", type=date.fromisoformat, default=None)
+    parser.add_argument("--browsers", type=int, default=4, help="Browsers fetching decision texts in parallel")
+    parser.add_argument("--window-days", type=int, default=WINDOW_DAYS)
+    parser.add_argument("--recheck-days", type=int, default=RECHECK_DAYS)
+    parser.add_argument("--checkpoint", default=os.path.join(OUTPUT_DIR, 'checkpoint.json'))
+    args = parser.parse_args()
+    fetch_data(args.courts, args.first_date, args.last_date, args.browsers, args.checkpoint,
+               args.recheck_days, args.window_days)
@@ -1,9 +1,12 @@
+import os
 from typing import List
-from sentence_transformers import SentenceTransformer
+from modules.local_embedder import LocalEmbedder
 
 # model = SentenceTransformer('intfloat/multilingual-e5-large-instruct')
-model = SentenceTransformer("BAAI/bge-m3")
+# bge-m3 dense vectors are the normalized CLS state. The model is loaded on the first call;
+# LOCAL_EMBEDDER_ONNX can point to an export made with `python -m modules.local_embedder export`.
+model = LocalEmbedder("BAAI/bge-m3", pooling="cls", max_length=8192, onnx_path=os.getenv("LOCAL_EMBEDDER_ONNX"))
 
 
 def get_embeddings(texts: List[str]):
-    return model.encode(texts, normalize_embeddings=True, show_progress_bar=False, convert_to_numpy=True)
\ No newline at end of file
+    return model.encode(texts)
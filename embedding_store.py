@@ -0,0 +1,222 @@
+import os
+import json
+import logging
+import argparse
+from typing import Any, Dict, Hashable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+
+# On-disk layout of an embedding store directory:
+#   vectors.npy  - (rows, dimension) float32 or float16 matrix, memory-mapped on read
+#   texts.bin    - UTF-8 texts of all rows, concatenated
+#   offsets.npy  - (rows + 1,) int64 byte offsets of the texts in texts.bin
+#   meta.json    - dimension, dtype and one record per entry: its first row and chunk keys
+# Every entry occupies consecutive rows: name, introduction, then its chunks in order.
+VECTORS_FILE = "vectors.npy"
+TEXTS_FILE = "texts.bin"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "meta.json"
+# Vectors are appended here while writing and moved into vectors.npy on close
+RAW_VECTORS_FILE = "vectors.raw"
+FORMAT_VERSION = 1
+# Rows copied at a time from the raw file into vectors.npy
+COPY_ROWS = 65536
+
+NAME = "name"
+INTRODUCTION = "introduction"
+
+
+class EmbeddingStoreWriter:
+    def __init__(self, path: str, dimension: int, dtype: str = "float32"):
+        self.path = path
+        self.dimension = dimension
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.entries: List[Dict[str, Any]] = []
+        self._offsets = [0]
+        os.makedirs(path, exist_ok=True)
+        self._texts = open(os.path.join(path, TEXTS_FILE), "wb")
+        self._vectors = open(os.path.join(path, RAW_VECTORS_FILE), "wb")
+
+    def _add_rows(self, texts: Sequence[str], embeddings: Sequence[Sequence[float]]):
+        block = np.asarray(embeddings, dtype=self.dtype).reshape(-1, self.dimension)
+        if len(block) != len(texts):
+            raise ValueError(f"Got {len(texts)} texts and {len(block)} embeddings")
+        self._vectors.write(block.tobytes())
+        for text in texts:
+            encoded = text.encode("utf-8")
+            self._texts.write(encoded)
+            self._offsets.append(self._offsets[-1] + len(encoded))
+        self.rows += len(texts)
+
+    # Append one entry in the chunk_data output shape: {"name": {"text", "embedding"}, "introduction": ..., "chunks": {key: ...}}
+    def add(self, entry: Dict[str, Any]):
+        chunk_keys = list(entry["chunks"])
+        parts = [entry[NAME], entry[INTRODUCTION]] + [entry["chunks"][key] for key in chunk_keys]
+        self.entries.append({"start": self.rows, "chunks": chunk_keys})
+        self._add_rows([part["text"] for part in parts], [part["embedding"] for part in parts])
+
+    # The .npy header needs the row count, so the raw vectors are copied in behind it a slice at a time
+    def _write_vectors(self):
+        raw_path = os.path.join(self.path, RAW_VECTORS_FILE)
+        vectors_path = os.path.join(self.path, VECTORS_FILE)
+        if not self.rows:
+            # np.memmap cannot map an empty file
+            np.save(vectors_path, np.empty((0, self.dimension), dtype=self.dtype))
+        else:
+            vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=self.dtype, shape=(self.rows, self.dimension))
+            raw = np.memmap(raw_path, dtype=self.dtype, mode="r", shape=(self.rows, self.dimension))
+            for start in range(0, self.rows, COPY_ROWS):
+                vectors[start:start + COPY_ROWS] = raw[start:start + COPY_ROWS]
+            vectors.flush()
+            del raw, vectors
+        os.remove(raw_path)
+
+    def close(self):
+        self._texts.close()
+        self._vectors.close()
+        self._write_vectors()
+        np.save(os.path.join(self.path, OFFSETS_FILE), np.asarray(self._offsets, dtype=np.int64))
+        with open(os.path.join(self.path, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"version": FORMAT_VERSION, "dimension": self.dimension, "dtype": self.dtype.name,
+                       "rows": self.rows, "entries": self.entries}, f, ensure_ascii=False)
+        logging.info(f"Wrote {len(self.entries)} entries ({self.rows} rows) to {self.path}")
+
+    def __enter__(self) -> "EmbeddingStoreWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# Lazy reader. Vectors and texts are memory-mapped, nothing is decoded until it is asked for.
+class EmbeddingStore:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.dimension: int = meta["dimension"]
+        self.dtype = np.dtype(meta["dtype"])
+        self.entries: List[Dict[str, Any]] = meta["entries"]
+        self.vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        texts_path = os.path.join(path, TEXTS_FILE)
+        # np.memmap cannot map an empty file
+        self._texts = np.memmap(texts_path, dtype=np.uint8, mode="r") if os.path.getsize(texts_path) else np.empty(0, np.uint8)
+        self._ids: Optional[List[Tuple[int, str]]] = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    @property
+    def rows(self) -> int:
+        return len(self.vectors)
+
+    def text(self, row: int) -> str:
+        return self._texts[self.offsets[row]:self.offsets[row + 1]].tobytes().decode("utf-8")
+
+    def row_keys(self, entry_index: int) -> List[str]:
+        return [NAME, INTRODUCTION] + self.entries[entry_index]["chunks"]
+
+    def row(self, entry_index: int, key: str) -> int:
+        record = self.entries[entry_index]
+        if key == NAME:
+            return record["start"]
+        if key == INTRODUCTION:
+            return record["start"] + 1
+        return record["start"] + 2 + record["chunks"].index(key)
+
+    # (entry index, key) of every row, the ids used by the local search
+    def ids(self) -> List[Tuple[int, str]]:
+        if self._ids is None:
+            self._ids = [(i, key) for i in range(len(self.entries)) for key in self.row_keys(i)]
+        return self._ids
+
+    # Boolean mask over the rows with the given keys ("name", "introduction" or "chunk")
+    def kind_mask(self, kinds: Sequence[str] = (INTRODUCTION, "chunk")) -> np.ndarray:
+        mask = np.zeros(self.rows, dtype=bool)
+        for record in self.entries:
+            start = record["start"]
+            mask[start] = NAME in kinds
+            mask[start + 1] = INTRODUCTION in kinds
+            mask[start + 2:start + 2 + len(record["chunks"])] = "chunk" in kinds
+        return mask
+
+    # One entry in the chunk_data output shape; embeddings are views into the memory map
+    def entry(self, entry_index: int, with_embeddings: bool = False) -> Dict[str, Any]:
+        def part(key: str) -> Dict[str, Any]:
+            row = self.row(entry_index, key)
+            value = {"text": self.text(row)}
+            if with_embeddings:
+                value["embedding"] = self.vectors[row]
+            return value
+        return {
+            NAME: part(NAME),
+            INTRODUCTION: part(INTRODUCTION),
+            "chunks": {key: part(key) for key in self.entries[entry_index]["chunks"]},
+        }
+
+    def iter_entries(self, with_embeddings: bool = False) -> Iterator[Dict[str, Any]]:
+        for i in range(len(self.entries)):
+            yield self.entry(i, with_embeddings)
+
+    # LocalIndex over all rows. Unit-length float32 vectors (OpenAI and Voyage embeddings) are searched
+    # straight from the memory map, anything else is normalized into a float32 copy first.
+    def local_index(self):
+        from real_shit.local_index import LocalIndex
+        if self.dtype == np.float32 and self.rows:
+            norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+            if np.allclose(norms, 1.0, atol=1e-3):
+                return LocalIndex(self.dimension, self.vectors, list(self.ids()))
+        return LocalIndex.from_vectors(self.vectors, self.ids())
+
+
+# The files written by chunk_data: JSON with a list of entries or {"data": [...]} (save_to_json), or
+# JSONL with one {"index", "entry"} record per line (process_file_parallel), read a line at a time
+def _load_json_entries(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8-sig") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)["entry"]
+            return
+        data = json.load(f)
+    yield from data["data"] if isinstance(data, dict) else data
+
+
+def convert_json_dir(src_dir: str, dst_dir: Optional[str] = None, dtype: str = "float32") -> str:
+    dst_dir = dst_dir or f"{src_dir.rstrip(os.sep)}.store"
+    filenames = sorted(f for f in os.listdir(src_dir) if f.endswith((".json", ".jsonl")))
+    writer = None
+    for filename in filenames:
+        # One entry in memory at a time, the writer streams rows to disk
+        for entry in _load_json_entries(os.path.join(src_dir, filename)):
+            if writer is None:
+                writer = EmbeddingStoreWriter(dst_dir, len(entry[NAME]["embedding"]), dtype)
+            writer.add(entry)
+        logging.info(f"Converted {filename}")
+    if writer is None:
+        raise ValueError(f"No entries found in {src_dir}")
+    writer.close()
+    return dst_dir
+
+
+# Open the store of a db directory, converting the JSON files on first use
+def load_store(db_dir: str, dtype: str = "float32") -> EmbeddingStore:
+    store_dir = db_dir if os.path.exists(os.path.join(db_dir, META_FILE)) else f"{db_dir.rstrip(os.sep)}.store"
+    if not os.path.exists(os.path.join(store_dir, META_FILE)):
+        convert_json_dir(db_dir, store_dir, dtype)
+    return EmbeddingStore(store_dir)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Convert db/db_* JSON embedding directories to embedding stores")
+    parser.add_argument("src", nargs="+", help="JSON directories, e.g. db/db_openai_large_8000")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32",
+                        help="float16 halves the size, float32 is searched without a conversion copy")
+    parser.add_argument("--output", help="output directory (only with a single source)")
+    args = parser.parse_args()
+    if args.output and len(args.src) > 1:
+        parser.error("--output needs a single source directory")
+    for src in args.src:
+        print(f"{src} -> {convert_json_dir(src, args.output, args.dtype)}")
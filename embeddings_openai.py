@@ -4,25 +4,22 @@ import json
 from dotenv import load_dotenv
 from tqdm import tqdm
 import numpy as np
+from real_shit.embeddings.cache import cached_embed
 load_dotenv()
 
 api_key = os.getenv("OPENAI_API_KEY")
 client = openai.Client(api_key=api_key)
 
 
+def _embed(text, model, dimension):
+    return cached_embed(model, dimension, None, text,
+                        lambda missing: [item.embedding for item in client.embeddings.create(input=missing, model=model).data])
+
 def embed_small(text):
-    response = client.embeddings.create(
-        input=text,
-        model="text-embedding-3-small"
-    )
-    return response.data[0].embedding
+    return _embed(text, "text-embedding-3-small", 1536)
 
 def embed_large(text):
-    response = client.embeddings.create(
-        input=text,
-        model="text-embedding-3-large"
-    )
-    return response.data[0].embedding
+    return _embed(text, "text-embedding-3-large", 3072)
 
 def load_from_json(filename):
     return json.load(open(filename, 'r', encoding='utf-8-sig'))
@@ -31,21 +31,27 @@ data_text = load_from_json('laws.json')
 
 # save_to_json(embeddings_dict, 'embeddings_seznam.json')
 
-results = []
+from real_shit.local_index import LocalIndex
+
 query = 'Napiš mi, v jakém předpise a paragrafu je upravena výpověď a jaká je dle českého práva výpovědní doba.'
 query_dict = tokenizer(query, max_length=512,
                                padding=True, truncation=True, return_tensors='pt')
 outputs = model(**query_dict)
-embedded_query = outputs.last_hidden_state[:, 0][0]
-embedded_query_tra = embedded_query.detach().numpy().T
+embedded_query = outputs.last_hidden_state[:, 0][0].detach().numpy()
 data_emb = load_from_json('embeddings_seznam.json')
+
+# All sub-key embeddings in one normalized matrix, searched with a single matrix product
+vectors = []
+ids = []
 for key_emb, key_text in zip(data_emb, data_text):
     for sub_emb, sub_text in zip(data_emb[key_emb], data_text[key_text]):
-        score = (np.array(data_emb[key_emb][sub_emb]) @ embedded_query_tra) / (np.linalg.norm(np.array(data_emb[key_emb][sub_emb])) * np.linalg.norm(embedded_query.detach().numpy()))
-        results.append((score, data_text[key_text][sub_text], sub_text))
+        vectors.append(data_emb[key_emb][sub_emb])
+        ids.append((key_text, sub_text))
+index = LocalIndex.from_vectors(vectors, ids)
 
-sorted_results = sorted(results, key=lambda x: x[0], reverse=True)
+sorted_results = [(score, data_text[key_text][sub_text], sub_text)
+                  for (key_text, sub_text), score in index.search(embedded_query, 10)]
 
 # Optionally, to see or use the sorted results:
 for score, text, mark in sorted_results[:10]:
-    print(f'Score: {score:.5f}, mark: {mark}')  
\ No newline at end of file
+    print(f'Score: {score:.5f}, mark: {mark}')
@@ -1,12 +1,15 @@
-import requests
+import sys
 import json
 import os
-import re
+import asyncio
 from typing import Any, List
 from pydantic import BaseModel
-from pymongo import MongoClient
 from datetime import datetime
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "real_shit"))
+from esbirka import EsbirkaClient, fetch_laws, sign_from_link
+from mongo_writer import BulkWriter, ensure_paragraph_indexes, get_mongo_client
+
 class Paragraf(BaseModel):
     cislo: str
     zneni: str
@@ -24,85 +27,51 @@ class Laws(BaseModel):
     laws: List[Law]
 
 def save_paragraphs_to_mongodb(paragraphs: List[Paragraf], collection_name: str, db_name="law_database"):
-    client = MongoClient("mongodb://localhost:27017/")
+    client = get_mongo_client()
     db = client[db_name]
     collection = db[collection_name + "_v2"]
-    for paragraf in paragraphs:
-        collection.update_one(
-            {"staleURL": paragraf.staleURL, "cislo": paragraf.cislo},
-            {"$set": paragraf.model_dump()},
-            upsert=True
-        )
+    ensure_paragraph_indexes(collection)
+    # One upsert per (staleURL, cislo), the last occurrence wins as it did with one update_one each:
+    # the bulk writes are unordered, repeated keys would leave an arbitrary text
+    by_key = {(paragraf.staleURL, paragraf.cislo): paragraf for paragraf in paragraphs}
+    with BulkWriter(collection) as writer:
+        for (staleURL, cislo), paragraf in by_key.items():
+            writer.upsert({"staleURL": staleURL, "cislo": cislo}, paragraf.model_dump())
 
 def load_from_json(filename: str) -> Any:
     with open(filename, 'r', encoding='utf-8-sig') as f:
         data = json.load(f)
     return data['data']
 
-def get_laws(dir_name: str):
-    num_pattern = r'\d+'
-    text_pattern = r'<[^>]+>'
-    headers = {"esel-api-access-key": "0zIAcHQyAcqhlxxExaJqjsAeiZaocXgVKifkIAtuuzqgtmwgclGDCQbtsyovsBIij"}
+async def _get_laws(dir_name: str, concurrency: int, rate_limit: float, transport=None):
     files = os.listdir("../data")
-    for file_num, file in enumerate(files):
-        data = load_from_json(f"../data/{file}")
-        field = file.removesuffix(".json")
-        paragraphs = []
-        for law_num, law_data in enumerate(data):
-            print(f"processing {file_num+1}/{len(files)}: {law_num+1}/{len(data)}", end="\r")
-            sign = law_data['link']
-            val = sign.split('/')[-1]
-            sign = val.split('-')
-            sign = "%2Fsb%2F"+sign[0]+"%2F"+sign[1]+"%2F0000-00-00"
-            try:
-                res = requests.get("https://api.e-sbirka.cz/dokumenty-sbirky/"+sign, headers=headers).json()
-            except Exception as e:
-                print(f"Failed to fetch law details for {sign}")
-                continue
-            if res.get('nazev') is None:
-                continue
-            nazev = res['nazev']
-            staleURL = res['staleUrl']
-            datumZruseni = res.get('datumZruseni')
-            is_valid = datumZruseni is None or datetime.strptime(datumZruseni, "%Y-%m-%d") > datetime.now()
-            for i in range(50):
-                response = requests.get("https://api.e-sbirka.cz/dokumenty-sbirky/"+sign+"/fragmenty?cisloStranky="+str(i), headers=headers).json()
-                if response.get('chyby') is not None:
-                    break
-                fragments = response['seznam']
-                current_paragraph_number = None
-                current_paragraph_text = ""
-                for fragment in fragments:
-                    if fragment['kodTypuFragmentu'] == 'Paragraf':
-                        if current_paragraph_number is not None:
-                            # Save the current paragraph before starting a new one
-                            paragraphs.append(Paragraf(
-                                cislo=current_paragraph_number,
-                                zneni=current_paragraph_text.strip(),
-                                staleURL=staleURL,
-                                isValid=is_valid,
-                                law_name=nazev
-                            ))
-                        # Start a new paragraph
-                        match = re.search(num_pattern, fragment['xhtml'])
-                        if match is None:
-                            raise ValueError("Paragraf number not found")
-                        current_paragraph_number = match.group()
-                        current_paragraph_text = ""
-                    else:
-                        # Append fragment text to the current paragraph
-                        cleaned_text = re.sub(text_pattern, '', fragment.get('xhtml', ''))
-                        current_paragraph_text += cleaned_text + "\n"
-                # Save the last paragraph if it exists
-                if current_paragraph_number is not None:
+    async with EsbirkaClient(concurrency=concurrency, rate_limit=rate_limit, transport=transport) as client:
+        for file_num, file in enumerate(files):
+            data = load_from_json(f"../data/{file}")
+            field = file.removesuffix(".json")
+            print(f"processing {file_num+1}/{len(files)}: {len(data)} laws")
+            results = await fetch_laws([sign_from_link(law_data['link']) for law_data in data], client)
+            paragraphs = []
+            for result in results:
+                if result is None:
+                    continue
+                res = result['detail']
+                nazev = res['nazev']
+                staleURL = res['staleUrl']
+                datumZruseni = res.get('datumZruseni')
+                is_valid = datumZruseni is None or datetime.strptime(datumZruseni, "%Y-%m-%d") > datetime.now()
+                for cislo, zneni in result['paragraphs']:
                     paragraphs.append(Paragraf(
-                        cislo=current_paragraph_number,
-                        zneni=current_paragraph_text.strip(),
+                        cislo=cislo,
+                        zneni=zneni,
                         staleURL=staleURL,
                         isValid=is_valid,
                         law_name=nazev
                     ))
-        save_paragraphs_to_mongodb(paragraphs, field)
+            save_paragraphs_to_mongodb(paragraphs, field)
+
+def get_laws(dir_name: str, concurrency: int = 16, rate_limit: float = 20.0, transport=None):
+    asyncio.run(_get_laws(dir_name, concurrency, rate_limit, transport))
 
 if __name__ == '__main__':
     output_dir = "../open_data/laws"
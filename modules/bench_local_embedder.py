@@ -0,0 +1,78 @@
+# Throughput of the local embedding engine on the paragraph length distribution of the corpus:
+# fixed input-order batches (the old get_embeddings) against length-bucketed token-budget batches,
+# with torch or an exported ONNX model.
+# Run from the repository root:
+#   python -m modules.bench_local_embedder --store db_store --texts 2000
+#   python -m modules.bench_local_embedder --onnx models/bge-m3-int8 --workers 1 2 4
+import json
+import time
+import random
+import argparse
+import logging
+from typing import List
+import numpy as np
+from modules.local_embedder import LocalEmbedder
+
+WORDS = ["zákon", "odstavec", "povinnost", "smlouva", "společnost", "nájem", "pacht", "odpad", "daň", "příjem",
+         "zaměstnavatel", "dohoda", "lhůta", "soud", "řízení", "správní", "orgán", "osoba", "právo", "věc"]
+
+
+# Texts of the paragraph chunks of an embedding store (see embedding_store.py), sampled
+def store_texts(path: str, count: int, seed: int = 0) -> List[str]:
+    from embedding_store import EmbeddingStore
+    store = EmbeddingStore(path)
+    rows = np.flatnonzero(store.kind_mask(("chunk",)))
+    rows = np.random.default_rng(seed).choice(rows, size=min(count, len(rows)), replace=False)
+    return [store.text(int(row)) for row in rows]
+
+
+def synthetic_texts(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    # Paragraph lengths roughly follow the long-tailed distribution of the corpus
+    return [" ".join(rng.choice(WORDS) for _ in range(max(min(int(rng.lognormvariate(4.5, 0.9)), 4000), 5)))
+            for _ in range(count)]
+
+
+def run(embedder: LocalEmbedder, texts: List[str]) -> dict:
+    embedder.encode(texts[:8])
+    embedder.tokens = embedder.padded_tokens = 0
+    start = time.perf_counter()
+    embedder.encode(texts)
+    elapsed = time.perf_counter() - start
+    return {
+        "texts_per_second": round(len(texts) / elapsed, 1),
+        "tokens_per_second": round(embedder.tokens / elapsed, 1),
+        # Share of the computed positions that were real tokens, not padding
+        "padding_efficiency": round(embedder.tokens / max(embedder.padded_tokens, 1), 3),
+        "seconds": round(elapsed, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="BAAI/bge-m3")
+    parser.add_argument("--pooling", default="cls")
+    parser.add_argument("--onnx", help="Directory of an exported ONNX model")
+    parser.add_argument("--store", help="Embedding store to sample paragraph texts from, synthetic texts otherwise")
+    parser.add_argument("--texts", type=int, default=1000)
+    parser.add_argument("--max-length", type=int, default=4096)
+    parser.add_argument("--max-batch-tokens", type=int, default=16_384)
+    parser.add_argument("--batch-size", type=int, default=32, help="Batch size of the fixed batches")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    texts = store_texts(args.store, args.texts) if args.store else synthetic_texts(args.texts)
+    results = []
+    for workers in args.workers:
+        for bucketing in (False, True):
+            embedder = LocalEmbedder(args.model, pooling=args.pooling, max_length=args.max_length, onnx_path=args.onnx,
+                                     max_batch_tokens=args.max_batch_tokens,
+                                     max_batch_size=args.batch_size if not bucketing else 64,
+                                     workers=workers, bucketing=bucketing)
+            result = {"workers": workers, "batching": "bucketed" if bucketing else "fixed", **run(embedder, texts)}
+            embedder.close()
+            results.append(result)
+            print(f"{result['batching']:>8} workers={workers}: {result['texts_per_second']} texts/s, "
+                  f"{result['tokens_per_second']} tokens/s, padding efficiency {result['padding_efficiency']}")
+    print(json.dumps(results, indent=4))
@@ -0,0 +1,224 @@
+# Local embedding engine for CPU-only nodes. Texts are tokenized once, sorted by length and cut
+# into batches whose padded size (batch size x longest text) stays under a token budget, so a long
+# paragraph no longer pads a whole batch of short ones. Batches run on a thread pool (torch and
+# onnxruntime release the GIL), hidden states are pooled with the attention mask and the vectors
+# are returned in input order. The model is loaded on first use.
+#
+# Same interface as the embedders in real_shit/embeddings/embedders.py (dimension, max_batch_size,
+# max_batch_tokens, count_tokens, embed), so it can back CachedEmbedder and the ingest pipeline.
+#
+# An exported ONNX model, optionally int8-quantized, runs without torch:
+#   python -m modules.local_embedder export BAAI/bge-m3 models/bge-m3-int8 --quantize
+import os
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Sequence
+import numpy as np
+
+POOLINGS = ("mean", "cls", "last")
+DEFAULT_MAX_LENGTH = 4096
+# Padded tokens of one forward pass, the main knob for CPU memory and cache efficiency
+DEFAULT_MAX_BATCH_TOKENS = 16_384
+DEFAULT_MAX_BATCH_SIZE = 64
+ONNX_MODEL_FILE = "model.onnx"
+
+
+# Batches of positions into `lengths` (sorted ascending) whose padded size stays under max_batch_tokens.
+# A text longer than the budget gets a batch of its own.
+def length_buckets(lengths: Sequence[int], max_batch_tokens: int, max_batch_size: int) -> Iterator[List[int]]:
+    batch: List[int] = []
+    for i, length in enumerate(lengths):
+        # Sorted input: the new text is the longest of the batch and sets its padded width
+        if batch and ((len(batch) + 1) * length > max_batch_tokens or len(batch) >= max_batch_size):
+            yield batch
+            batch = []
+        batch.append(i)
+    if batch:
+        yield batch
+
+
+def pool(hidden: np.ndarray, attention_mask: np.ndarray, pooling: str = "mean") -> np.ndarray:
+    if pooling == "cls":
+        return hidden[:, 0]
+    if pooling == "last":
+        # Last real token of every row, padding may be on either side
+        last = attention_mask.shape[1] - 1 - np.argmax(attention_mask[:, ::-1], axis=1)
+        return hidden[np.arange(hidden.shape[0]), last]
+    mask = attention_mask[..., None].astype(hidden.dtype)
+    return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1.0, None)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.clip(norms, 1e-12, None)
+
+
+class LocalEmbedder:
+    def __init__(self, model_name: str = "BAAI/bge-m3", pooling: str = "cls", max_length: int = DEFAULT_MAX_LENGTH,
+                 max_batch_tokens: int = DEFAULT_MAX_BATCH_TOKENS, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 onnx_path: Optional[str] = None, workers: int = 2, device: str = "cpu", dtype: Optional[str] = None,
+                 query_prefix: str = "", bucketing: bool = True, trust_remote_code: bool = False):
+        if pooling not in POOLINGS:
+            raise ValueError(f"Unknown pooling {pooling}, expected one of {POOLINGS}")
+        self.model = model_name
+        self.pooling = pooling
+        self.max_length = max_length
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.onnx_path = onnx_path
+        self.workers = workers
+        self.device = device
+        self.dtype = dtype
+        self.query_prefix = query_prefix
+        # Off: batches of max_batch_size in input order, padded to their longest text (for comparison)
+        self.bucketing = bucketing
+        self.trust_remote_code = trust_remote_code
+        self._tokenizer = None
+        self._model = None
+        self._session = None
+        self._dimension: Optional[int] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        # Real and padded tokens of everything embedded so far
+        self.tokens = 0
+        self.padded_tokens = 0
+
+    def _load(self):
+        with self._lock:
+            if self._tokenizer is not None:
+                return
+            from transformers import AutoTokenizer
+            tokenizer_path = self.onnx_path or self.model
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer_path, trust_remote_code=self.trust_remote_code)
+            if self.onnx_path:
+                import onnxruntime
+                options = onnxruntime.SessionOptions()
+                # The thread pool runs the batches in parallel, split the cores between them
+                options.intra_op_num_threads = max(1, (os.cpu_count() or 1) // self.workers)
+                self._session = onnxruntime.InferenceSession(os.path.join(self.onnx_path, ONNX_MODEL_FILE), options,
+                                                             providers=["CPUExecutionProvider"])
+            else:
+                import torch
+                from transformers import AutoModel
+                torch.set_num_threads(max(1, (os.cpu_count() or 1) // self.workers))
+                if self.device == "auto":
+                    self.device = "mps" if torch.backends.mps.is_available() else "cpu"
+                    # FP16 on the GPU, the CPU keeps FP32
+                    self.dtype = self.dtype or ("float16" if self.device == "mps" else None)
+                model = AutoModel.from_pretrained(self.model, trust_remote_code=self.trust_remote_code)
+                model = model.to(device=self.device, dtype=getattr(torch, self.dtype) if self.dtype else None)
+                self._model = model.eval()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="local-embed")
+            self._tokenizer = tokenizer
+            logging.info(f"Loaded {self.onnx_path or self.model} ({'onnx' if self.onnx_path else self.device})")
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._load()
+        return self._tokenizer
+
+    @property
+    def dimension(self) -> int:
+        if self._dimension is None:
+            self._dimension = int(self.encode(["dimenze"]).shape[1])
+        return self._dimension
+
+    def _token_ids(self, texts: List[str]) -> List[List[int]]:
+        return self.tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        return [len(ids) for ids in self._token_ids(texts)]
+
+    def _forward(self, batch_ids: List[List[int]]) -> np.ndarray:
+        width = max(len(ids) for ids in batch_ids)
+        pad_id = self.tokenizer.pad_token_id or 0
+        input_ids = np.full((len(batch_ids), width), pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(batch_ids), width), dtype=np.int64)
+        for row, ids in enumerate(batch_ids):
+            input_ids[row, :len(ids)] = ids
+            attention_mask[row, :len(ids)] = 1
+        if self._session is not None:
+            hidden = self._session.run(None, {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+        else:
+            import torch
+            with torch.inference_mode():
+                outputs = self._model(input_ids=torch.from_numpy(input_ids).to(self.device),
+                                      attention_mask=torch.from_numpy(attention_mask).to(self.device))
+                hidden = outputs.last_hidden_state.float().cpu().numpy()
+        return pool(hidden.astype(np.float32), attention_mask, self.pooling)
+
+    def _batches(self, lengths: List[int]) -> List[List[int]]:
+        if not self.bucketing:
+            return [list(range(start, min(start + self.max_batch_size, len(lengths))))
+                    for start in range(0, len(lengths), self.max_batch_size)]
+        order = sorted(range(len(lengths)), key=lengths.__getitem__)
+        return [[order[i] for i in bucket]
+                for bucket in length_buckets([lengths[i] for i in order], self.max_batch_tokens, self.max_batch_size)]
+
+    # (len(texts), dimension) float32 unit vectors in input order
+    def encode(self, texts: List[str], input_type: str = "document") -> np.ndarray:
+        if input_type == "query" and self.query_prefix:
+            texts = [self.query_prefix + text for text in texts]
+        token_ids = self._token_ids(texts)
+        lengths = [len(ids) for ids in token_ids]
+        batches = self._batches(lengths)
+        results = self._executor.map(lambda batch: self._forward([token_ids[i] for i in batch]), batches)
+        vectors = None
+        for batch, pooled in zip(batches, results):
+            if vectors is None:
+                vectors = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            vectors[batch] = pooled
+            self.padded_tokens += len(batch) * max(lengths[i] for i in batch)
+        self.tokens += sum(lengths)
+        if vectors is None:
+            return np.empty((0, self._dimension or 0), dtype=np.float32)
+        return normalize(vectors)
+
+    def embed(self, texts: List[str], input_type: str = "document") -> List[List[float]]:
+        return self.encode(texts, input_type).tolist()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+# Export a Hugging Face encoder to ONNX next to its tokenizer, with dynamic batch and sequence axes.
+# --quantize adds dynamic int8 quantization of the weights, about 4x smaller and faster on CPU.
+def export_onnx(model_name: str, output_dir: str, quantize: bool = False, trust_remote_code: bool = False):
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=trust_remote_code)
+    model = AutoModel.from_pretrained(model_name, trust_remote_code=trust_remote_code).eval()
+    sample = tokenizer(["vzorový text"], return_tensors="pt")
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    export_path = f"{model_path}.fp32" if quantize else model_path
+    dynamic_axes = {"input_ids": {0: "batch", 1: "sequence"}, "attention_mask": {0: "batch", 1: "sequence"},
+                    "last_hidden_state": {0: "batch", 1: "sequence"}}
+    with torch.inference_mode():
+        torch.onnx.export(model, (sample["input_ids"], sample["attention_mask"]), export_path,
+                          input_names=["input_ids", "attention_mask"], output_names=["last_hidden_state"],
+                          dynamic_axes=dynamic_axes, opset_version=17)
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(export_path, model_path, weight_type=QuantType.QInt8)
+        os.remove(export_path)
+    tokenizer.save_pretrained(output_dir)
+    logging.info(f"Exported {model_name} to {model_path}{' (int8)' if quantize else ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export = subparsers.add_parser("export")
+    export.add_argument("model")
+    export.add_argument("output_dir")
+    export.add_argument("--quantize", action="store_true")
+    export.add_argument("--trust-remote-code", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "export":
+        export_onnx(args.model, args.output_dir, quantize=args.quantize, trust_remote_code=args.trust_remote_code)
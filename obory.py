@@ -1,33 +1,16 @@
-from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.common.exceptions import InvalidArgumentException, WebDriverException, NoSuchElementException
-from selenium.webdriver.support.ui import Select
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.action_chains import ActionChains
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pydantic import BaseModel
-from time import sleep
-from typing import List, Dict
+from typing import Any, Dict, List
 from datetime import datetime
+import argparse
 import json
 import logging
 import os
-
-# Set up Selenium WebDriver
-options = webdriver.ChromeOptions()
-options.add_argument("--window-size=1080,1920")
-options.add_argument("--disable-extensions")
-options.add_argument("--proxy-server='direct://'")
-options.add_argument("--proxy-bypass-list=*")
-options.add_argument("--start-maximized")
-options.add_argument('--headless')
-options.add_argument('--disable-gpu')
-options.add_argument('--disable-dev-shm-usage')
-options.add_argument('--no-sandbox')
-options.add_argument('--ignore-certificate-errors')
+from crawl_common import DriverPool, JsonlWriter, WAIT_TIMEOUT
 
 
 logging.basicConfig(
@@ -36,6 +19,31 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'  # Log message format
 )
 
+LISTING_URL = 'https://www.zakonyprolidi.cz/obor/{obor}'
+TABLE_SELECTOR = '#Main > div.pg-body > div.PageMain > div > div.ContentBody > div.Paper > div.PdMain > table > tbody'
+FRAGS_XPATH = "//*[@id='idBody_idCtn']/div[@class='Frags']"
+# The first elements of the text form the introduction of a law
+INTRODUCTION_ELEMENTS = 12
+
+# All rows of the listing in one round trip instead of re-querying the table for every law
+ROWS_JS = """
+return Array.from(document.querySelectorAll(arguments[0] + ' tr'))
+    .filter(tr => tr.querySelector('td.c1 > a'))
+    .map(tr => ({link: tr.querySelector('td.c1 > a').href,
+                 name: tr.querySelector('td.c2').innerText,
+                 effect: tr.querySelector('td.c3').innerText}));
+"""
+# Tag and text of every element of the law text, in document order
+FRAGS_JS = """
+const result = document.evaluate(arguments[0], document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+const items = [];
+for (let i = 0; i < result.snapshotLength; i++) {
+    const element = result.snapshotItem(i);
+    items.push([element.tagName.toLowerCase(), element.innerText]);
+}
+return items;
+"""
+
 
 class LawDetail(BaseModel):
     introduction: str
@@ -58,60 +66,90 @@ def log_to_file(message):
         file.write(message + '\n')
 
 
-count_requests = 0
+# Name, effect and link of every law of a field, from one load of the listing
+def fetch_law_links(driver, obor: str) -> List[Dict[str, str]]:
+    driver.get(LISTING_URL.format(obor=obor))
+    table = WebDriverWait(driver, WAIT_TIMEOUT).until(EC.presence_of_element_located((By.CSS_SELECTOR, TABLE_SELECTOR)))
+    # Show 200 laws per page, the postback re-renders the table
+    driver.execute_script("__doPostBack('X$idBody$Grid', 'SIZE200');")
+    try:
+        WebDriverWait(driver, WAIT_TIMEOUT).until(EC.staleness_of(table))
+    except TimeoutException:
+        logging.warning(f"Listing of {obor} was not re-rendered, reading the current page")
+    WebDriverWait(driver, WAIT_TIMEOUT).until(EC.presence_of_element_located((By.CSS_SELECTOR, TABLE_SELECTOR)))
+    return driver.execute_script(ROWS_JS, TABLE_SELECTOR)
+
+
+def fetch_law_detail(driver, link: str) -> LawDetail:
+    driver.get(link)
+    WebDriverWait(driver, WAIT_TIMEOUT).until(EC.presence_of_element_located((By.XPATH, FRAGS_XPATH)))
+    items = driver.execute_script(FRAGS_JS, f"{FRAGS_XPATH}//*")
+    introduction = '\n'.join([text for _, text in items[:INTRODUCTION_ELEMENTS]])
+    description = '\n'.join([text for tag, text in items[INTRODUCTION_ELEMENTS:] if tag != 'h4'])
+    return LawDetail(introduction=introduction, description=description)
+
+
+def fetch_law(pool: DriverPool, row: Dict[str, str]) -> Law:
+    with pool.driver() as driver:
+        detail = fetch_law_detail(driver, row['link'])
+    return Law(name=row['name'], effect=row['effect'], link=row['link'], detail=detail)
+
+
+# One law per line keyed by its link, written as soon as it is fetched. Laws already in the file are not
+# fetched again; a line cut short by a crash is dropped by JsonlWriter before anything is appended.
+class LawWriter(JsonlWriter):
+    def __init__(self, path: str):
+        super().__init__(path, key='link')
+        self.laws: Dict[str, Law] = {}
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    law = Law(**json.loads(line))
+                    self.laws[law.link] = law
+
+    def write(self, law: Law):
+        super().write(law.dict())
+        self.file.flush()
+        self.laws[law.link] = law
+
+
+def fetch_field(pool: DriverPool, obor: str, workers: int) -> List[Law]:
+    with pool.driver() as driver:
+        rows = fetch_law_links(driver, obor)
+    os.makedirs('data', exist_ok=True)
+    writer = LawWriter(os.path.join('data', f'{obor}.jsonl'))
+    pending = [row for row in rows if row['link'] not in writer.laws]
+    print(f"{obor}: {len(rows)} laws, {len(rows) - len(pending)} already fetched")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fetch_law, pool, row): row for row in pending}
+            for future in as_completed(futures):
+                try:
+                    law = future.result()
+                except Exception as e:
+                    logging.error(f"Failed to fetch {futures[future]['link']}: {e}")
+                    continue
+                writer.write(law)
+                now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+                law_intro_stripped = law.detail.introduction.replace('\n', '')
+                log_to_file(f"{now} - Field: {obor.capitalize()}, Processed law: {law.name}, Link: {law.link}, Intro: {law_intro_stripped}")
+    finally:
+        writer.close()
+    # Listing order, laws that failed are left out until the next run
+    return [writer.laws[row['link']] for row in rows if row['link'] in writer.laws]
 
 
-def fetch_data():
-    driver = webdriver.Chrome(service=Service(
-        ChromeDriverManager().install()), options=options)
-    obory = ['koronavirus']
+def fetch_data(obory: List[str] = ('koronavirus',), browsers: int = 4):
+    pool = DriverPool(browsers)
     try:
         for obor in obory:
-            count_requests = 0
-            data = []
-            driver.get(f'https://www.zakonyprolidi.cz/obor/{obor}')
-            driver.execute_script("__doPostBack('X$idBody$Grid', 'SIZE200');")
-            sleep(3)  # Wait for the page and JavaScript to fully load
-            table_selector = '#Main > div.pg-body > div.PageMain > div > div.ContentBody > div.Paper > div.PdMain > table > tbody'
-
-            for i in range(len(driver.find_elements(By.CSS_SELECTOR, f"{table_selector} tr"))):
-                tr_elements = driver.find_elements(
-                    By.CSS_SELECTOR, f"{table_selector} tr")
-                tr = tr_elements[i]
-
-                anchor_element = tr.find_element(By.CSS_SELECTOR, "td.c1 > a")
-                link = anchor_element.get_attribute("href")
-                name = tr.find_element(By.CSS_SELECTOR, "td.c2").text
-                effect = tr.find_element(By.CSS_SELECTOR, "td.c3").text
-
-                driver.get(link)
-                sleep(1)
-
-                elements = driver.find_elements(
-                    By.XPATH, "//*[@id='idBody_idCtn']/div[@class='Frags']//*")
-                introduction = '\n'.join(
-                    [element.text for element in elements[:12]])
-                description = '\n'.join(
-                    [element.text for element in elements[12:] if element.tag_name.lower() != 'h4'])
-
-                law_detail = LawDetail(
-                    introduction=introduction, description=description)
-                law = Law(name=name, effect=effect,
-                          link=link, detail=law_detail)
-                now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-                law_intro_stripped = law.detail.introduction.replace('\n', '')
-                log_message = f"{now} - Field: {obor.capitalize()}, Processed law: {law.name}, Link: {law.link}, Intro: {law_intro_stripped}"
-                log_to_file(log_message)
-                data.append(law)
-                driver.back()
-                sleep(1)
-                count_requests += 3
+            data = fetch_field(pool, obor, browsers)
             save_data_to_json(data, f'{obor}.json')
-            print(count_requests)
+            print(f"{obor}: saved {len(data)} laws")
     except Exception as e:
         print(f"Unexpected error occurred: {str(e)}")
     finally:
-        driver.quit()
+        pool.close()
 
 
 def save_data_to_json(data: List[Law], filename: str):
@@ -126,4 +164,8 @@ def save_data_to_json(data: List[Law], filename: str):
 
 
 if __name__ == "__main__":
-    fetch_data()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fields", nargs="+", default=['koronavirus'])
+    parser.add_argument("--browsers", type=int, default=4, help="Browsers fetching law details in parallel")
+    args = parser.parse_args()
+    fetch_data(args.fields, args.browsers)
@@ -0,0 +1,221 @@
+# Async HTTP service in front of the retrieval pipeline. One process holds the warm Qdrant, Voyage and
+# LLM clients and the query cache; the Streamlit and Chainlit UIs call it over HTTP (see api_client.py),
+# so more instances can run behind a load balancer.
+#   python api.py --port 8000
+#   POST /retrieve        {"question", "model", "top_n", "rerank_top_k", "neighbours"}
+#   POST /batch_retrieve  {"questions": [...], same options}
+#   POST /answer          same as /retrieve plus "context_budget" (prompt tokens), streams server-sent
+#                         events: retrieval (with the token usage of the packed context), token..., done
+#   GET  /stats, /health
+import os
+import json
+import asyncio
+import logging
+import argparse
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+from aiohttp import web
+from dedup import remove_duplicates
+from retrieval import RetrievalResult, RetrievalService, citation
+from lexical_index import load_lexical_index
+
+MAX_CONCURRENT_RETRIEVALS = int(os.getenv("API_MAX_CONCURRENT_RETRIEVALS", 32))
+MAX_CONCURRENT_ANSWERS = int(os.getenv("API_MAX_CONCURRENT_ANSWERS", 8))
+# Seconds a request may wait for a free slot before it is turned away with 503
+QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", 10.0))
+MAX_BATCH_SIZE = 64
+MAX_CONTEXT_BUDGET = 32_000
+MODELS = ("gpt-4o", "gpt-4o-mini")
+
+SERVICE = web.AppKey("service", RetrievalService)
+RETRIEVALS = web.AppKey("retrievals", asyncio.Semaphore)
+ANSWERS = web.AppKey("answers", asyncio.Semaphore)
+WARMUP = web.AppKey("warmup", asyncio.Task)
+
+
+def point_to_dict(point: Any) -> Dict[str, Any]:
+    return {"id": point.id, "score": getattr(point, "score", None), "payload": point.payload}
+
+
+def result_to_dict(result: RetrievalResult) -> Dict[str, Any]:
+    return {
+        "question": result.question,
+        "rephrased_question": result.rephrased_question,
+        "paragraphs": [point_to_dict(point) for point in result.top_paragraphs],
+        "extended_paragraphs": [point_to_dict(point) for point in result.extended_paragraphs],
+        "citations": [citation(point) for point in result.top_paragraphs],
+        "timings": result.timings,
+        "degraded": result.degraded,
+    }
+
+
+# Retrieval options of a request body, validated
+def retrieval_options(body: Dict[str, Any]) -> Dict[str, Any]:
+    model_name = body.get("model", "gpt-4o")
+    if model_name not in MODELS:
+        raise web.HTTPBadRequest(reason=f"Unknown model {model_name}")
+    try:
+        return {
+            "model_name": model_name,
+            "top_n": min(int(body.get("top_n", 50)), 200),
+            "rerank_top_k": min(int(body.get("rerank_top_k", 3)), 20),
+            "neighbours_paragraph": min(int(body.get("neighbours", 0)), 5),
+        }
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(reason="top_n, rerank_top_k and neighbours must be integers")
+
+
+async def read_json(request: web.Request) -> Dict[str, Any]:
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(reason="Request body must be JSON")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(reason="Request body must be a JSON object")
+    return body
+
+
+def context_budget(body: Dict[str, Any]) -> Optional[int]:
+    if body.get("context_budget") is None:
+        return None
+    try:
+        return max(1, min(int(body["context_budget"]), MAX_CONTEXT_BUDGET))
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(reason="context_budget must be an integer")
+
+
+def question_of(body: Dict[str, Any]) -> str:
+    question = body.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise web.HTTPBadRequest(reason="Missing question")
+    return question
+
+
+# Wait for one of the limited slots, or give up with 503 so the load balancer can retry elsewhere
+@asynccontextmanager
+async def slot(semaphore: asyncio.Semaphore, timeout: float = QUEUE_TIMEOUT):
+    try:
+        await asyncio.wait_for(semaphore.acquire(), timeout)
+    except asyncio.TimeoutError:
+        raise web.HTTPServiceUnavailable(reason="Too many concurrent requests", headers={"Retry-After": "1"})
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+async def retrieve(service: RetrievalService, question: str, options: Dict[str, Any]) -> RetrievalResult:
+    result = await service.retrieve(question, **options)
+    result.top_paragraphs = remove_duplicates(result.top_paragraphs)
+    return result
+
+
+async def handle_retrieve(request: web.Request) -> web.Response:
+    body = await read_json(request)
+    question, options = question_of(body), retrieval_options(body)
+    async with slot(request.app[RETRIEVALS]):
+        result = await retrieve(request.app[SERVICE], question, options)
+    return web.json_response(result_to_dict(result))
+
+
+async def handle_batch_retrieve(request: web.Request) -> web.Response:
+    body = await read_json(request)
+    questions = body.get("questions")
+    if not isinstance(questions, list) or not questions:
+        raise web.HTTPBadRequest(reason="Missing questions")
+    if len(questions) > MAX_BATCH_SIZE:
+        raise web.HTTPBadRequest(reason=f"At most {MAX_BATCH_SIZE} questions per batch")
+    options = retrieval_options(body)
+
+    async def one(question: Any) -> Dict[str, Any]:
+        if not isinstance(question, str) or not question.strip():
+            return {"question": question, "error": "Missing question"}
+        try:
+            # Every question takes its own slot, a batch cannot starve single requests
+            async with slot(request.app[RETRIEVALS]):
+                return result_to_dict(await retrieve(request.app[SERVICE], question, options))
+        except web.HTTPServiceUnavailable as e:
+            return {"question": question, "error": e.reason}
+        except Exception as e:
+            logging.exception("Retrieval failed for a batch question")
+            return {"question": question, "error": str(e)}
+
+    return web.json_response({"results": await asyncio.gather(*[one(question) for question in questions])})
+
+
+def sse(event: str, data: Any) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+async def handle_answer(request: web.Request) -> web.StreamResponse:
+    body = await read_json(request)
+    question, options, budget = question_of(body), retrieval_options(body), context_budget(body)
+    service = request.app[SERVICE]
+    async with slot(request.app[ANSWERS]):
+        async with slot(request.app[RETRIEVALS]):
+            result = await retrieve(service, question, options)
+        # Token counting and packing are CPU bound, keep them off the event loop
+        context = await asyncio.to_thread(service.answer_context, result, budget)
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        await response.write(sse("retrieval", {**result_to_dict(result), "context": context.usage()}))
+        answer = []
+        try:
+            async for token in service.astream_answer(result.rephrased_question, context, options["model_name"]):
+                answer.append(token)
+                await response.write(sse("token", token))
+            await response.write(sse("done", {"answer": "".join(answer), "citations": [citation(point) for point in result.top_paragraphs],
+                                              "context": context.usage()}))
+        except ConnectionResetError:
+            logging.info("Client disconnected during the answer")
+            return response
+        except Exception as e:
+            logging.exception("Answer generation failed")
+            await response.write(sse("error", {"error": str(e)}))
+        await response.write_eof()
+        return response
+
+
+async def handle_stats(request: web.Request) -> web.Response:
+    service = request.app[SERVICE]
+    return web.json_response({"timings": service.timings.summary(), "cache": service.cache.stats(),
+                              "context_tokens": service.context_tokens.summary()})
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    # Requests are served during the warmup too, the first ones just pay for what is not loaded yet
+    return web.json_response({"status": "ok", "warm": request.app[WARMUP].done()})
+
+
+def create_app(service: Optional[RetrievalService] = None) -> web.Application:
+    app = web.Application()
+    app[RETRIEVALS] = asyncio.Semaphore(MAX_CONCURRENT_RETRIEVALS)
+    app[ANSWERS] = asyncio.Semaphore(MAX_CONCURRENT_ANSWERS)
+
+    # The clients must be created on the server's event loop
+    async def start(app: web.Application):
+        app[SERVICE] = service or RetrievalService(lexical=load_lexical_index())
+        app[WARMUP] = asyncio.create_task(app[SERVICE].warmup())
+
+    async def stop(app: web.Application):
+        app[WARMUP].cancel()
+        await app[SERVICE].close()
+
+    app.on_startup.append(start)
+    app.on_cleanup.append(stop)
+    app.router.add_post("/retrieve", handle_retrieve)
+    app.router.add_post("/batch_retrieve", handle_batch_retrieve)
+    app.router.add_post("/answer", handle_answer)
+    app.router.add_get("/stats", handle_stats)
+    app.router.add_get("/health", handle_health)
+    return app
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", 8000)))
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
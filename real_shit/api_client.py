@@ -0,0 +1,52 @@
+# Client of the retrieval API (api.py) used by the Streamlit and Chainlit UIs
+import os
+import json
+from typing import Any, AsyncIterator, Dict, List, Tuple
+import httpx
+
+API_URL = os.getenv("RETRIEVAL_API_URL", "http://localhost:8000")
+# Answers stream for a while, only connecting and the gaps between tokens are bounded
+TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+
+class ApiClient:
+    def __init__(self, base_url: str = API_URL, timeout: httpx.Timeout = TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _client(self) -> httpx.AsyncClient:
+        # A client per call: UIs may run every interaction on a new event loop
+        return httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout)
+
+    async def retrieve(self, question: str, **options) -> Dict[str, Any]:
+        async with self._client() as client:
+            response = await client.post("/retrieve", json={"question": question, **options})
+            response.raise_for_status()
+            return response.json()
+
+    async def batch_retrieve(self, questions: List[str], **options) -> List[Dict[str, Any]]:
+        async with self._client() as client:
+            response = await client.post("/batch_retrieve", json={"questions": questions, **options})
+            response.raise_for_status()
+            return response.json()["results"]
+
+    async def stats(self) -> Dict[str, Any]:
+        async with self._client() as client:
+            response = await client.get("/stats")
+            response.raise_for_status()
+            return response.json()
+
+    # (event, data) pairs of the /answer stream: "retrieval" once, "token" per chunk, then "done" or "error"
+    async def answer(self, question: str, **options) -> AsyncIterator[Tuple[str, Any]]:
+        async with self._client() as client:
+            async with client.stream("POST", "/answer", json={"question": question, **options}) as response:
+                response.raise_for_status()
+                event, data = None, []
+                async for line in response.aiter_lines():
+                    if line.startswith("event:"):
+                        event = line[len("event:"):].strip()
+                    elif line.startswith("data:"):
+                        data.append(line[len("data:"):].strip())
+                    elif not line and event:
+                        yield event, json.loads("\n".join(data))
+                        event, data = None, []
@@ -0,0 +1,39 @@
+# Benchmark of the async e-Sbírka fetcher against the in-process mock API.
+# Run from real_shit/: python -m benchmarks.bench_esbirka --laws 100 --latency 0.05
+import time
+import json
+import asyncio
+import argparse
+from esbirka import EsbirkaClient, fetch_laws
+from esbirka_mock import MockEsbirka, generate_laws
+
+
+async def run(mock: MockEsbirka, concurrency: int, rate_limit: float):
+    signs = [f"%2Fsb%2F{law['staleUrl'].split('/')[2]}%2F{law['staleUrl'].split('/')[3]}%2F0000-00-00" for law in mock.laws.values()]
+    async with EsbirkaClient(base_url="http://esbirka.mock", concurrency=concurrency, rate_limit=rate_limit,
+                             backoff=0.01, transport=mock.transport()) as client:
+        start = time.perf_counter()
+        results = await fetch_laws(signs, client)
+        elapsed = time.perf_counter() - start
+    paragraphs = sum(len(result["paragraphs"]) for result in results if result)
+    return {"concurrency": concurrency, "laws": len(signs), "failed": sum(result is None for result in results),
+            "paragraphs": paragraphs, "requests": client.requests, "seconds": round(elapsed, 3),
+            "laws_per_second": round(len(signs) / elapsed, 1)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--laws", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--rate-limit", type=float, default=1000.0)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    laws = generate_laws(args.laws)
+    results = []
+    for concurrency in args.concurrency:
+        mock = MockEsbirka(laws, latency=args.latency, error_rate=args.error_rate)
+        results.append(asyncio.run(run(mock, concurrency, args.rate_limit)))
+        print(f"concurrency={concurrency}: {results[-1]['laws_per_second']} laws/s")
+    print(json.dumps(results, indent=4))
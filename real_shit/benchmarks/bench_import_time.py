@@ -0,0 +1,89 @@
+# Cold-start check of the query entry points. Imports each module in a fresh interpreter with
+# -X importtime, reports its cumulative import time and heaviest imports, and fails when a module
+# pulls in a dependency that must load lazily or takes longer than the budget.
+# Run from real_shit/: python -m benchmarks.bench_import_time --budget 2.0
+import os
+import sys
+import json
+import argparse
+import subprocess
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Created on first use by the retrieval core (see RetrievalService.warmup), never at import
+LAZY = ["langchain", "langchain_core", "langchain_openai", "langchain_anthropic", "openai", "anthropic", "voyageai",
+        "tiktoken", "pymongo", "torch", "transformers", "sentence_transformers", "streamlit", "chainlit"]
+ENTRY_POINTS = {
+    "retrieval": LAZY,
+    "api": LAZY,
+    "query": [name for name in LAZY if name != "pymongo"],
+    "api_client": LAZY + ["qdrant_client", "numpy"],
+}
+
+
+# (package, self us, cumulative us, depth) of every line of a -X importtime report
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def profile(module: str) -> List[Tuple[str, int, int, int]]:
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                            capture_output=True, text=True, env={**os.environ, "PYTHONPATH": ROOT})
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def report(module: str, runs: int, top: int) -> Dict:
+    best = None
+    for _ in range(runs):
+        rows = profile(module)
+        # The imports of the module come right before its own top-level line, after the interpreter startup
+        end = max(i for i, row in enumerate(rows) if row[0] == module and row[3] == 0)
+        start = max([i + 1 for i, row in enumerate(rows[:end]) if row[3] == 0], default=0)
+        total = rows[end][2]
+        if best is None or total < best[0]:
+            best = (total, rows[start:end])
+    total, rows = best
+    # Direct imports of third-party and project packages, the heaviest first
+    heaviest = sorted([(name, cumulative) for name, _, cumulative, depth in rows if depth == 1],
+                      key=lambda row: -row[1])[:top]
+    loaded = {name.split(".")[0] for name, _, _, _ in rows}
+    return {
+        "module": module,
+        "seconds": round(total / 1e6, 3),
+        "heaviest": [{"package": name, "seconds": round(cumulative / 1e6, 3)} for name, cumulative in heaviest],
+        "eager": sorted(loaded.intersection(ENTRY_POINTS.get(module, []))),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=list(ENTRY_POINTS))
+    parser.add_argument("--runs", type=int, default=3, help="best of this many fresh interpreters")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--budget", type=float, help="maximum import seconds of every module")
+    args = parser.parse_args()
+
+    results, failures = [], []
+    for module in args.modules:
+        result = report(module, args.runs, args.top)
+        results.append(result)
+        print(f"{module}: {result['seconds']:.3f}s, heaviest: "
+              + ", ".join(f"{row['package']} {row['seconds']:.3f}s" for row in result["heaviest"][:5]))
+        if result["eager"]:
+            failures.append(f"{module} imports {', '.join(result['eager'])} eagerly")
+        if args.budget is not None and result["seconds"] > args.budget:
+            failures.append(f"{module} takes {result['seconds']:.3f}s to import, budget {args.budget}s")
+    print(json.dumps(results, indent=4))
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,45 @@
+# Offline benchmark of the ingest pipeline with a stand-in embedder and an in-memory Qdrant.
+# Run from real_shit/: python -m benchmarks.bench_ingest --paragraphs 20000 --latency 0.3
+import argparse
+import json
+import random
+import logging
+from qdrant_client import QdrantClient
+from qdrant_client.models import VectorParams, Distance
+from embeddings.embedders import HashEmbedder
+from ingest_pipeline import EmbeddingPipeline, PipelineItem
+
+WORDS = ["zákon", "odstavec", "povinnost", "smlouva", "společnost", "nájem", "pacht", "odpad", "daň", "příjem",
+         "zaměstnavatel", "dohoda", "lhůta", "soud", "řízení", "správní", "orgán", "osoba", "právo", "věc"]
+
+
+def synthetic_items(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    for i in range(count):
+        # Paragraph lengths roughly follow the long-tailed distribution of the corpus
+        length = min(int(rng.lognormvariate(4.5, 0.9)), 4000)
+        text = " ".join(rng.choice(WORDS) for _ in range(max(length, 5)))
+        yield PipelineItem(id=i + 1, text=text, payload={"cislo": str(i % 400 + 1), "zneni": text})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--paragraphs", type=int, default=10000)
+    parser.add_argument("--latency", type=float, default=0.2, help="simulated seconds per embed request")
+    parser.add_argument("--latency-per-1k-tokens", type=float, default=0.01)
+    parser.add_argument("--embed-workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--upsert-batch-size", type=int, default=512)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    results = []
+    for workers in args.embed_workers:
+        embedder = HashEmbedder(latency=args.latency, latency_per_1k_tokens=args.latency_per_1k_tokens)
+        client = QdrantClient(":memory:")
+        client.create_collection("bench", vectors_config=VectorParams(size=embedder.dimension, distance=Distance.COSINE))
+        pipeline = EmbeddingPipeline(embedder, client, "bench", embed_workers=workers, upsert_batch_size=args.upsert_batch_size)
+        stats = pipeline.run(synthetic_items(args.paragraphs))
+        results.append({"embed_workers": workers, "paragraphs_per_second": round(stats.paragraphs_per_second, 1),
+                        **stats.model_dump()})
+        print(f"embed_workers={workers}: {stats.paragraphs_per_second:.1f} paragraphs/s ({stats.batches} batches, {stats.elapsed:.1f}s)")
+    print(json.dumps(results, indent=4))
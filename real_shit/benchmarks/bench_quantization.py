@@ -0,0 +1,111 @@
+# Memory saved vs. recall lost by scalar and binary quantization, on the labelled question set.
+# Every configuration searches the same vectors with the LocalIndex implementation of Qdrant's
+# quantization (oversampled first pass over the codes, rescoring with the full vectors).
+# Run from real_shit/, offline over a JSONL export of paragraphs:
+#   python -m benchmarks.bench_quantization --corpus paragraphs.jsonl
+# or over the vectors of the real collection with Voyage query embeddings:
+#   python -m benchmarks.bench_quantization --qdrant-url http://localhost:6333 --embedder voyage
+import os
+import json
+import time
+import asyncio
+import argparse
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.models import Filter, FieldCondition, MatchValue
+from local_index import LocalIndex, payload_matches
+from benchmarks.bench_retrieval import load_questions, recall_at_k, git_commit, QUESTIONS_PATH, RESULTS_DIR
+from benchmarks.stand_ins import HashQueryEmbedder, load_corpus
+
+VALID = Filter(must=[FieldCondition(key="isValid", match=MatchValue(value=True))])
+
+
+# Vectors and payloads of a Qdrant collection, read page by page
+def export_collection(client: QdrantClient, collection_name: str, page_size: int = 1024) -> Tuple[LocalIndex, List[Dict[str, Any]]]:
+    vectors, ids, payloads = [], [], []
+    offset = None
+    while True:
+        records, offset = client.scroll(collection_name, limit=page_size, offset=offset, with_payload=True, with_vectors=True)
+        for record in records:
+            vectors.append(record.vector)
+            ids.append(record.id)
+            payloads.append(record.payload)
+        if offset is None:
+            break
+    return LocalIndex.from_vectors(vectors, ids), payloads
+
+
+def run_config(index: LocalIndex, payloads, queries: np.ndarray, questions, mask: np.ndarray, exact_rows: np.ndarray,
+               k: int, oversampling: Optional[float], rescore: bool) -> Dict[str, Any]:
+    start = time.perf_counter()
+    rows, _ = index.search_batch(queries, k, mask=mask, oversampling=oversampling, rescore=rescore)
+    elapsed = time.perf_counter() - start
+    recall = {f"@{cut}": float(np.mean([recall_at_k(question["expected"], [payloads[row] for row in found], cut)
+                                        for question, found in zip(questions, rows)]))
+              for cut in (1, 3, 5, 10) if cut <= k}
+    # Share of the exact float32 top-k the configuration still finds
+    overlap = float(np.mean([len(set(found) & set(exact)) / len(exact) for found, exact in zip(rows, exact_rows) if len(exact)]))
+    return {"recall": recall, "overlap": overlap, "ms_per_query": elapsed / len(queries) * 1000}
+
+
+async def main(args):
+    questions = load_questions(args.questions)
+    if args.embedder == "voyage":
+        from embeddings.utils import embed
+    else:
+        embed = HashQueryEmbedder()
+    if args.corpus:
+        local = await load_corpus(args.corpus, HashQueryEmbedder(), args.collection, backend="local")
+        index, payloads = local.index, local.payloads
+    else:
+        index, payloads = export_collection(QdrantClient(url=args.qdrant_url, api_key=os.getenv("QDRANT_API_KEY")), args.collection)
+    queries = np.asarray([await embed(question["question"]) for question in questions], dtype=np.float32)
+    mask = np.fromiter((payload_matches(payload, VALID) for payload in payloads), dtype=bool, count=len(payloads))
+
+    index.quantize("none")
+    exact_rows, _ = index.search_batch(queries, args.k, mask=mask, exact=True)
+    baseline = index.memory_bytes()["search"]
+    configs = [("none", None, True)]
+    for kind in ("scalar", "binary"):
+        configs.append((kind, None, False))
+        configs += [(kind, oversampling, True) for oversampling in args.oversampling]
+
+    rows = []
+    for kind, oversampling, rescore in configs:
+        if index.quantized is None or index.quantized.kind != kind:
+            index.quantize(kind)
+        memory = index.memory_bytes()
+        result = run_config(index, payloads, queries, questions, mask, exact_rows, args.k, oversampling, rescore)
+        rows.append({"quantization": kind, "oversampling": oversampling, "rescore": rescore,
+                     "ram_bytes": memory["search"], "disk_bytes": memory["rescore"],
+                     "ram_saved": 1 - memory["search"] / baseline, **result})
+
+    report = {"commit": git_commit(), "created_at": datetime.utcnow().isoformat(), "vectors": len(index),
+              "config": {key: value for key, value in vars(args).items() if key != "output"}, "results": rows}
+    output = args.output or os.path.join(RESULTS_DIR, f"quantization_{report['commit']}_{datetime.utcnow():%Y%m%d%H%M%S}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    reference = rows[0]["recall"]
+    for row in rows:
+        lost = {key: reference[key] - value for key, value in row["recall"].items()}
+        print(f"{row['quantization']:>6} oversampling {row['oversampling'] or '-':>4} rescore {str(row['rescore']):>5}: "
+              f"RAM {row['ram_bytes'] / 2**20:8.1f} MiB ({row['ram_saved']:.0%} saved), overlap@{args.k} {row['overlap']:.3f}, "
+              f"recall lost {', '.join(f'{key} {value:+.3f}' for key, value in lost.items())}, {row['ms_per_query']:.2f} ms/query")
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", default=QUESTIONS_PATH)
+    parser.add_argument("--collection", default="legal_paragraphs_updated")
+    parser.add_argument("--corpus", help="JSONL export of paragraphs, embedded with the hash stand-in")
+    parser.add_argument("--qdrant-url", default=os.getenv("QDRANT_HOST", "http://localhost:6333"))
+    parser.add_argument("--embedder", choices=["hash", "voyage"], default="hash")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--oversampling", type=float, nargs="+", default=[1.0, 2.0, 3.0, 4.0])
+    parser.add_argument("--output")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,205 @@
+# Replays the labelled question set against the retrieval pipeline and records per-stage latency
+# percentiles, throughput under concurrency and recall@k, written as JSON for comparison across commits.
+# Run from real_shit/, fully offline:
+#   python -m benchmarks.bench_retrieval --corpus paragraphs.jsonl
+# or against the real services:
+#   python -m benchmarks.bench_retrieval --qdrant-url http://localhost:6333 --embedder voyage --reranker voyage --llm openai
+import os
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+from datetime import datetime
+from typing import Any, Dict, List
+from qdrant_client import AsyncQdrantClient
+from retrieval import JUDGMENTS_TOP_N, RetrievalService, StageTimings
+from query_cache import QueryCache
+from lexical_index import load_lexical_index
+from collection_schema import JUDGMENTS_COLLECTION
+from benchmarks.stand_ins import HashQueryEmbedder, LexicalReranker, EchoLLM, load_corpus, load_judgments, load_lexical_corpus
+
+QUESTIONS_PATH = os.path.join(os.path.dirname(__file__), "questions.json")
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+RECALL_KS = [1, 3, 5, 10]
+
+
+def load_questions(path: str = QUESTIONS_PATH) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["questions"]
+
+
+# An expected item {"law": "89/2012", "paragraph": "2978"} matches a hit from /sb/2012/89/... with that cislo
+def matches(expected: Dict[str, str], payload: Dict[str, Any]) -> bool:
+    number, year = expected["law"].split("/")
+    parts = payload.get("staleURL", "").strip("/").split("/")
+    if len(parts) < 3 or parts[1] != year or parts[2] != number:
+        return False
+    return expected.get("paragraph") is None or str(payload.get("cislo")) == expected["paragraph"]
+
+
+def recall_at_k(expected: List[Dict[str, str]], payloads: List[Dict[str, Any]], k: int) -> float:
+    found = sum(any(matches(item, payload) for payload in payloads[:k]) for item in expected)
+    return found / len(expected) if expected else 0.0
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+async def build_service(args) -> RetrievalService:
+    embed_fn = rerank_fn = llm_factory = None
+    if args.embedder == "hash":
+        embed_fn = HashQueryEmbedder(latency=args.embed_latency)
+    if args.reranker == "lexical":
+        rerank_fn = LexicalReranker(latency=args.rerank_latency)
+    if args.llm == "echo":
+        llm = EchoLLM(latency=args.llm_latency)
+        llm_factory = lambda model_name: llm
+    if args.corpus:
+        qdrant = await load_corpus(args.corpus, embed_fn or HashQueryEmbedder(), args.collection, backend=args.backend)
+    else:
+        qdrant = AsyncQdrantClient(url=args.qdrant_url, api_key=os.getenv("QDRANT_API_KEY"))
+    # An offline run searches court decisions only when they are loaded next to the corpus
+    judgments_collection = args.judgments_collection if args.judgments or not args.corpus else None
+    if args.judgments:
+        qdrant = await load_judgments(qdrant, args.judgments, embed_fn or HashQueryEmbedder(), args.judgments_collection)
+    lexical = None
+    if args.lexical:
+        lexical = load_lexical_corpus(args.corpus) if args.corpus else load_lexical_index()
+    # Caching would hide the cost of the stages on repeats, it is measured separately
+    cache = QueryCache(maxsize=10_000 if args.cache else 0)
+    return RetrievalService(collection_name=args.collection, qdrant=qdrant, cache=cache,
+                            embed_fn=embed_fn, rerank_fn=rerank_fn, llm_factory=llm_factory, lexical=lexical,
+                            judgments_collection=judgments_collection, judgments_top_n=args.judgments_top_n)
+
+
+async def run_quality(service: RetrievalService, questions, args) -> List[Dict[str, Any]]:
+    results = []
+    for _ in range(args.repeats):
+        for question in questions:
+            result = await service.retrieve(question["question"], model_name=args.model, top_n=args.top_n,
+                                            rerank_top_k=args.rerank_top_k, speculative=not args.no_speculative)
+            payloads = [point.payload for point in result.top_paragraphs]
+            results.append({
+                "id": question["id"],
+                "level": question["level"],
+                "timings": result.timings,
+                "recall": {f"@{k}": recall_at_k(question["expected"], payloads, k) for k in RECALL_KS if k <= args.rerank_top_k},
+                "hits": [f"{payload.get('staleURL')} §{payload.get('cislo')}" for payload in payloads],
+            })
+    return results
+
+
+async def run_throughput(service: RetrievalService, questions, concurrency: int, args) -> Dict[str, float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = StageTimings(window=1_000_000)
+
+    async def one(question):
+        async with semaphore:
+            start = time.perf_counter()
+            await service.retrieve(question["question"], model_name=args.model, top_n=args.top_n,
+                                   rerank_top_k=args.rerank_top_k, speculative=not args.no_speculative)
+            latencies.record("total", time.perf_counter() - start)
+
+    batch = questions * args.repeats
+    start = time.perf_counter()
+    await asyncio.gather(*[one(question) for question in batch])
+    elapsed = time.perf_counter() - start
+    return {"concurrency": concurrency, "queries": len(batch), "seconds": elapsed, "qps": len(batch) / elapsed,
+            "p50": latencies.percentile("total", 0.5), "p95": latencies.percentile("total", 0.95),
+            "p99": latencies.percentile("total", 0.99)}
+
+
+def summarize(quality: List[Dict[str, Any]], service: RetrievalService) -> Dict[str, Any]:
+    recall: Dict[str, float] = {}
+    for key in quality[0]["recall"] if quality else []:
+        recall[key] = sum(result["recall"][key] for result in quality) / len(quality)
+    stages = {stage: {"count": len(service.timings.samples[stage]),
+                      "p50": service.timings.percentile(stage, 0.5),
+                      "p95": service.timings.percentile(stage, 0.95),
+                      "p99": service.timings.percentile(stage, 0.99)}
+              for stage in service.timings.samples}
+    return {"recall": recall, "stages": stages}
+
+
+def compare(current: Dict[str, Any], previous_path: str):
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)
+    print(f"Compared to {previous['commit']} ({previous_path}):")
+    for key, value in current["summary"]["recall"].items():
+        before = previous["summary"]["recall"].get(key)
+        if before is not None:
+            print(f"  recall{key}: {before:.3f} -> {value:.3f} ({value - before:+.3f})")
+    for stage, values in current["summary"]["stages"].items():
+        before = previous["summary"]["stages"].get(stage)
+        if before:
+            print(f"  {stage} p95: {before['p95'] * 1000:.1f}ms -> {values['p95'] * 1000:.1f}ms")
+
+
+async def main(args):
+    questions = load_questions(args.questions)
+    service = await build_service(args)
+    quality = await run_quality(service, questions, args)
+    summary = summarize(quality, service)
+    throughput = [await run_throughput(service, questions, concurrency, args) for concurrency in args.concurrency]
+    await service.close()
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.utcnow().isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "summary": summary,
+        "throughput": throughput,
+        "questions": quality,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"retrieval_{report['commit']}_{datetime.utcnow():%Y%m%d%H%M%S}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    for key, value in summary["recall"].items():
+        print(f"recall{key}: {value:.3f}")
+    for stage, values in summary["stages"].items():
+        print(f"{stage}: p50 {values['p50'] * 1000:.1f}ms, p95 {values['p95'] * 1000:.1f}ms")
+    for row in throughput:
+        print(f"concurrency {row['concurrency']}: {row['qps']:.1f} qps, p95 {row['p95'] * 1000:.1f}ms")
+    print(f"Results written to {output}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", default=QUESTIONS_PATH)
+    parser.add_argument("--collection", default="legal_paragraphs_updated")
+    parser.add_argument("--corpus", help="JSONL export of paragraphs to load into an in-memory Qdrant")
+    parser.add_argument("--backend", choices=["qdrant", "local"], default="qdrant",
+                        help="in-memory store for --corpus: qdrant-client local mode or the numpy LocalIndex")
+    parser.add_argument("--judgments", help="crawled court decisions (JSONL) to chunk and load next to --corpus, "
+                                            "needs --backend qdrant")
+    parser.add_argument("--judgments-collection", default=JUDGMENTS_COLLECTION)
+    parser.add_argument("--judgments-top-n", type=int, default=JUDGMENTS_TOP_N,
+                        help="court decision chunks added to the law candidates, 0 searches the laws only")
+    parser.add_argument("--qdrant-url", default=os.getenv("QDRANT_HOST", "http://localhost:6333"))
+    parser.add_argument("--embedder", choices=["hash", "voyage"], default="hash")
+    parser.add_argument("--reranker", choices=["lexical", "voyage"], default="lexical")
+    parser.add_argument("--llm", choices=["echo", "openai"], default="echo")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--rerank-latency", type=float, default=0.15)
+    parser.add_argument("--llm-latency", type=float, default=0.8)
+    parser.add_argument("--top-n", type=int, default=50)
+    parser.add_argument("--rerank-top-k", type=int, default=10)
+    parser.add_argument("--no-speculative", action="store_true")
+    parser.add_argument("--lexical", action="store_true",
+                        help="fuse BM25 hits with the dense ones (built from --corpus, or the index at LEXICAL_INDEX_PATH)")
+    parser.add_argument("--cache", action="store_true", help="keep the query cache enabled")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--output")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,125 @@
+# Local stand-ins for the Voyage embedder and reranker and the rephrasing LLM, so the retrieval
+# pipeline can be benchmarked without network access or API cost
+import re
+import json
+import asyncio
+from typing import Any, List, Optional
+from pydantic import BaseModel
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.models import PointStruct
+from qdrant_client.models import VectorParams, Distance
+from embeddings.embedders import HashEmbedder
+from sync import paragraph_point_id
+from collection_schema import paragraph_payload
+from local_index import LocalIndex, LocalQdrant
+from lexical_index import LexicalIndex
+
+
+def _tokens(text: str) -> List[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+class HashQueryEmbedder:
+    def __init__(self, dimension: int = 1024, latency: float = 0.0):
+        self.embedder = HashEmbedder(dimension=dimension)
+        self.latency = latency
+
+    async def __call__(self, text: str) -> List[float]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.embedder.embed([text], input_type="query")[0]
+
+
+class RerankResult(BaseModel):
+    index: int
+    document: str
+    relevance_score: float
+
+
+# Scores documents by the share of query words they contain
+class LexicalReranker:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    async def __call__(self, query: str, documents: List[str], model: str = None, top_k: Optional[int] = None,
+                       truncation: bool = True) -> List[RerankResult]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        query_tokens = set(_tokens(query))
+        results = []
+        for i, document in enumerate(documents):
+            overlap = len(query_tokens & set(_tokens(document)))
+            results.append(RerankResult(index=i, document=document, relevance_score=overlap / max(len(query_tokens), 1)))
+        results.sort(key=lambda result: result.relevance_score, reverse=True)
+        return results[:top_k] if top_k else results
+
+
+class EchoResponse(BaseModel):
+    content: str
+
+
+# Rephrasing LLM that returns the question unchanged after a simulated delay
+class EchoLLM:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    async def ainvoke(self, messages: List[Any]) -> EchoResponse:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return EchoResponse(content=messages[-1]["content"])
+
+    # Answers by streaming the prompt back word by word
+    async def astream(self, messages: List[Any]):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for word in re.findall(r"\S+\s*", messages[-1]["content"]):
+            yield EchoResponse(content=word)
+
+
+# In-memory collection built from a JSONL export of paragraphs (one Mongo document per line), served
+# either by qdrant-client's local mode or by the numpy LocalQdrant
+async def load_corpus(path: str, embed, collection_name: str, dimension: int = 1024, backend: str = "qdrant"):
+    points = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            doc = json.loads(line)
+            doc.setdefault("isValid", True)
+            points.append(PointStruct(id=paragraph_point_id(doc["staleURL"], doc["cislo"]),
+                                      vector=await embed(doc["zneni"]), payload=paragraph_payload(doc)))
+    if backend == "local":
+        index = LocalIndex.from_vectors([point.vector for point in points], [point.id for point in points])
+        return LocalQdrant(index, [point.payload for point in points], collection_name)
+    client = AsyncQdrantClient(location=":memory:")
+    await client.create_collection(collection_name, vectors_config=VectorParams(size=dimension, distance=Distance.COSINE))
+    for start in range(0, len(points), 1000):
+        await client.upsert(collection_name=collection_name, points=points[start:start + 1000])
+    return client
+
+
+# BM25 index over the same JSONL export, with the point ids load_corpus gives the paragraphs
+def load_lexical_corpus(path: str) -> LexicalIndex:
+    def documents():
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                doc = json.loads(line)
+                yield {"id": paragraph_point_id(doc["staleURL"], doc["cislo"]), "zneni": doc["zneni"],
+                       "isValid": doc.get("isValid", True)}
+    index = LexicalIndex()
+    index.update(documents())
+    return index
+
+
+# Court decisions of a crawler output file (see crawl_zakony_pro_lidi.py), chunked as judgments.py
+# does, added to a qdrant-client local-mode client as their own collection
+async def load_judgments(client: AsyncQdrantClient, path: str, embed, collection_name: str, dimension: int = 1024):
+    from judgments import judgment_items
+    points = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            for item in judgment_items(record) if record.get("text") else []:
+                points.append(PointStruct(id=item.id, vector=await embed(item.text), payload=item.payload))
+    await client.create_collection(collection_name, vectors_config=VectorParams(size=dimension, distance=Distance.COSINE))
+    for start in range(0, len(points), 1000):
+        await client.upsert(collection_name=collection_name, points=points[start:start + 1000])
+    return client
@@ -0,0 +1,125 @@
+import os
+import re
+import logging
+from typing import Any, Dict, Optional
+from qdrant_client import QdrantClient
+from qdrant_client.models import Disabled, Distance, HnswConfigDiff, OptimizersConfigDiff, PayloadSchemaType, VectorParams
+from dedup import text_hash
+from quantization import quantization_config
+
+VOYAGE_DIMENSION = 1024
+# Bumped whenever paragraph_payload changes shape, so incremental syncs rewrite every point
+PAYLOAD_SCHEMA_VERSION = 3
+# Token count of zneni and the hash of the text it was counted for, see count_tokens_in_mongo.py
+ZNENI_TOKENS_FIELD = "zneni_tokens"
+ZNENI_TOKENS_HASH_FIELD = "zneni_tokens_hash"
+TOKEN_ENCODING = "cl100k_base"
+
+# isValid filters every production search, staleURL + cislo_num the neighbour lookups, field
+# (the Mongo collection the law came from) narrows a search to one area of law
+PARAGRAPH_PAYLOAD_INDEXES = {
+    "staleURL": PayloadSchemaType.KEYWORD,
+    "field": PayloadSchemaType.KEYWORD,
+    "isValid": PayloadSchemaType.BOOL,
+    "cislo_num": PayloadSchemaType.INTEGER,
+    "cislo": PayloadSchemaType.KEYWORD,
+}
+# Court decisions live in their own collection (see judgments.py). Their chunks reuse staleURL, cislo
+# and law_name for the decision URL, chunk number and title, so neighbour lookups and the context
+# packer handle them like paragraphs; court narrows a search to one court.
+JUDGMENTS_COLLECTION = os.getenv("JUDGMENTS_COLLECTION", "court_decisions")
+JUDGMENT_PAYLOAD_INDEXES = {**PARAGRAPH_PAYLOAD_INDEXES, "court": PayloadSchemaType.KEYWORD}
+HNSW_CONFIG = HnswConfigDiff(m=16, ef_construct=128, full_scan_threshold=10_000)
+OPTIMIZERS_CONFIG = OptimizersConfigDiff(default_segment_number=4, indexing_threshold=20_000)
+# zneni makes up most of the payload and is only read for the final hits, the indexed fields stay in RAM
+ON_DISK_PAYLOAD = True
+
+CISLO_RE = re.compile(r"\d+")
+
+
+# Numeric part of a paragraph label: "52" -> 52, "52a" -> 52
+def cislo_number(cislo: Any) -> Optional[int]:
+    match = CISLO_RE.search(str(cislo))
+    return int(match.group()) if match else None
+
+
+# Numeric cislo of a point, for points stored before cislo_num existed too
+def point_cislo(payload: Dict[str, Any]) -> int:
+    number = payload.get("cislo_num")
+    return number if number is not None else cislo_number(payload["cislo"]) or 0
+
+
+def is_judgment(payload: Dict[str, Any]) -> bool:
+    return payload.get("kind") == "judgment"
+
+
+# Qdrant payload of a Mongo paragraph document
+def paragraph_payload(doc: Dict[str, Any], field: Optional[str] = None) -> Dict[str, Any]:
+    payload = {key: doc[key] for key in ("cislo", "zneni", "law_name", "year", "staleURL", "isValid")
+               if doc.get(key) is not None}
+    payload["cislo"] = str(payload.get("cislo", ""))
+    payload["cislo_num"] = cislo_number(payload["cislo"])
+    payload["zneni_hash"] = text_hash(doc.get("zneni") or "")
+    # A count made for an older text is left out, the context packer counts those itself
+    if doc.get(ZNENI_TOKENS_FIELD) is not None and doc.get(ZNENI_TOKENS_HASH_FIELD) == payload["zneni_hash"]:
+        payload[ZNENI_TOKENS_FIELD] = doc[ZNENI_TOKENS_FIELD]
+    if field or doc.get("field"):
+        payload["field"] = field or doc["field"]
+    return payload
+
+
+# Fields of `diff` whose value differs from the current config
+def _changed(current, diff) -> Dict[str, Any]:
+    return {key: value for key, value in diff.model_dump(exclude_none=True).items() if getattr(current, key, None) != value}
+
+
+def ensure_payload_indexes(client: QdrantClient, collection_name: str, indexes: Dict[str, PayloadSchemaType] = PARAGRAPH_PAYLOAD_INDEXES):
+    existing = client.get_collection(collection_name).payload_schema or {}
+    for field_name, schema in indexes.items():
+        if field_name not in existing:
+            client.create_payload_index(collection_name, field_name=field_name, field_schema=schema, wait=True)
+            logging.info(f"Created {schema.value} payload index on '{field_name}' in '{collection_name}'")
+
+
+# Create the paragraph collection, or bring an existing one to the declared HNSW, optimizer and
+# payload index settings. Safe to run before every ingest; returns True when the collection was created.
+# `quantization` None leaves the quantization of an existing collection as it is.
+def provision_collection(client: QdrantClient, collection_name: str, dimension: int = VOYAGE_DIMENSION,
+                         quantization: Optional[str] = None, recreate: bool = False,
+                         indexes: Dict[str, PayloadSchemaType] = PARAGRAPH_PAYLOAD_INDEXES) -> bool:
+    created = False
+    if recreate and client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+    if not client.collection_exists(collection_name):
+        quantization = quantization or "none"
+        client.create_collection(
+            collection_name,
+            vectors_config=VectorParams(
+                size=dimension,
+                distance=Distance.COSINE,
+                # With quantization only the compressed vectors stay in RAM, the originals are read for rescoring
+                on_disk=quantization != "none",
+            ),
+            hnsw_config=HNSW_CONFIG,
+            optimizers_config=OPTIMIZERS_CONFIG,
+            on_disk_payload=ON_DISK_PAYLOAD,
+            quantization_config=quantization_config(quantization),
+        )
+        created = True
+        logging.info(f"Created collection '{collection_name}' ({dimension} dimensions, quantization {quantization})")
+    else:
+        config = client.get_collection(collection_name).config
+        hnsw = _changed(config.hnsw_config, HNSW_CONFIG)
+        optimizers = _changed(config.optimizer_config, OPTIMIZERS_CONFIG)
+        updates = {}
+        if hnsw:
+            updates["hnsw_config"] = HnswConfigDiff(**hnsw)
+        if optimizers:
+            updates["optimizers_config"] = OptimizersConfigDiff(**optimizers)
+        if quantization is not None and config.quantization_config != quantization_config(quantization):
+            updates["quantization_config"] = quantization_config(quantization) or Disabled.DISABLED
+        if updates:
+            client.update_collection(collection_name, **updates)
+            logging.info(f"Updated {', '.join(updates)} of collection '{collection_name}'")
+    ensure_payload_indexes(client, collection_name, indexes)
+    return created
@@ -0,0 +1,223 @@
+# Assembles the CONTEXT of the answer prompt within a token budget. The reranked paragraphs go in
+# first, in rank order, then their neighbours closest first. Paragraphs longer than a cap are cut
+# down to the odstavce around the one that best matches the question, neighbour odstavce already in
+# the context are left out, and whatever no longer fits is dropped. Token counts come from the
+# zneni_tokens payload field (see count_tokens_in_mongo.py) and are only computed for texts without one.
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence, Set, Tuple
+from collection_schema import TOKEN_ENCODING, ZNENI_TOKENS_FIELD, is_judgment, point_cislo
+from dedup import paragraph_hash, text_hash
+from lexical_index import analyze, fold
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 6000))
+MAX_PARAGRAPH_TOKENS = int(os.getenv("MAX_PARAGRAPH_TOKENS", 1500))
+# A trimmed reranked paragraph smaller than this is not worth its header
+MIN_PARAGRAPH_TOKENS = 100
+OMITTED = "[…]"
+
+# Start of an odstavec, "(1)" or "(2a)" at the beginning of a line
+ODSTAVEC_RE = re.compile(r"(?m)^[ \t]*\(\d+[a-z]?\)")
+
+_encoding = None
+
+
+def get_encoding():
+    global _encoding
+    if _encoding is None:
+        import tiktoken
+        _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode_ordinary(text))
+
+
+# Precomputed token count of a paragraph, counted here for points stored without one
+def paragraph_tokens(payload: Dict[str, Any]) -> int:
+    tokens = payload.get(ZNENI_TOKENS_FIELD)
+    return tokens if tokens is not None else count_tokens(payload.get("zneni") or "")
+
+
+def format_paragraph(payload: Dict[str, Any], zneni: str) -> str:
+    if is_judgment(payload):
+        return format_judgment(payload, zneni)
+    return f"""
+paragraph
+§{payload['cislo']}
+cislo zakona
+{payload['staleURL'].rsplit('/', 1)[0]}
+jmeno zakona
+{payload['law_name']}
+zneni zakona
+{zneni}
+---------------------------------
+"""
+
+
+def format_judgment(payload: Dict[str, Any], zneni: str) -> str:
+    return f"""
+rozhodnuti
+{payload['court_name']}, sp. zn. {payload.get('spisova_znacka', '')}
+nazev rozhodnuti
+{payload['law_name']}
+cast rozhodnuti
+{payload.get('section', '')}
+zneni rozhodnuti
+{zneni}
+---------------------------------
+"""
+
+
+# The whole paragraphs, without a budget
+def format_context(paragraphs: List[Any]) -> str:
+    return "\n".join([format_paragraph(p.payload, p.payload['zneni']) for p in paragraphs])
+
+
+# Text before the first odstavec, then one piece per odstavec
+def split_odstavce(text: str) -> List[str]:
+    starts = [match.start() for match in ODSTAVEC_RE.finditer(text)]
+    if not starts:
+        return [text]
+    if starts[0] > 0 and text[:starts[0]].strip():
+        starts.insert(0, 0)
+    else:
+        starts[0] = 0
+    return [text[start:end].strip() for start, end in zip(starts, starts[1:] + [len(text)])]
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    tokens = get_encoding().encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return get_encoding().decode(tokens[:max_tokens]).rstrip() + f" {OMITTED}"
+
+
+# Keep the odstavec sharing most terms with the question and grow around it while under max_tokens,
+# preferring the better matching side. Gaps are marked with […].
+def trim_paragraph(text: str, question_terms: Set[str], max_tokens: int) -> str:
+    parts = split_odstavce(text)
+    if len(parts) == 1:
+        return _truncate(text, max_tokens)
+    scores = [len(question_terms.intersection(analyze(part))) for part in parts]
+    counts = [count_tokens(part) for part in parts]
+    best = max(range(len(parts)), key=lambda i: (scores[i], -i))
+    if counts[best] >= max_tokens:
+        return _truncate(parts[best], max_tokens)
+
+    kept, total = {best}, counts[best]
+    low, high = best - 1, best + 1
+    while low >= 0 or high < len(parts):
+        sides = sorted([i for i in (low, high) if 0 <= i < len(parts)], key=lambda i: (-scores[i], i))
+        grown = False
+        for i in sides:
+            if total + counts[i] <= max_tokens:
+                kept.add(i)
+                total += counts[i]
+                low, high = (i - 1, high) if i == low else (low, i + 1)
+                grown = True
+                break
+        if not grown:
+            break
+
+    pieces = []
+    for i in range(len(parts)):
+        if i in kept:
+            pieces.append(parts[i])
+        elif not pieces or pieces[-1] != OMITTED:
+            pieces.append(OMITTED)
+    return "\n".join(pieces)
+
+
+def _odstavec_key(part: str) -> str:
+    return text_hash(" ".join(fold(part).split()))
+
+
+@dataclass
+class PackedContext:
+    text: str
+    tokens: int
+    budget: int
+    paragraphs: int = 0
+    neighbours: int = 0
+    trimmed: int = 0
+    deduplicated: int = 0
+    dropped: int = 0
+
+    def usage(self) -> Dict[str, int]:
+        return {"tokens": self.tokens, "budget": self.budget, "paragraphs": self.paragraphs,
+                "neighbours": self.neighbours, "trimmed": self.trimmed, "deduplicated": self.deduplicated,
+                "dropped": self.dropped}
+
+
+# Neighbours closest to a reranked paragraph of the same law first, ties in rank order of that paragraph
+def _neighbour_order(hits: Sequence[Any], neighbours: Sequence[Any]) -> List[Any]:
+    anchors: Dict[str, List[Tuple[int, int]]] = {}
+    for rank, hit in enumerate(hits):
+        anchors.setdefault(hit.payload["staleURL"], []).append((rank, point_cislo(hit.payload)))
+
+    def key(point: Any) -> Tuple[int, int]:
+        cislo = point_cislo(point.payload)
+        return min(((abs(cislo - anchor), rank) for rank, anchor in anchors.get(point.payload["staleURL"], [])),
+                   default=(len(hits), len(hits)))
+
+    return sorted(neighbours, key=key)
+
+
+def pack_context(question: str, paragraphs: Sequence[Any], neighbours: Sequence[Any] = (),
+                 budget: int = CONTEXT_TOKEN_BUDGET, max_paragraph_tokens: int = MAX_PARAGRAPH_TOKENS) -> PackedContext:
+    question_terms = set(analyze(question))
+    packed = PackedContext(text="", tokens=0, budget=budget)
+    seen_ids, seen_texts, seen_odstavce = set(), set(), set()
+    blocks: List[Tuple[Any, str]] = []
+
+    candidates = [(point, False) for point in paragraphs] + [(point, True) for point in _neighbour_order(paragraphs, neighbours)]
+    for point, is_neighbour in candidates:
+        payload = point.payload
+        if point.id in seen_ids or paragraph_hash(point) in seen_texts:
+            packed.deduplicated += 1
+            continue
+        zneni = payload.get("zneni") or ""
+        tokens = paragraph_tokens(payload)
+        if is_neighbour:
+            # Leave out the odstavce the context already has
+            parts = split_odstavce(zneni)
+            new_parts = [part for part in parts if _odstavec_key(part) not in seen_odstavce]
+            if not new_parts:
+                packed.deduplicated += 1
+                continue
+            if len(new_parts) < len(parts):
+                packed.deduplicated += 1
+                zneni = "\n".join(new_parts)
+                tokens = count_tokens(zneni)
+
+        header_tokens = count_tokens(format_paragraph(payload, ""))
+        available = min(max_paragraph_tokens, budget - packed.tokens - header_tokens)
+        if tokens > available:
+            # Neighbours are only context, they are not cut to fit
+            if available < MIN_PARAGRAPH_TOKENS or (is_neighbour and tokens <= max_paragraph_tokens):
+                packed.dropped += 1
+                continue
+            zneni = trim_paragraph(zneni, question_terms, available)
+            tokens = count_tokens(zneni)
+            packed.trimmed += 1
+
+        seen_ids.add(point.id)
+        seen_texts.add(paragraph_hash(point))
+        seen_odstavce.update(_odstavec_key(part) for part in split_odstavce(zneni))
+        blocks.append((point, zneni))
+        packed.tokens += header_tokens + tokens
+        if is_neighbour:
+            packed.neighbours += 1
+        else:
+            packed.paragraphs += 1
+
+    # Paragraphs of one law read in order, laws in the order of their best reranked paragraph
+    law_order: Dict[str, int] = {}
+    for point, _ in blocks:
+        law_order.setdefault(point.payload["staleURL"], len(law_order))
+    blocks.sort(key=lambda block: (law_order[block[0].payload["staleURL"]], point_cislo(block[0].payload)))
+    packed.text = "\n".join([format_paragraph(point.payload, zneni) for point, zneni in blocks])
+    return packed
@@ -1,73 +1,121 @@
+# Token accounting of the Mongo corpus for embedding cost planning. Paragraphs are streamed from the
+# cursors (zneni only), encoded in batches on a process pool and their counts stored back on the
+# documents next to a hash of the text, so later runs only encode new or changed paragraphs.
+#   python count_tokens_in_mongo.py --db law_database --report token_report.json
+import json
 import logging
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 import tiktoken
-from pymongo import MongoClient
-from typing import List, Dict
-from pydantic import BaseModel
-
-
-
-# Define your data model
-class Paragraf(BaseModel):
-    cislo: str
-    zneni: str
-    law_name: str
-    year: str
-    isValid: bool
-    staleURL: str
-
-def extract_year_from_staleURL(staleURL: str) -> str:
-    try:
-        parts = staleURL.split('/')
-        if len(parts) > 2:
-            return parts[2]
-        return "Unknown"
-    except Exception as e:
-        logging.error(f"Error extracting year from staleURL {staleURL}: {e}")
-        return "Unknown"
-
-# Function to load data from MongoDB
-def load_paragraphs_from_mongodb(db_name: str) -> Dict[str, Paragraf]:
-    try:
-        client = MongoClient("mongodb://localhost:27017/")
-        db = client[db_name]
-        collection_names = db.list_collection_names()
-
-        paragraphs = {}
-        for collection_name in collection_names:
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from collection_schema import TOKEN_ENCODING as ENCODING_NAME, ZNENI_TOKENS_FIELD as TOKENS_FIELD, ZNENI_TOKENS_HASH_FIELD as HASH_FIELD
+from dedup import text_hash
+from mongo_writer import BulkWriter, get_mongo_client, paragraph_collections
+
+BATCH_SIZE = 1000
+
+_encoding = None
+
+
+# Runs in the pool workers, every process loads the encoding once
+def _count_batch(texts: List[str]) -> List[int]:
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding(ENCODING_NAME)
+    return [len(tokens) for tokens in _encoding.encode_ordinary_batch(texts, num_threads=1)]
+
+
+# (_id, zneni, hash) batches of the paragraphs whose stored count is missing or stale
+def iter_uncounted(collection: Collection, batch_size: int = BATCH_SIZE,
+                   recount: bool = False) -> Iterator[List[Tuple[Any, str, str]]]:
+    batch = []
+    cursor = collection.find({}, {"zneni": 1, HASH_FIELD: 1}).batch_size(batch_size)
+    for doc in cursor:
+        zneni = doc.get("zneni") or ""
+        digest = text_hash(zneni)
+        if not recount and doc.get(HASH_FIELD) == digest:
+            continue
+        batch.append((doc["_id"], zneni, digest))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Count the uncounted paragraphs of one collection, at most two batches per worker in flight
+def count_collection(collection: Collection, pool: ProcessPoolExecutor, workers: int,
+                     batch_size: int = BATCH_SIZE, recount: bool = False) -> int:
+    counted = 0
+    pending = deque()
+    with BulkWriter(collection) as writer:
+        def store(batch, future):
+            for (_id, _, digest), tokens in zip(batch, future.result()):
+                writer.add(UpdateOne({"_id": _id}, {"$set": {TOKENS_FIELD: tokens, HASH_FIELD: digest}}))
+            return len(batch)
+
+        for batch in iter_uncounted(collection, batch_size, recount):
+            pending.append((batch, pool.submit(_count_batch, [zneni for _, zneni, _ in batch])))
+            if len(pending) >= 2 * workers:
+                counted += store(*pending.popleft())
+        while pending:
+            counted += store(*pending.popleft())
+    return counted
+
+
+# Per-law token totals of one collection from the stored counts
+def law_totals(collection: Collection) -> List[Dict[str, Any]]:
+    pipeline = [
+        {"$group": {"_id": "$staleURL", "law_name": {"$first": "$law_name"},
+                    "paragraphs": {"$sum": 1}, "tokens": {"$sum": f"${TOKENS_FIELD}"}}},
+        {"$sort": {"tokens": -1}},
+    ]
+    return [{"staleURL": doc["_id"], "law_name": doc["law_name"], "paragraphs": doc["paragraphs"],
+             "tokens": doc["tokens"]} for doc in collection.aggregate(pipeline, allowDiskUse=True)]
+
+
+# Count what is missing and return the totals per field (Mongo collection) and per law
+def count_tokens(db_name: str = "law_database", workers: int = 4, batch_size: int = BATCH_SIZE,
+                 recount: bool = False, mongo_client=None) -> Dict[str, Any]:
+    db = (mongo_client or get_mongo_client())[db_name]
+    fields = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for collection_name in paragraph_collections(db):
             collection = db[collection_name]
-            for doc in collection.find():
-                year = extract_year_from_staleURL(doc['staleURL'])
-                paragraph = Paragraf(
-                    cislo=doc['cislo'],
-                    zneni=doc['zneni'],
-                    law_name=doc['law_name'],
-                    year=year,
-                    isValid=doc.get('isValid', None),
-                    staleURL=doc.get('staleURL', None)
-                )
-                key = f"{paragraph.cislo}|{paragraph.law_name}|{paragraph.year}"
-                paragraphs[key] = paragraph
-        return paragraphs
-    except Exception as e:
-        logging.error(f"Error loading data from MongoDB: {e}")
-        raise
-    
-def count_total_tokens(paragraphs: Dict[str, Paragraf]) -> int:
-    # Initialize tokenizer
-    encoding = tiktoken.get_encoding("cl100k_base")  # Use appropriate model encoding here
-
-    total_tokens = 0
-    for key, paragraph in paragraphs.items():
-        # Encode text to tokens
-        tokens = encoding.encode(paragraph.zneni)
-        # Count the number of tokens
-        total_tokens += len(tokens)
-    
-    return total_tokens
-
-# Example usage
+            counted = count_collection(collection, pool, workers, batch_size, recount)
+            laws = law_totals(collection)
+            fields[collection_name] = {
+                "paragraphs": sum(law["paragraphs"] for law in laws),
+                "tokens": sum(law["tokens"] for law in laws),
+                "laws": laws,
+            }
+            logging.info(f"'{collection_name}': {fields[collection_name]['tokens']} tokens in "
+                         f"{fields[collection_name]['paragraphs']} paragraphs, {counted} newly counted")
+    return {
+        "encoding": ENCODING_NAME,
+        "tokens": sum(field["tokens"] for field in fields.values()),
+        "paragraphs": sum(field["paragraphs"] for field in fields.values()),
+        "fields": fields,
+    }
+
+
 if __name__ == "__main__":
-    db_name = "law_database"
-    paragraphs = load_paragraphs_from_mongodb(db_name)
-    total_tokens = count_total_tokens(paragraphs)
-    print(f"Total number of tokens: {total_tokens}")
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="law_database")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--recount", action="store_true", help="Encode every paragraph, not just new or changed ones")
+    parser.add_argument("--report", help="Write the per-field and per-law totals to this JSON file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    report = count_tokens(args.db, args.workers, args.batch_size, args.recount)
+    for field_name, field in sorted(report["fields"].items(), key=lambda item: -item[1]["tokens"]):
+        print(f"{field_name}: {field['tokens']} tokens, {field['paragraphs']} paragraphs, {len(field['laws'])} laws")
+    print(f"Total number of tokens: {report['tokens']}")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
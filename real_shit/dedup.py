@@ -0,0 +1,26 @@
+import hashlib
+from typing import Any, List
+
+
+# Short stable hash of a paragraph text, stored in the payload as zneni_hash at ingest
+def text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def paragraph_hash(point: Any) -> str:
+    payload = point.payload
+    return payload.get("zneni_hash") or text_hash(payload["zneni"])
+
+
+# Drop points whose text was already seen, keeping the first (best ranked) one
+def remove_duplicates(paragraphs: List[Any]) -> List[Any]:
+    seen = set()
+    unique_paragraphs = []
+
+    for paragraph in paragraphs:
+        key = paragraph_hash(paragraph)
+        if key not in seen:
+            seen.add(key)
+            unique_paragraphs.append(paragraph)
+
+    return unique_paragraphs
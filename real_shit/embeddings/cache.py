@@ -0,0 +1,253 @@
+import os
+import re
+import time
+import fcntl
+import atexit
+import hashlib
+import logging
+import threading
+import unicodedata
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+import numpy as np
+
+CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "laws_rag", "embeddings"))
+DEFAULT_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "1000000"))
+KEY_SIZE = 20
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(model: str, input_type: Optional[str], text: str) -> bytes:
+    return hashlib.sha1(f"{model}\x00{input_type}\x00{normalize_text(text)}".encode("utf-8")).digest()
+
+
+# Persistent embedding cache keyed by (model, input_type, hash of normalized text).
+# Vectors live in a fixed-capacity memory-mapped .npy matrix, the index is a pair of
+# memory-mapped .npy arrays (key digests and last-use ticks). When the cache is full the least
+# recently used slots are evicted in bulk.
+# Several processes can share one cache directory (API workers, sync and ingest jobs): slot
+# allocation and eviction run under an exclusive lock on a lock file, and the index arrays are
+# shared mappings, so every process sees the slots the others claimed. A process keeps its own
+# key -> slot dict, each hit is checked against the shared keys and the dict is re-read when
+# other processes changed the index.
+class EmbeddingCache:
+    def __init__(self, path: str, dimension: int, max_entries: int = DEFAULT_MAX_ENTRIES, dtype: str = "float16",
+                 evict_fraction: float = 0.05, refresh_interval: float = 60.0):
+        self.path = path
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self.evict_count = max(1, int(max_entries * evict_fraction))
+        self.refresh_interval = refresh_interval
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._lock_file = open(os.path.join(path, "lock"), "a+")
+
+        with self._file_lock():
+            vectors_path = os.path.join(path, "vectors.npy")
+            keys_path = os.path.join(path, "keys.npy")
+            ticks_path = os.path.join(path, "ticks.npy")
+            generation_path = os.path.join(path, "generation.npy")
+            if os.path.exists(vectors_path):
+                self.vectors = np.load(vectors_path, mmap_mode="r+")
+                if self.vectors.shape != (max_entries, dimension) or self.vectors.dtype != self.dtype:
+                    raise ValueError(f"Embedding cache at {path} has shape {self.vectors.shape} {self.vectors.dtype}, "
+                                     f"expected {(max_entries, dimension)} {self.dtype}")
+                self.keys = np.load(keys_path, mmap_mode="r+")
+                self.ticks = np.load(ticks_path, mmap_mode="r+")
+            else:
+                self.vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=self.dtype, shape=(max_entries, dimension))
+                self.keys = np.lib.format.open_memmap(keys_path, mode="w+", dtype=np.uint8, shape=(max_entries, KEY_SIZE))
+                self.ticks = np.lib.format.open_memmap(ticks_path, mode="w+", dtype=np.int64, shape=(max_entries,))
+            # Bumped by every process that claims or evicts slots
+            if os.path.exists(generation_path):
+                self.generation = np.load(generation_path, mmap_mode="r+")
+            else:
+                self.generation = np.lib.format.open_memmap(generation_path, mode="w+", dtype=np.int64, shape=(1,))
+            self._load_slots()
+
+    @contextmanager
+    def _file_lock(self):
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    # Re-read key -> slot from the shared index. Tick 0 marks an empty slot.
+    def _load_slots(self):
+        used = np.flatnonzero(self.ticks > 0)
+        digests = self.keys[used].view(f"V{KEY_SIZE}").ravel().tolist()
+        self.slots: Dict[bytes, int] = dict(zip([bytes(digest) for digest in digests], used.tolist()))
+        self.seen_generation = int(self.generation[0])
+        self.loaded_at = time.monotonic()
+
+    def _refresh_slots(self):
+        if int(self.generation[0]) != self.seen_generation and time.monotonic() - self.loaded_at > self.refresh_interval:
+            self._load_slots()
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    # Called with the file lock held
+    def _evict(self, needed: int) -> np.ndarray:
+        used = np.flatnonzero(self.ticks > 0)
+        count = min(max(self.evict_count, needed), len(used))
+        oldest = used[np.argpartition(self.ticks[used], count - 1)[:count]]
+        for digest in self.keys[oldest]:
+            self.slots.pop(digest.tobytes(), None)
+        # Clear the keys before the freed slots get overwritten, so neither a crash nor a reader in
+        # another process can pair an old key with a new vector
+        self.keys[oldest] = 0
+        self.ticks[oldest] = 0
+        logging.debug(f"Evicted {count} entries from embedding cache {self.path}")
+        return oldest
+
+    def _slot_of(self, key: bytes) -> Optional[int]:
+        slot = self.slots.get(key)
+        if slot is not None and self.keys[slot].tobytes() != key:
+            # Evicted and reused by another process
+            del self.slots[key]
+            return None
+        return slot
+
+    def get_many(self, model: str, input_type: Optional[str], texts: Sequence[str]) -> List[Optional[List[float]]]:
+        results: List[Optional[List[float]]] = []
+        with self._lock:
+            self._refresh_slots()
+            for text in texts:
+                key = cache_key(model, input_type, text)
+                slot = self._slot_of(key)
+                vector = self.vectors[slot].astype(np.float32) if slot is not None else None
+                # The key is checked again after the copy, the slot may have been reused meanwhile
+                if vector is None or self.keys[slot].tobytes() != key:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                self.ticks[slot] = time.time_ns()
+                results.append(vector.tolist())
+        return results
+
+    def put_many(self, model: str, input_type: Optional[str], texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        with self._lock, self._file_lock():
+            entries = {cache_key(model, input_type, text): vector for text, vector in zip(texts, vectors)}
+            new_keys = [key for key in entries if self._slot_of(key) is None]
+            existing = [key for key in entries if key in self.slots]
+            free = np.flatnonzero(self.ticks == 0)[:len(new_keys)]
+            if len(free) < len(new_keys):
+                free = np.concatenate([free, self._evict(len(new_keys) - len(free))])[:len(new_keys)]
+            for key, slot in zip(new_keys, free.tolist()):
+                self.keys[slot] = 0
+                self.vectors[slot] = np.asarray(entries[key], dtype=self.dtype)
+                self.keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                self.ticks[slot] = time.time_ns()
+                self.slots[key] = slot
+            for key in existing:
+                if key in self.slots:
+                    self.ticks[self.slots[key]] = time.time_ns()
+            if new_keys:
+                self.generation[0] += 1
+                if int(self.generation[0]) == self.seen_generation + 1:
+                    # Nobody else changed the index since it was read, the dict is still complete
+                    self.seen_generation += 1
+
+    def flush(self):
+        with self._lock:
+            self.vectors.flush()
+            self.keys.flush()
+            self.ticks.flush()
+            self.generation.flush()
+
+    # Embed `texts` with `embed_fn`, calling it only for texts that are not cached yet
+    def embed(self, model: str, input_type: Optional[str], texts: Sequence[str],
+              embed_fn: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        results = self.get_many(model, input_type, texts)
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        if missing:
+            # Identical texts within one call are embedded once
+            unique: Dict[bytes, int] = {}
+            to_embed: List[str] = []
+            for i in missing:
+                key = cache_key(model, input_type, texts[i])
+                if key not in unique:
+                    unique[key] = len(to_embed)
+                    to_embed.append(texts[i])
+            embedded = embed_fn(to_embed)
+            self.put_many(model, input_type, to_embed, embedded)
+            for i in missing:
+                results[i] = list(embedded[unique[cache_key(model, input_type, texts[i])]])
+        return results
+
+    # Async variant of embed for coroutine embedders
+    async def aembed(self, model: str, input_type: Optional[str], texts: Sequence[str],
+                     embed_fn: Callable[[List[str]], Awaitable[List[List[float]]]]) -> List[List[float]]:
+        results = self.get_many(model, input_type, texts)
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        if missing:
+            to_embed = list(dict.fromkeys(texts[i] for i in missing))
+            embedded = dict(zip(to_embed, await embed_fn(to_embed)))
+            self.put_many(model, input_type, to_embed, [embedded[text] for text in to_embed])
+            for i in missing:
+                results[i] = list(embedded[texts[i]])
+        return results
+
+
+_caches: Dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+
+# Shared cache instance for a model, stored in CACHE_DIR/<model>
+def get_cache(model: str, dimension: int, max_entries: int = DEFAULT_MAX_ENTRIES) -> EmbeddingCache:
+    with _caches_lock:
+        if model not in _caches:
+            _caches[model] = EmbeddingCache(os.path.join(CACHE_DIR, model), dimension, max_entries=max_entries)
+        return _caches[model]
+
+
+# First embedding of `text` (a string or a list of strings, as the embed functions accept) through the
+# shared cache of `model`; `embed_fn` embeds the texts that are not cached yet
+def cached_embed(model: str, dimension: int, input_type: Optional[str], text,
+                 embed_fn: Callable[[List[str]], List[List[float]]]) -> List[float]:
+    texts = [text] if isinstance(text, str) else list(text)
+    return get_cache(model, dimension).embed(model, input_type, texts, embed_fn)[0]
+
+
+# Async variant of cached_embed for coroutine embedders
+async def acached_embed(model: str, dimension: int, input_type: Optional[str], text,
+                        embed_fn: Callable[[List[str]], Awaitable[List[List[float]]]]) -> List[float]:
+    texts = [text] if isinstance(text, str) else list(text)
+    return (await get_cache(model, dimension).aembed(model, input_type, texts, embed_fn))[0]
+
+
+@atexit.register
+def flush_all():
+    for cache in list(_caches.values()):
+        cache.flush()
+
+
+# Embedder wrapper that serves previously seen texts from the cache
+class CachedEmbedder:
+    def __init__(self, embedder, cache: Optional[EmbeddingCache] = None):
+        self.embedder = embedder
+        self.cache = cache or get_cache(embedder.model, embedder.dimension)
+        self.model = embedder.model
+        self.dimension = embedder.dimension
+        self.max_batch_size = embedder.max_batch_size
+        self.max_batch_tokens = embedder.max_batch_tokens
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        return self.embedder.count_tokens(texts)
+
+    def embed(self, texts: List[str], input_type: str = "document") -> List[List[float]]:
+        return self.cache.embed(self.model, input_type, texts, lambda missing: self.embedder.embed(missing, input_type=input_type))
@@ -0,0 +1,80 @@
+import time
+import hashlib
+from typing import List, Iterator, Sequence, Tuple
+import numpy as np
+from voyageai import Client
+
+VOYAGE_MODEL = "voyage-multilingual-2"
+VOYAGE_DIMENSION = 1024
+# Limits of a single vo.embed request for voyage-multilingual-2
+VOYAGE_MAX_BATCH_SIZE = 128
+VOYAGE_MAX_BATCH_TOKENS = 120_000
+
+
+# Embedder backed by the Voyage API, embeds a whole batch in one request
+class VoyageEmbedder:
+    def __init__(self, model: str = VOYAGE_MODEL, client: Client = None):
+        self.model = model
+        self.dimension = VOYAGE_DIMENSION
+        self.max_batch_size = VOYAGE_MAX_BATCH_SIZE
+        self.max_batch_tokens = VOYAGE_MAX_BATCH_TOKENS
+        self.client = client or Client()
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        return [len(encoding.ids) for encoding in self.client.tokenize(texts)]
+
+    def embed(self, texts: List[str], input_type: str = "document") -> List[List[float]]:
+        result = self.client.embed(texts, model=self.model, input_type=input_type)
+        return result.embeddings
+
+
+# Offline stand-in for VoyageEmbedder. Returns deterministic unit vectors derived
+# from the text hash and optionally sleeps to simulate the API round-trip.
+class HashEmbedder:
+    def __init__(self, dimension: int = VOYAGE_DIMENSION, latency: float = 0.0, latency_per_1k_tokens: float = 0.0,
+                 max_batch_size: int = VOYAGE_MAX_BATCH_SIZE, max_batch_tokens: int = VOYAGE_MAX_BATCH_TOKENS):
+        self.model = f"hash-{dimension}"
+        self.dimension = dimension
+        self.latency = latency
+        self.latency_per_1k_tokens = latency_per_1k_tokens
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        # Rough estimate for Czech text, good enough for batching
+        return [max(1, len(text) // 3) for text in texts]
+
+    def embed(self, texts: List[str], input_type: str = "document") -> List[List[float]]:
+        if self.latency or self.latency_per_1k_tokens:
+            tokens = sum(self.count_tokens(texts))
+            time.sleep(self.latency + self.latency_per_1k_tokens * tokens / 1000)
+        embeddings = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(f"{input_type}\x00{text}".encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+            vector /= np.linalg.norm(vector)
+            embeddings.append(vector.tolist())
+        return embeddings
+
+
+# Group texts into batches that respect both the request size and token limits.
+# Yields lists of indices into `token_counts`; a text over the token budget gets a batch of its own.
+def batch_by_tokens(token_counts: Sequence[int], max_batch_tokens: int, max_batch_size: int) -> Iterator[List[int]]:
+    batch: List[int] = []
+    batch_tokens = 0
+    for i, tokens in enumerate(token_counts):
+        if batch and (batch_tokens + tokens > max_batch_tokens or len(batch) >= max_batch_size):
+            yield batch
+            batch = []
+            batch_tokens = 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+# Convenience wrapper returning (batch texts, batch indices) pairs for an embedder
+def iter_batches(embedder, texts: List[str]) -> Iterator[Tuple[List[str], List[int]]]:
+    token_counts = embedder.count_tokens(texts)
+    for indices in batch_by_tokens(token_counts, embedder.max_batch_tokens, embedder.max_batch_size):
+        yield [texts[i] for i in indices], indices
@@ -1,33 +1,43 @@
 import os
-from voyageai import Client
-import voyageai.error as error
 from typing import List, Optional
 from dotenv import load_dotenv
+from embeddings.cache import acached_embed
 
 
 VOYAGE_API_KEY = os.getenv("VOYAGE_API_KEY")
 load_dotenv()
 
+_client = None
+
+# One Voyage client for the lifetime of the process, voyageai is imported with it
 def serve_async_client():
-    try:
-        client = Client(api_key=VOYAGE_API_KEY)
-        return client
-    except:
-        raise error.VoyageError("Error serving Voyage client")
-    
+    global _client
+    if _client is None:
+        from voyageai import AsyncClient
+        import voyageai.error as error
+        try:
+            _client = AsyncClient(api_key=VOYAGE_API_KEY or os.getenv("VOYAGE_API_KEY"))
+        except Exception:
+            raise error.VoyageError("Error serving Voyage client")
+    return _client
+
 
 async def embed(text: List[str], input_type: str = "query"):
     vo = serve_async_client()
-    result = vo.embed(text, model="voyage-multilingual-2", input_type=input_type)
-    return result.embeddings[0]
+
+    async def embed_missing(missing: List[str]) -> List[List[float]]:
+        result = await vo.embed(missing, model="voyage-multilingual-2", input_type=input_type)
+        return result.embeddings
+
+    return await acached_embed("voyage-multilingual-2", 1024, input_type, text, embed_missing)
 
 async def rerank(query: str, documents: List[str], model: str, top_k: Optional[int] = None, truncation: bool = True):
     vo = serve_async_client()
-    reranking_object =  vo.rerank(
+    reranking_object = await vo.rerank(
         query=query,
         documents=documents,
         model=model,
         top_k=top_k,
         truncation=truncation
     )
-    return reranking_object.results
\ No newline at end of file
+    return reranking_object.results
@@ -0,0 +1,153 @@
+import os
+import re
+import random
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote
+import httpx
+from aiolimiter import AsyncLimiter
+
+API_URL = os.getenv("ESBIRKA_API_URL", "https://api.e-sbirka.cz")
+API_KEY = os.getenv("ESBIRKA_API_KEY", "0zIAcHQyAcqhlxxExaJqjsAeiZaocXgVKifkIAtuuzqgtmwgclGDCQbtsyovsBIij")
+MAX_PAGES = 50
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+num_pattern = r'\d+'
+text_pattern = r'<[^>]+>'
+
+
+# Turn the link of a law on zakonyprolidi.cz (.../cs/2012-89) into an e-Sbírka document sign
+def sign_from_link(link: str) -> str:
+    val = link.split('/')[-1]
+    sign = val.split('-')
+    return "%2Fsb%2F"+sign[0]+"%2F"+sign[1]+"%2F0000-00-00"
+
+
+# Assemble (cislo, zneni) pairs from the fragments of one page, same rules as the original crawler
+def assemble_paragraphs(fragments: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
+    paragraphs = []
+    current_paragraph_number = None
+    current_paragraph_text = ""
+    for fragment in fragments:
+        if fragment['kodTypuFragmentu'] == 'Paragraf':
+            if current_paragraph_number is not None:
+                # Save the current paragraph before starting a new one
+                paragraphs.append((current_paragraph_number, current_paragraph_text.strip()))
+            # Start a new paragraph
+            match = re.search(num_pattern, fragment['xhtml'])
+            if match is None:
+                raise ValueError("Paragraf number not found")
+            current_paragraph_number = match.group()
+            current_paragraph_text = ""
+        else:
+            # Append fragment text to the current paragraph
+            cleaned_text = re.sub(text_pattern, '', fragment.get('xhtml', ''))
+            current_paragraph_text += cleaned_text + "\n"
+    # Save the last paragraph if it exists
+    if current_paragraph_number is not None:
+        paragraphs.append((current_paragraph_number, current_paragraph_text.strip()))
+    return paragraphs
+
+
+class EsbirkaError(Exception):
+    pass
+
+
+# Async e-Sbírka API client with one keep-alive connection pool, a bound on concurrent
+# requests, a requests-per-second limiter and retries with exponential backoff
+class EsbirkaClient:
+    def __init__(self, base_url: str = API_URL, api_key: str = API_KEY, concurrency: int = 16,
+                 rate_limit: float = 20.0, retries: int = 4, backoff: float = 0.5, timeout: float = 30.0,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.limiter = AsyncLimiter(rate_limit, 1)
+        self.client = httpx.AsyncClient(
+            headers={"esel-api-access-key": api_key},
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            timeout=timeout,
+            transport=transport,
+        )
+        self.requests = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def get_json(self, path: str) -> Dict[str, Any]:
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.semaphore:
+                    async with self.limiter:
+                        self.requests += 1
+                        response = await self.client.get(url)
+                if response.status_code not in RETRY_STATUSES:
+                    return response.json()
+                error = EsbirkaError(f"HTTP {response.status_code} for {url}")
+            except (httpx.TransportError, ValueError) as e:
+                error = e
+            if attempt == self.retries:
+                raise EsbirkaError(f"Giving up on {url} after {attempt + 1} attempts: {error}")
+            delay = self.backoff * 2 ** attempt * (1 + random.random())
+            logging.debug(f"Retrying {url} in {delay:.2f}s: {error}")
+            await asyncio.sleep(delay)
+
+    async def get_document(self, sign: str) -> Dict[str, Any]:
+        return await self.get_json(f"/dokumenty-sbirky/{sign}")
+
+    # Related documents of a document, e.g. its republished full versions
+    async def get_souvislosti(self, staleURL: str) -> Dict[str, Any]:
+        return await self.get_json(f"/dokumenty-sbirky/{quote(staleURL, safe='')}/souvislosti")
+
+    async def get_fragment_page(self, sign: str, page: int) -> Dict[str, Any]:
+        return await self.get_json(f"/dokumenty-sbirky/{sign}/fragmenty?cisloStranky={page}")
+
+    # Fetch fragment pages of a document. When the API reports the page count the remaining
+    # pages are fetched concurrently, otherwise pages are read one by one until the first error
+    # or empty page.
+    async def get_fragment_pages(self, sign: str, max_pages: int = MAX_PAGES) -> List[List[Dict[str, Any]]]:
+        first = await self.get_fragment_page(sign, 0)
+        if first.get('chyby') is not None or not first.get('seznam'):
+            return []
+        page_count = first.get('pocetStranek')
+        if page_count is not None:
+            rest = await asyncio.gather(*[self.get_fragment_page(sign, i) for i in range(1, min(page_count, max_pages))])
+            return [first['seznam']] + [page['seznam'] for page in rest if page.get('chyby') is None]
+        pages = [first['seznam']]
+        for i in range(1, max_pages):
+            response = await self.get_fragment_page(sign, i)
+            if response.get('chyby') is not None or not response.get('seznam'):
+                break
+            pages.append(response['seznam'])
+        return pages
+
+    # Fetch the document detail and its paragraphs. Returns None for unknown documents.
+    async def get_law(self, sign: str) -> Optional[Dict[str, Any]]:
+        res = await self.get_document(sign)
+        if res.get('nazev') is None:
+            return None
+        pages = await self.get_fragment_pages(sign)
+        paragraphs = []
+        for fragments in pages:
+            paragraphs.extend(assemble_paragraphs(fragments))
+        return {"detail": res, "paragraphs": paragraphs}
+
+
+# Fetch many laws concurrently, preserving the input order. Failed laws are logged and returned as None.
+async def fetch_laws(signs: List[str], client: EsbirkaClient) -> List[Optional[Dict[str, Any]]]:
+    async def fetch(sign: str):
+        try:
+            return await client.get_law(sign)
+        except Exception as e:
+            logging.error(f"Failed to fetch law details for {sign}: {e}")
+            return None
+    return await asyncio.gather(*[fetch(sign) for sign in signs])
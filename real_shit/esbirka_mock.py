@@ -0,0 +1,139 @@
+# Local mock of the e-Sbírka API used by benchmarks and offline runs of the crawlers.
+# In-process: EsbirkaClient(transport=MockEsbirka(...).transport())
+# Over HTTP:  python esbirka_mock.py --port 8081, then ESBIRKA_API_URL=http://localhost:8081
+import random
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote, parse_qs
+import httpx
+
+PAGE_SIZE = 100
+
+
+class MockEsbirka:
+    def __init__(self, laws: Optional[Dict[str, Dict[str, Any]]] = None, latency: float = 0.0,
+                 error_rate: float = 0.0, report_page_count: bool = True, seed: int = 0):
+        # staleUrl -> {"nazev", "staleUrl", "datumZruseni", "fragments": [...]}
+        self.laws = laws if laws is not None else generate_laws(50, seed=seed)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.report_page_count = report_page_count
+        self.random = random.Random(seed)
+        self.requests = 0
+
+    # Route a request path (already unquoted) to a (status, json) response
+    def handle(self, path: str, query: Dict[str, List[str]]) -> Tuple[int, Dict[str, Any]]:
+        self.requests += 1
+        if self.error_rate and self.random.random() < self.error_rate:
+            return 503, {"chyby": [{"kod": "SLUZBA_NEDOSTUPNA"}]}
+        if not path.startswith("/dokumenty-sbirky/"):
+            return 404, {"chyby": [{"kod": "NENALEZENO"}]}
+        rest = path[len("/dokumenty-sbirky/"):]
+        endpoint = None
+        for suffix in ("/fragmenty", "/souvislosti"):
+            if rest.endswith(suffix):
+                rest, endpoint = rest[:-len(suffix)], suffix
+        law = self.find(rest)
+        if law is None:
+            return 404, {"chyby": [{"kod": "DOKUMENT_NENALEZEN"}]}
+        if endpoint is None:
+            return 200, {key: value for key, value in law.items() if key != "fragments"}
+        if endpoint == "/souvislosti":
+            state = "ZRUSENY" if law.get("datumZruseni") else "PLATNY"
+            return 200, {"souvislosti": [{"typ": "UPLNA_ZNENI_REPUBLIKOVAN",
+                                          "dokumentySbirky": [{"stavDokumentuSbirky": state}]}]}
+        page = int(query.get("cisloStranky", ["0"])[0])
+        fragments = law["fragments"][page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+        if not fragments:
+            return 400, {"chyby": [{"kod": "STRANKA_NEEXISTUJE"}]}
+        body = {"seznam": fragments}
+        if self.report_page_count:
+            body["pocetStranek"] = (len(law["fragments"]) + PAGE_SIZE - 1) // PAGE_SIZE
+        return 200, body
+
+    # Documents are addressed either by their staleUrl or by the /sb/<year>/<number>/0000-00-00 sign
+    def find(self, sign: str) -> Optional[Dict[str, Any]]:
+        if sign in self.laws:
+            return self.laws[sign]
+        parts = sign.strip("/").split("/")
+        if len(parts) >= 3:
+            return self.laws.get(f"/{parts[0]}/{parts[1]}/{parts[2]}")
+        return None
+
+    async def _handle_httpx(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        path = unquote(request.url.raw_path.decode().split("?")[0])
+        status, body = self.handle(path, parse_qs(request.url.query.decode()))
+        return httpx.Response(status, json=body)
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self._handle_httpx)
+
+
+def _law(rng: random.Random, staleUrl: str, number: str, year: int, repealed_fraction: float) -> Dict[str, Any]:
+    fragments = []
+    for cislo in range(1, min(int(rng.lognormvariate(3.5, 1.0)), 3000) + 2):
+        fragments.append({"kodTypuFragmentu": "Paragraf", "xhtml": f"§ {cislo}"})
+        for odstavec in range(rng.randint(1, 4)):
+            fragments.append({"kodTypuFragmentu": "Odstavec_Dc",
+                              "xhtml": f"<p>({odstavec + 1}) Text odstavce {odstavec + 1} paragrafu {cislo} zákona {number}/{year}.</p>"})
+    return {
+        "nazev": f"Zákon č. {number}/{year} Sb.",
+        "staleUrl": staleUrl,
+        "datumZruseni": "2020-01-01" if rng.random() < repealed_fraction else None,
+        "fragments": fragments,
+    }
+
+
+# Synthetic laws with a long-tailed number of paragraphs
+def generate_laws(count: int, seed: int = 0, repealed_fraction: float = 0.1) -> Dict[str, Dict[str, Any]]:
+    rng = random.Random(seed)
+    laws = {}
+    for i in range(count):
+        year = rng.randint(1950, 2024)
+        staleUrl = f"/sb/{year}/{i + 1}"
+        laws[staleUrl] = _law(rng, staleUrl, str(i + 1), year, repealed_fraction)
+    return laws
+
+
+# Collections numbered like the real ones: 1..n in every year and prefix, with a few numbers missing
+def generate_collection(years: List[int], per_year: int, prefixes: List[str] = ("sb",), seed: int = 0,
+                        missing_fraction: float = 0.05, repealed_fraction: float = 0.1) -> Dict[str, Dict[str, Any]]:
+    rng = random.Random(seed)
+    laws = {}
+    for prefix in prefixes:
+        for year in years:
+            for number in range(1, rng.randint(1, per_year) + 1):
+                if rng.random() < missing_fraction:
+                    continue
+                staleUrl = f"/{prefix}/{year}/{number}"
+                laws[staleUrl] = _law(rng, staleUrl, str(number), year, repealed_fraction)
+    return laws
+
+
+def create_app(mock: MockEsbirka):
+    from aiohttp import web
+
+    async def handler(request: web.Request) -> web.Response:
+        if mock.latency:
+            await asyncio.sleep(mock.latency)
+        path = unquote(request.raw_path.split("?")[0])
+        status, body = mock.handle(path, parse_qs(request.query_string))
+        return web.json_response(body, status=status)
+
+    app = web.Application()
+    app.router.add_route("GET", "/{tail:.*}", handler)
+    return app
+
+
+if __name__ == "__main__":
+    from aiohttp import web
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--laws", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    web.run_app(create_app(MockEsbirka(generate_laws(args.laws), latency=args.latency, error_rate=args.error_rate)), port=args.port)
@@ -0,0 +1,141 @@
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from pydantic import BaseModel
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import PointStruct
+from embeddings.embedders import batch_by_tokens
+
+
+# A single paragraph ready to be embedded and stored as a Qdrant point
+class PipelineItem(BaseModel):
+    id: Union[int, str]
+    text: str
+    payload: Dict[str, Any]
+
+
+class PipelineStats(BaseModel):
+    paragraphs: int = 0
+    batches: int = 0
+    tokens: int = 0
+    skipped: int = 0
+    failed: int = 0
+    upserts: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def paragraphs_per_second(self) -> float:
+        return self.paragraphs / self.elapsed if self.elapsed else 0.0
+
+
+# Embeds paragraphs in token-budgeted batches on a bounded pool of workers and streams
+# the resulting points into Qdrant as large upsert batches on a second pool.
+class EmbeddingPipeline:
+    def __init__(self, embedder, client: QdrantClient, collection_name: str,
+                 embed_workers: int = 4, upsert_workers: int = 2, upsert_batch_size: int = 512,
+                 max_batch_tokens: Optional[int] = None, max_batch_size: Optional[int] = None,
+                 read_ahead: int = 4096, log_every: float = 10.0,
+                 on_stored: Optional[Callable[[List[PointStruct]], None]] = None):
+        self.embedder = embedder
+        self.client = client
+        self.collection_name = collection_name
+        self.embed_workers = embed_workers
+        self.upsert_workers = upsert_workers
+        self.upsert_batch_size = upsert_batch_size
+        self.max_batch_tokens = max_batch_tokens or embedder.max_batch_tokens
+        self.max_batch_size = max_batch_size or embedder.max_batch_size
+        self.read_ahead = read_ahead
+        self.log_every = log_every
+        # Called from the submitting thread with every batch of points Qdrant acknowledged
+        self.on_stored = on_stored
+
+    def _embed_batch(self, items: List[PipelineItem]) -> List[PointStruct]:
+        embeddings = self.embedder.embed([item.text for item in items], input_type="document")
+        return [PointStruct(id=item.id, vector=embedding, payload=item.payload) for item, embedding in zip(items, embeddings)]
+
+    def _upsert(self, points: List[PointStruct]) -> List[PointStruct]:
+        self.client.upsert(collection_name=self.collection_name, points=points, wait=True)
+        return points
+
+    # Split one read-ahead window into token-budgeted batches
+    def _batches(self, window: List[PipelineItem]) -> Iterable[Tuple[List[PipelineItem], int]]:
+        token_counts = self.embedder.count_tokens([item.text for item in window])
+        for indices in batch_by_tokens(token_counts, self.max_batch_tokens, self.max_batch_size):
+            yield [window[i] for i in indices], sum(token_counts[i] for i in indices)
+
+    def _windows(self, items: Iterable[PipelineItem], stats: PipelineStats) -> Iterable[List[PipelineItem]]:
+        window = []
+        for item in items:
+            if not item.text:
+                logging.warning(f"Skipping empty paragraph: {item.id}")
+                stats.skipped += 1
+                continue
+            window.append(item)
+            if len(window) >= self.read_ahead:
+                yield window
+                window = []
+        if window:
+            yield window
+
+    def run(self, items: Iterable[PipelineItem]) -> PipelineStats:
+        stats = PipelineStats()
+        start = time.perf_counter()
+        last_log = start
+        buffer: List[PointStruct] = []
+        embed_pending: Dict[Future, List[PipelineItem]] = {}
+        upsert_pending: deque = deque()
+
+        with ThreadPoolExecutor(self.embed_workers) as embed_pool, ThreadPoolExecutor(self.upsert_workers) as upsert_pool:
+
+            def flush(force: bool = False):
+                nonlocal buffer
+                while len(buffer) >= self.upsert_batch_size or (force and buffer):
+                    chunk, buffer = buffer[:self.upsert_batch_size], buffer[self.upsert_batch_size:]
+                    upsert_pending.append((upsert_pool.submit(self._upsert, chunk), len(chunk)))
+                # Keep at most two rounds of upserts in flight so memory stays bounded
+                while len(upsert_pending) > 2 * self.upsert_workers or (force and upsert_pending):
+                    future, size = upsert_pending.popleft()
+                    try:
+                        points = future.result()
+                        stats.paragraphs += len(points)
+                        stats.upserts += 1
+                        if self.on_stored:
+                            self.on_stored(points)
+                    except Exception as e:
+                        stats.failed += size
+                        logging.error(f"Error upserting points into '{self.collection_name}': {e}")
+
+            def collect(return_when):
+                nonlocal last_log
+                done, _ = wait(list(embed_pending), return_when=return_when)
+                for future in done:
+                    batch = embed_pending.pop(future)
+                    try:
+                        buffer.extend(future.result())
+                    except Exception as e:
+                        stats.failed += len(batch)
+                        logging.error(f"Error embedding batch starting with paragraph {batch[0].id}: {e}")
+                flush()
+                now = time.perf_counter()
+                if now - last_log >= self.log_every:
+                    last_log = now
+                    logging.info(f"Stored {stats.paragraphs} paragraphs, {stats.paragraphs / (now - start):.1f} paragraphs/s")
+
+            for window in self._windows(items, stats):
+                for batch, tokens in self._batches(window):
+                    # Bound the number of batches in flight to the worker count
+                    while len(embed_pending) >= self.embed_workers:
+                        collect(FIRST_COMPLETED)
+                    embed_pending[embed_pool.submit(self._embed_batch, batch)] = batch
+                    stats.batches += 1
+                    stats.tokens += tokens
+            while embed_pending:
+                collect(FIRST_COMPLETED)
+            flush(force=True)
+
+        stats.elapsed = time.perf_counter() - start
+        logging.info(f"Stored {stats.paragraphs} paragraphs in {stats.batches} embed batches and {stats.upserts} upserts, "
+                     f"{stats.paragraphs_per_second:.1f} paragraphs/s, {stats.failed} failed, {stats.skipped} skipped")
+        return stats
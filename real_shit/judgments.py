@@ -0,0 +1,294 @@
+# Ingest of the court decisions crawled by crawl_zakony_pro_lidi.py into their own Qdrant collection.
+# A decision is split along its structure (právní věta, výrok, odůvodnění and its numbered parts),
+# numbered points are kept whole where they fit and packed into chunks of up to --max-tokens, and the
+# chunks are embedded in token-budgeted batches by the EmbeddingPipeline. Only decisions whose text
+# changed since the last run are chunked and embedded again.
+#   python judgments.py --input ../data/judgments
+import os
+import re
+import glob
+import json
+import logging
+import argparse
+from datetime import date
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from pydantic import BaseModel
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import PointIdsList, PointStruct
+from embeddings.embedders import VoyageEmbedder, VOYAGE_DIMENSION
+from embeddings.cache import CachedEmbedder, flush_all
+from ingest_pipeline import EmbeddingPipeline, PipelineItem
+from query_cache import bump_collection_version
+from sync import DELETE_BATCH_SIZE, paragraph_point_id
+from collection_schema import JUDGMENTS_COLLECTION, JUDGMENT_PAYLOAD_INDEXES, ZNENI_TOKENS_FIELD, provision_collection
+from context_packer import count_tokens, get_encoding
+from lexical_index import fold
+from dedup import text_hash
+from quantization import QUANTIZATION_KINDS
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "judgments")
+# Bumped whenever the chunking changes, so the next ingest re-chunks every decision
+CHUNKER_VERSION = 1
+JUDGMENT_CHUNK_TOKENS = 512
+STATE_FILE = "ingested.json"
+
+COURT_NAMES = {"nejvyssi_soud": "Nejvyšší soud", "nejvyssi_spravni_soud": "Nejvyšší správní soud",
+               "ustavni_soud": "Ústavní soud"}
+# Section headings, folded and without spaces: decisions often space them out ("O d ů v o d n ě n í :").
+# The výrok follows the name of the decision or "Jménem republiky".
+SECTION_TITLES = {"pravniveta": "Právní věta", "vyrok": "Výrok", "rozsudek": "Výrok", "usneseni": "Výrok",
+                  "nalez": "Výrok", "jmenemrepubliky": "Výrok", "oduvodneni": "Odůvodnění",
+                  "pouceni": "Poučení", "odlisnestanovisko": "Odlišné stanovisko"}
+# "I." or "II. Dovolání" on its own line, a part of the odůvodnění
+ROMAN_RE = re.compile(r"^[IVX]+\.(\s|$)")
+# Start of a numbered point: "[12]", "12." or "II."
+POINT_RE = re.compile(r"^(\[\d+\]|\d+\.|[IVX]+\.)\s")
+SENTENCE_RE = re.compile(r"(?<=[.;:])\s+")
+SPISOVA_ZNACKA_RE = re.compile(r"sp\.\s*zn\.\s*([^,\n]+)", re.IGNORECASE)
+DATE_RE = re.compile(r"ze dne\s+(\d{1,2})\.\s*(\d{1,2})\.\s*(\d{4})")
+
+
+def section_title(line: str, current: str) -> Optional[str]:
+    compact = re.sub(r"[\W_]", "", fold(line))
+    if compact in SECTION_TITLES:
+        return SECTION_TITLES[compact]
+    # In the výrok the same numerals number the operative points
+    if current.startswith(SECTION_TITLES["oduvodneni"]) and len(line) <= 120 and ROMAN_RE.match(line):
+        return f"{SECTION_TITLES['oduvodneni']}, {line}"
+    return None
+
+
+# (section, numbered points) of a decision; a point is a numbered line with the lines that follow it
+def split_sections(text: str) -> List[Tuple[str, List[str]]]:
+    sections: List[Tuple[str, List[str]]] = [("", [])]
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        title = section_title(line, sections[-1][0])
+        if title is not None:
+            sections.append((title, []))
+        elif sections[-1][0].endswith(".") and not sections[-1][1] and not POINT_RE.match(line) and len(line) <= 120:
+            # The name of a part on the line after its numeral: "II." then "Dovolání"
+            sections[-1] = (f"{sections[-1][0]} {line}", [])
+        elif POINT_RE.match(line) or not sections[-1][1]:
+            sections[-1][1].append(line)
+        else:
+            sections[-1][1][-1] += "\n" + line
+    return [(title, points) for title, points in sections if points]
+
+
+# A point longer than max_tokens split at sentence ends, a sentence longer than that at token boundaries
+def split_point(point: str, max_tokens: int) -> List[str]:
+    if count_tokens(point) <= max_tokens:
+        return [point]
+    pieces, current = [], ""
+    for sentence in SENTENCE_RE.split(point):
+        if count_tokens(sentence) > max_tokens:
+            tokens = get_encoding().encode_ordinary(sentence)
+            parts = [get_encoding().decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+        else:
+            parts = [sentence]
+        for part in parts:
+            candidate = f"{current} {part}" if current else part
+            if current and count_tokens(candidate) > max_tokens:
+                pieces.append(current)
+                candidate = part
+            current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+# (section, text) chunks of a decision. Points are packed in order and never cross a section.
+def chunk_judgment(text: str, max_tokens: int = JUDGMENT_CHUNK_TOKENS) -> List[Tuple[str, str]]:
+    chunks = []
+    for section, points in split_sections(text):
+        current, current_tokens = [], 0
+        for point in points:
+            for piece in split_point(point, max_tokens):
+                tokens = count_tokens(piece)
+                if current and current_tokens + tokens > max_tokens:
+                    chunks.append((section, "\n".join(current)))
+                    current, current_tokens = [], 0
+                current.append(piece)
+                current_tokens += tokens
+        if current:
+            chunks.append((section, "\n".join(current)))
+    return chunks
+
+
+# Title (the first line), spisová značka and the decision date, when the text has them
+def judgment_metadata(record: Dict[str, Any]) -> Dict[str, Any]:
+    text = record["text"]
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    metadata = {"title": lines[0] if lines else record["key"]}
+    match = SPISOVA_ZNACKA_RE.search(text)
+    if match:
+        metadata["spisova_znacka"] = match.group(1).strip()
+    match = DATE_RE.search(text)
+    if match:
+        day, month, year = (int(group) for group in match.groups())
+        try:
+            metadata["date"] = date(year, month, day).isoformat()
+        except ValueError:
+            pass
+    return metadata
+
+
+def judgment_payload(record: Dict[str, Any], metadata: Dict[str, Any], index: int, section: str, text: str) -> Dict[str, Any]:
+    payload = {
+        "kind": "judgment",
+        "court": record["court"],
+        "court_name": COURT_NAMES.get(record["court"], record["court"]),
+        "judgment_id": record["key"],
+        "staleURL": record["link"],
+        "cislo": str(index),
+        "cislo_num": index,
+        "law_name": metadata["title"],
+        "section": section,
+        "zneni": text,
+        "zneni_hash": text_hash(text),
+        ZNENI_TOKENS_FIELD: count_tokens(text),
+        "isValid": True,
+    }
+    payload.update({key: metadata[key] for key in ("spisova_znacka", "date") if key in metadata})
+    return payload
+
+
+# Points of one decision. The embedded text leads with the court, title and section so a chunk
+# from the middle of an odůvodnění still says where it comes from.
+def judgment_items(record: Dict[str, Any], max_tokens: int = JUDGMENT_CHUNK_TOKENS) -> List[PipelineItem]:
+    metadata = judgment_metadata(record)
+    items = []
+    for index, (section, text) in enumerate(chunk_judgment(record["text"], max_tokens)):
+        payload = judgment_payload(record, metadata, index, section, text)
+        header = f"{payload['court_name']}, {metadata['title']}\n{section}".rstrip()
+        items.append(PipelineItem(id=paragraph_point_id(record["link"], str(index)), text=f"{header}\n{text}", payload=payload))
+    return items
+
+
+def judgment_fingerprint(record: Dict[str, Any], max_tokens: int) -> str:
+    return text_hash(f"v{CHUNKER_VERSION}\x00{max_tokens}\x00{record['link']}\x00{record['text']}")
+
+
+def iter_records(input_dir: str) -> Iterator[Dict[str, Any]]:
+    for path in sorted(glob.glob(os.path.join(input_dir, "*.jsonl"))):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+# Decision key -> {"fingerprint", "chunks"} of everything stored in the collection
+class IngestState:
+    def __init__(self, path: str):
+        self.path = path
+        self.decisions: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.decisions = json.load(f)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.decisions, f)
+        os.replace(tmp_path, self.path)
+
+
+class IngestReport(BaseModel):
+    decisions: int = 0
+    changed: int = 0
+    unchanged: int = 0
+    chunks: int = 0
+    removed: int = 0
+    failed: int = 0
+
+
+def ingest_judgments(input_dir: str = INPUT_DIR, collection_name: str = JUDGMENTS_COLLECTION,
+                     qdrant_client: QdrantClient = None, embedder=None, max_tokens: int = JUDGMENT_CHUNK_TOKENS,
+                     dry_run: bool = False, quantization: Optional[str] = None,
+                     embed_workers: int = 4, upsert_workers: int = 2) -> IngestReport:
+    qdrant_client = qdrant_client or QdrantClient(host="localhost", port=6333)
+    state = IngestState(os.path.join(input_dir, STATE_FILE))
+    report = IngestReport()
+    if not dry_run:
+        dimension = embedder.dimension if embedder else VOYAGE_DIMENSION
+        if provision_collection(qdrant_client, collection_name, dimension=dimension, quantization=quantization,
+                                indexes=JUDGMENT_PAYLOAD_INDEXES):
+            # A new collection holds nothing, forget whatever was ingested before
+            state.decisions = {}
+
+    # Decision key -> (fingerprint, point ids) of the decisions embedded in this run
+    pending: Dict[str, Tuple[str, List[str]]] = {}
+    removed: List[str] = []
+
+    def changed_items(records: Iterable[Dict[str, Any]]) -> Iterator[PipelineItem]:
+        for record in records:
+            if not record.get("text"):
+                continue
+            report.decisions += 1
+            fingerprint = judgment_fingerprint(record, max_tokens)
+            previous = state.decisions.get(record["key"])
+            if previous is not None and previous["fingerprint"] == fingerprint:
+                report.unchanged += 1
+                continue
+            items = judgment_items(record, max_tokens)
+            report.changed += 1
+            report.chunks += len(items)
+            pending[record["key"]] = (fingerprint, [item.id for item in items])
+            # A shorter text leaves the chunks past its end behind
+            if previous is not None:
+                removed.extend(paragraph_point_id(record["link"], str(index))
+                               for index in range(len(items), previous["chunks"]))
+            yield from items
+
+    if dry_run:
+        for _ in changed_items(iter_records(input_dir)):
+            pass
+        logging.info(f"Dry run: {report.changed} of {report.decisions} decisions changed, {report.chunks} chunks")
+        return report
+
+    stored: Set[str] = set()
+
+    def record_stored(points: List[PointStruct]):
+        stored.update(point.id for point in points)
+
+    embedder = embedder or CachedEmbedder(VoyageEmbedder())
+    pipeline = EmbeddingPipeline(embedder, qdrant_client, collection_name, embed_workers=embed_workers,
+                                 upsert_workers=upsert_workers, on_stored=record_stored)
+    stats = pipeline.run(changed_items(iter_records(input_dir)))
+    flush_all()
+    report.failed = stats.failed
+
+    for start in range(0, len(removed), DELETE_BATCH_SIZE):
+        batch = removed[start:start + DELETE_BATCH_SIZE]
+        qdrant_client.delete(collection_name=collection_name, points_selector=PointIdsList(points=batch), wait=True)
+    report.removed = len(removed)
+
+    # A decision counts as ingested once all of its chunks are stored, the rest is embedded again
+    # next time (mostly from the embedding cache)
+    for key, (fingerprint, point_ids) in pending.items():
+        if all(point_id in stored for point_id in point_ids):
+            state.decisions[key] = {"fingerprint": fingerprint, "chunks": len(point_ids)}
+    state.save()
+    if pending or removed:
+        # Make query services drop cached results that searched this collection
+        bump_collection_version(qdrant_client, collection_name)
+    logging.info(f"Ingested {report.changed} changed decisions ({report.chunks} chunks, {report.failed} failed, "
+                 f"{report.removed} removed), {report.unchanged} unchanged, into '{collection_name}'")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default=INPUT_DIR, help="Directory with the <court>.jsonl files of the crawler")
+    parser.add_argument("--collection", default=JUDGMENTS_COLLECTION)
+    parser.add_argument("--max-tokens", type=int, default=JUDGMENT_CHUNK_TOKENS)
+    parser.add_argument("--quantization", choices=QUANTIZATION_KINDS, default=None,
+                        help="Quantization of a new collection, an existing one keeps its own when not given")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    print(ingest_judgments(args.input, args.collection, max_tokens=args.max_tokens, dry_run=args.dry_run,
+                           quantization=args.quantization).model_dump())
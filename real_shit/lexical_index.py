@@ -0,0 +1,312 @@
+import os
+import re
+import json
+import math
+import shutil
+import logging
+import argparse
+import unicodedata
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from dedup import text_hash
+
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "lexical_index")
+FORMAT_VERSION = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+# Frequent Czech function words, already folded
+STOP_WORDS = set("""
+a aby ale ani az by byl byla byli bylo byt ci co do i jak jako je jeho jej jeji jejich jen jenz jiz jsou
+k kde kdo kdyz ke ktera ktere kteri ktery kterych kterym ma mu na nad nebo neni nez o od po pod podle
+pokud pri pro proti s se si so ta tak tam te tedy to tom tu u uz v ve vsak z za ze
+""".split())
+
+# Case endings of the light stemmer by Dolamic & Savoy, folded, longest first
+CASE_SUFFIXES = sorted("""
+atech etem atum ech ich eho emi emu ete eti iho imi imu ach ata aty ych ama ami ove ovi ymi
+em es im um at am os us ym mi ou a e i o u y
+""".split(), key=len, reverse=True)
+POSSESSIVE_SUFFIXES = ["ov", "in", "uv"]
+MIN_STEM = 3
+TOKEN_RE = re.compile(r"\d+[a-z]?|[a-z]+")
+
+
+# Lower case without diacritics: "Výpovědní" -> "vypovedni"
+def fold(text: str) -> str:
+    decomposed = unicodedata.normalize("NFD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def stem(token: str) -> str:
+    if token[0].isdigit():
+        # Paragraph numbers such as 2978 or 52a are kept whole
+        return token
+    for suffix in CASE_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM:
+            token = token[:-len(suffix)]
+            break
+    for suffix in POSSESSIVE_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM:
+            return token[:-len(suffix)]
+    return token
+
+
+def analyze(text: str) -> List[str]:
+    return [stem(token) for token in TOKEN_RE.findall(fold(text)) if token not in STOP_WORDS]
+
+
+# Reciprocal-rank fusion of several rankings of ids, best first
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Hashable]], k: int = RRF_K) -> List[Tuple[Hashable, float]]:
+    scores: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+# BM25 index over paragraph texts. Besides the inverted index (term -> documents) it keeps the
+# forward index (document -> term counts), so an update only re-analyzes new and changed texts
+# and the postings are rebuilt from the stored counts with a single sort.
+#
+# On-disk layout (all arrays memory-mapped on load):
+#   meta.json            - format version, counts, BM25 parameters
+#   terms.json           - vocabulary, the position is the term id
+#   docs.json            - [point id, zneni hash] of every document
+#   valid.npy            - isValid of every document
+#   fwd_terms/fwd_tfs    - term ids and counts of every document, split by fwd_offsets
+#   inv_docs/inv_tfs     - document rows and counts of every term, split by inv_offsets
+class LexicalIndex:
+    def __init__(self, terms: Optional[List[str]] = None, docs: Optional[List[List[str]]] = None,
+                 valid: Optional[np.ndarray] = None, fwd_terms: Optional[np.ndarray] = None,
+                 fwd_tfs: Optional[np.ndarray] = None, fwd_offsets: Optional[np.ndarray] = None,
+                 k1: float = BM25_K1, b: float = BM25_B):
+        self.terms = terms or []
+        self.vocabulary = {term: i for i, term in enumerate(self.terms)}
+        self.docs = docs or []
+        self.rows = {point_id: i for i, (point_id, _) in enumerate(self.docs)}
+        self.valid = valid if valid is not None else np.zeros(0, dtype=bool)
+        self.fwd_terms = fwd_terms if fwd_terms is not None else np.zeros(0, dtype=np.uint32)
+        self.fwd_tfs = fwd_tfs if fwd_tfs is not None else np.zeros(0, dtype=np.uint16)
+        self.fwd_offsets = fwd_offsets if fwd_offsets is not None else np.zeros(1, dtype=np.int64)
+        self.k1 = k1
+        self.b = b
+        self._build_postings()
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def _compute_lengths(self):
+        lengths = np.diff(self.fwd_offsets)
+        self.doc_lengths = np.zeros(len(self.docs), dtype=np.float32)
+        if len(self.fwd_tfs):
+            # reduceat needs the empty documents left out
+            self.doc_lengths[lengths > 0] = np.add.reduceat(np.asarray(self.fwd_tfs, dtype=np.float32),
+                                                            self.fwd_offsets[:-1][lengths > 0])
+        self.avgdl = float(self.doc_lengths.mean()) if len(self.docs) else 0.0
+        return lengths
+
+    def _build_postings(self):
+        lengths = self._compute_lengths()
+        rows = np.repeat(np.arange(len(self.docs), dtype=np.uint32), lengths)
+        order = np.argsort(self.fwd_terms, kind="stable")
+        self.inv_docs = rows[order]
+        self.inv_tfs = self.fwd_tfs[order]
+        counts = np.bincount(self.fwd_terms, minlength=len(self.terms)) if len(self.fwd_terms) else np.zeros(len(self.terms), np.int64)
+        self.inv_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def _term_ids(self, tokens: List[str], grow: bool) -> List[int]:
+        ids = []
+        for token in tokens:
+            term_id = self.vocabulary.get(token)
+            if term_id is None:
+                if not grow:
+                    continue
+                term_id = self.vocabulary[token] = len(self.terms)
+                self.terms.append(token)
+            ids.append(term_id)
+        return ids
+
+    # Rebuild from documents {"id", "zneni", "isValid"}, re-analyzing only texts that changed since the
+    # last build. Documents missing from `documents` are dropped.
+    def update(self, documents: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+        docs, valid, fwd_terms, fwd_tfs = [], [], [], []
+        stats = {"added": 0, "changed": 0, "unchanged": 0}
+        for document in documents:
+            point_id, zneni = document["id"], document.get("zneni") or ""
+            digest = text_hash(zneni)
+            row = self.rows.get(point_id)
+            if row is not None and self.docs[row][1] == digest:
+                start, end = self.fwd_offsets[row], self.fwd_offsets[row + 1]
+                terms, tfs = np.asarray(self.fwd_terms[start:end]), np.asarray(self.fwd_tfs[start:end])
+                stats["unchanged"] += 1
+            else:
+                terms, tfs = np.unique(np.asarray(self._term_ids(analyze(zneni), grow=True), dtype=np.uint32), return_counts=True)
+                tfs = np.minimum(tfs, np.iinfo(np.uint16).max).astype(np.uint16)
+                stats["added" if row is None else "changed"] += 1
+            docs.append([point_id, digest])
+            valid.append(bool(document.get("isValid", True)))
+            fwd_terms.append(terms)
+            fwd_tfs.append(tfs)
+        stats["removed"] = len(self.docs) - stats["unchanged"] - stats["changed"]
+
+        self.docs = docs
+        self.rows = {point_id: i for i, (point_id, _) in enumerate(docs)}
+        self.valid = np.asarray(valid, dtype=bool)
+        self.fwd_terms = np.concatenate(fwd_terms).astype(np.uint32) if docs else np.zeros(0, dtype=np.uint32)
+        self.fwd_tfs = np.concatenate(fwd_tfs).astype(np.uint16) if docs else np.zeros(0, dtype=np.uint16)
+        self.fwd_offsets = np.concatenate([[0], np.cumsum([len(terms) for terms in fwd_terms])]).astype(np.int64)
+        self._build_postings()
+        return stats
+
+    def search(self, query: str, k: int = 100, valid_only: bool = True) -> List[Tuple[Hashable, float]]:
+        if not self.docs:
+            return []
+        scores = np.zeros(len(self.docs), dtype=np.float32)
+        for term_id in set(self._term_ids(analyze(query), grow=False)):
+            start, end = self.inv_offsets[term_id], self.inv_offsets[term_id + 1]
+            if start == end:
+                continue
+            rows = self.inv_docs[start:end]
+            tfs = self.inv_tfs[start:end].astype(np.float32)
+            idf = math.log(1 + (len(self.docs) - (end - start) + 0.5) / (end - start + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[rows] / max(self.avgdl, 1e-9))
+            # Every document appears once in a term's postings, so plain fancy-index addition is safe
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        if valid_only:
+            scores[~self.valid] = 0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(self.docs[row][0], float(scores[row])) for row in candidates]
+
+    # Flip isValid of indexed documents without a rebuild, ids that are not indexed are ignored.
+    # Returns the number of documents that changed.
+    def set_valid(self, validity: Dict[Hashable, bool]) -> int:
+        valid = np.array(self.valid, dtype=bool)
+        changed = 0
+        for point_id, is_valid in validity.items():
+            row = self.rows.get(point_id)
+            if row is not None and valid[row] != bool(is_valid):
+                valid[row] = bool(is_valid)
+                changed += 1
+        self.valid = valid
+        return changed
+
+    # Replace only valid.npy of a saved index; services holding the old file mapped keep reading it
+    def save_valid(self, path: str):
+        tmp_path = os.path.join(path, "valid.tmp.npy")
+        np.save(tmp_path, np.asarray(self.valid))
+        os.replace(tmp_path, os.path.join(path, "valid.npy"))
+
+    def save(self, path: str):
+        # Write next to the old index and swap, so readers never see a half-written one
+        tmp_path = f"{path.rstrip(os.sep)}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": FORMAT_VERSION, "documents": len(self.docs), "terms": len(self.terms),
+                       "k1": self.k1, "b": self.b}, f)
+        with open(os.path.join(tmp_path, "terms.json"), "w", encoding="utf-8") as f:
+            json.dump(self.terms, f, ensure_ascii=False)
+        with open(os.path.join(tmp_path, "docs.json"), "w", encoding="utf-8") as f:
+            json.dump(self.docs, f)
+        for name in ("valid", "fwd_terms", "fwd_tfs", "fwd_offsets", "inv_docs", "inv_tfs", "inv_offsets"):
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.asarray(getattr(self, name)))
+        old_path = f"{path.rstrip(os.sep)}.old"
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "LexicalIndex":
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "terms.json"), "r", encoding="utf-8") as f:
+            terms = json.load(f)
+        with open(os.path.join(path, "docs.json"), "r", encoding="utf-8") as f:
+            docs = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+                  for name in ("valid", "fwd_terms", "fwd_tfs", "fwd_offsets", "inv_docs", "inv_tfs", "inv_offsets")}
+        index = cls.__new__(cls)
+        index.terms, index.docs = terms, docs
+        index.vocabulary = {term: i for i, term in enumerate(terms)}
+        index.rows = {point_id: i for i, (point_id, _) in enumerate(docs)}
+        index.k1, index.b = meta["k1"], meta["b"]
+        for name, array in arrays.items():
+            setattr(index, name, array)
+        index._compute_lengths()
+        return index
+
+
+# The index at `path`, or None when it was never built
+def load_lexical_index(path: str = LEXICAL_INDEX_PATH) -> Optional[LexicalIndex]:
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    index = LexicalIndex.load(path)
+    logging.info(f"Loaded lexical index with {len(index)} paragraphs and {len(index.terms)} terms from {path}")
+    return index
+
+
+# Patch isValid in the on-disk index after a sync or validity refresh flipped it in Qdrant, so
+# BM25 stops returning repealed paragraphs before the next full build
+def update_lexical_validity(validity: Dict[Hashable, bool], path: str = LEXICAL_INDEX_PATH) -> int:
+    index = load_lexical_index(path)
+    if index is None:
+        return 0
+    changed = index.set_valid(validity)
+    if changed:
+        index.save_valid(path)
+        logging.info(f"Updated isValid of {changed} paragraphs in the lexical index at {path}")
+    return changed
+
+
+def iter_mongo_paragraphs(mongo_client, db_name: str = "law_database",
+                          collection_names: Optional[List[str]] = None) -> Iterable[Dict[str, Any]]:
+    # The ingest side (Mongo, Voyage) is only imported by the jobs that build the index
+    from sync import PAYLOAD_FIELDS, SYNC_COLLECTION_PREFIX, paragraph_point_id, paragraph_source_key
+    db = mongo_client[db_name]
+    if collection_names is None:
+        collection_names = [name for name in db.list_collection_names() if not name.startswith(SYNC_COLLECTION_PREFIX)]
+    # The same owner collection per paragraph as compute_sync_plan
+    collection_names = sorted(collection_names)
+    seen = set()
+    projection = {field: 1 for field in PAYLOAD_FIELDS}
+    for collection_name in collection_names:
+        for doc in db[collection_name].find({}, projection):
+            if not doc.get("zneni"):
+                continue
+            # Same point ids as the Qdrant collection, so lexical and dense hits can be fused
+            point_id = paragraph_point_id(paragraph_source_key(doc), doc["cislo"])
+            if point_id in seen:
+                continue
+            seen.add(point_id)
+            yield {"id": point_id, "zneni": doc["zneni"], "isValid": doc.get("isValid", True)}
+
+
+# Bring the on-disk index up to date with the Mongo paragraphs
+def build_from_mongo(path: str = LEXICAL_INDEX_PATH, db_name: str = "law_database",
+                     collection_names: Optional[List[str]] = None) -> LexicalIndex:
+    from mongo_writer import get_mongo_client
+    index = load_lexical_index(path) or LexicalIndex()
+    stats = index.update(iter_mongo_paragraphs(get_mongo_client(), db_name, collection_names))
+    index.save(path)
+    logging.info(f"Lexical index at {path}: {stats['added']} added, {stats['changed']} changed, "
+                 f"{stats['unchanged']} unchanged, {stats['removed']} removed, {len(index.terms)} terms")
+    return LexicalIndex.load(path)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build or update the BM25 index of the Mongo paragraphs")
+    parser.add_argument("--path", default=LEXICAL_INDEX_PATH)
+    parser.add_argument("--db", default="law_database")
+    parser.add_argument("--query", help="search the index after the update")
+    args = parser.parse_args()
+    lexical_index = build_from_mongo(args.path, args.db)
+    if args.query:
+        for point_id, score in lexical_index.search(args.query, k=10):
+            print(f"{score:.3f} {point_id}")
@@ -0,0 +1,297 @@
+import os
+import math
+import json
+import logging
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Tuple
+import numpy as np
+from cachetools import LRUCache
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+# Indices of the k largest scores of every row, best first
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=-1), axis=-1)
+    return np.take_along_axis(part, order, axis=-1)
+
+
+# Set bits of every byte value, for Hamming distances between packed binary codes
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+# Compressed copy of the vectors for the first search pass, the same schemes as Qdrant's quantization:
+# "scalar" maps every value between the quantile bounds to an int8, "binary" keeps only the sign bit.
+# Codes are encoded and scored in row blocks so no full-size float temporary is created.
+class QuantizedVectors:
+    def __init__(self, kind: str, vectors: np.ndarray, quantile: float = 0.99, block_rows: int = 65536):
+        if kind not in ("scalar", "binary"):
+            raise ValueError(f"Unknown quantization: {kind}")
+        self.kind = kind
+        self.dimension = vectors.shape[1]
+        self.block_rows = block_rows
+        if kind == "scalar":
+            sample = np.asarray(vectors[::max(1, len(vectors) // 10_000)], dtype=np.float32)
+            self.low, high = np.quantile(sample, [(1 - quantile) / 2, 1 - (1 - quantile) / 2]) if len(sample) else (-1.0, 1.0)
+            self.scale = max(float(high - self.low), 1e-12) / 255
+            self.codes = np.empty(vectors.shape, dtype=np.int8)
+        else:
+            self.codes = np.empty((len(vectors), (self.dimension + 7) // 8), dtype=np.uint8)
+        for start in range(0, len(vectors), block_rows):
+            self.codes[start:start + block_rows] = self._encode(np.asarray(vectors[start:start + block_rows], dtype=np.float32))
+
+    def _encode(self, block: np.ndarray) -> np.ndarray:
+        if self.kind == "scalar":
+            return (np.clip(np.rint((block - self.low) / self.scale), 0, 255) - 128).astype(np.int8)
+        return np.packbits(block > 0, axis=1)
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+    # Approximate scores of normalized queries against all rows, shape (queries, rows)
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        scores = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        if self.kind == "scalar":
+            # q . v ~ q . ((code + 128) * scale + low)
+            offset = queries.sum(axis=1, keepdims=True) * (128 * self.scale + self.low)
+            for start in range(0, len(self.codes), self.block_rows):
+                block = self.codes[start:start + self.block_rows].astype(np.float32)
+                scores[:, start:start + len(block)] = queries @ block.T * self.scale + offset
+        else:
+            query_bits = np.packbits(queries > 0, axis=1)
+            for start in range(0, len(self.codes), self.block_rows):
+                block = self.codes[start:start + self.block_rows]
+                for i, bits in enumerate(query_bits):
+                    distance = POPCOUNT[np.bitwise_xor(block, bits)].sum(axis=1, dtype=np.int32)
+                    scores[i, start:start + len(block)] = 1.0 - 2.0 * distance / self.dimension
+        return scores
+
+
+# In-process cosine similarity index. Vectors are normalized once and kept in one contiguous
+# float32 matrix (optionally memory-mapped from disk), with a row -> id table. Exact search uses
+# a single matrix product and argpartition; an HNSW (hnswlib) or IVF (faiss) index can be built
+# on top for large corpora. With quantize() the first pass runs over int8 or binary codes and the
+# oversampled candidates are rescored with the full vectors, which can then stay memory-mapped on disk.
+class LocalIndex:
+    def __init__(self, dimension: int, vectors: Optional[np.ndarray] = None, ids: Optional[List[Hashable]] = None):
+        self.dimension = dimension
+        self.vectors = np.empty((0, dimension), dtype=np.float32) if vectors is None else vectors
+        self.ids: List[Hashable] = ids or []
+        self.rows: Dict[Hashable, int] = {row_id: i for i, row_id in enumerate(self.ids)}
+        self.approximate = None
+        self.approximate_kind: Optional[str] = None
+        self.quantized: Optional[QuantizedVectors] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_vectors(cls, vectors: Sequence[Sequence[float]], ids: Sequence[Hashable]) -> "LocalIndex":
+        matrix = normalize_rows(np.asarray(vectors, dtype=np.float32))
+        return cls(matrix.shape[1], np.ascontiguousarray(matrix), list(ids))
+
+    def add(self, vectors: Sequence[Sequence[float]], ids: Sequence[Hashable]):
+        matrix = normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension))
+        start = len(self.ids)
+        self.vectors = np.ascontiguousarray(np.concatenate([np.asarray(self.vectors), matrix]))
+        for i, row_id in enumerate(ids):
+            self.rows[row_id] = start + i
+        self.ids.extend(ids)
+        self.approximate = None
+        if self.quantized is not None:
+            self.quantize(self.quantized.kind)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "vectors.npy"), np.asarray(self.vectors))
+        with open(os.path.join(path, "ids.json"), "w", encoding="utf-8") as f:
+            json.dump(self.ids, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "LocalIndex":
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None)
+        with open(os.path.join(path, "ids.json"), "r", encoding="utf-8") as f:
+            # JSON turns tuple ids into lists
+            ids = [tuple(row_id) if isinstance(row_id, list) else row_id for row_id in json.load(f)]
+        return cls(vectors.shape[1], vectors, ids)
+
+    def build_approximate(self, kind: str = "hnsw", m: int = 32, ef_construction: int = 200, ef_search: int = 128,
+                          nlist: Optional[int] = None, nprobe: int = 16):
+        if kind == "hnsw":
+            import hnswlib
+            index = hnswlib.Index(space="ip", dim=self.dimension)
+            index.init_index(max_elements=len(self), M=m, ef_construction=ef_construction)
+            index.add_items(np.asarray(self.vectors), np.arange(len(self)))
+            index.set_ef(ef_search)
+        elif kind == "ivf":
+            import faiss
+            nlist = nlist or max(1, int(np.sqrt(len(self))))
+            quantizer = faiss.IndexFlatIP(self.dimension)
+            index = faiss.IndexIVFFlat(quantizer, self.dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(np.asarray(self.vectors))
+            index.add(np.asarray(self.vectors))
+            index.nprobe = nprobe
+        else:
+            raise ValueError(f"Unknown approximate index kind: {kind}")
+        self.approximate = index
+        self.approximate_kind = kind
+        logging.info(f"Built {kind} index over {len(self)} vectors")
+
+    def quantize(self, kind: str = "scalar", quantile: float = 0.99):
+        self.quantized = None if kind == "none" else QuantizedVectors(kind, self.vectors, quantile=quantile)
+        if self.quantized is not None:
+            logging.info(f"Quantized {len(self)} vectors to {kind}: {self.quantized.nbytes} bytes instead of {np.asarray(self.vectors).nbytes}")
+
+    # Bytes the first search pass keeps in RAM, and the full-precision vectors only read for rescoring
+    def memory_bytes(self) -> Dict[str, int]:
+        vectors = np.asarray(self.vectors).nbytes
+        if self.quantized is None:
+            return {"search": vectors, "rescore": 0}
+        return {"search": self.quantized.nbytes, "rescore": vectors}
+
+    def _quantized_search(self, queries: np.ndarray, k: int, mask: Optional[np.ndarray], oversampling: Optional[float],
+                          rescore: bool) -> Tuple[np.ndarray, np.ndarray]:
+        scores = self.quantized.scores(queries)
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+        candidates = top_k(scores, math.ceil(k * (oversampling or 1.0)))
+        if not rescore:
+            rows = candidates[:, :k]
+            return rows, np.take_along_axis(scores, rows, axis=-1)
+        full = np.stack([np.asarray(self.vectors[row], dtype=np.float32) @ query for row, query in zip(candidates, queries)])
+        if mask is not None:
+            full[~mask[candidates]] = -np.inf
+        order = top_k(full, k)
+        return np.take_along_axis(candidates, order, axis=-1), np.take_along_axis(full, order, axis=-1)
+
+    def _approximate_search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        k = min(k, len(self))
+        if self.approximate_kind == "hnsw":
+            rows, distances = self.approximate.knn_query(queries, k=k)
+            # hnswlib "ip" distance is 1 - inner product
+            return rows.astype(np.int64), 1.0 - distances
+        scores, rows = self.approximate.search(queries, k)
+        return rows.astype(np.int64), scores
+
+    # Batched search: returns (rows, scores) of shape (queries, k)
+    def search_batch(self, queries: Sequence[Sequence[float]], k: int = 10, mask: Optional[np.ndarray] = None,
+                     exact: bool = False, oversampling: Optional[float] = None, rescore: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        queries = normalize_rows(np.asarray(queries, dtype=np.float32).reshape(-1, self.dimension))
+        if self.approximate is not None and not exact and mask is None:
+            return self._approximate_search(queries, k)
+        if self.quantized is not None and not exact:
+            return self._quantized_search(queries, k, mask, oversampling, rescore)
+        scores = queries @ np.asarray(self.vectors).T
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+            k = min(k, int(mask.sum()))
+        rows = top_k(scores, k)
+        return rows, np.take_along_axis(scores, rows, axis=-1)
+
+    def search(self, query: Sequence[float], k: int = 10, mask: Optional[np.ndarray] = None,
+               **kwargs) -> List[Tuple[Hashable, float]]:
+        rows, scores = self.search_batch([query], k, mask=mask, **kwargs)
+        return [(self.ids[row], float(score)) for row, score in zip(rows[0], scores[0])]
+
+
+# Evaluate a qdrant Filter against a payload. Supports must/should/must_not with
+# MatchValue, MatchAny and Range conditions, which is all the query paths use.
+def payload_matches(payload: Dict[str, Any], query_filter) -> bool:
+    if query_filter is None:
+        return True
+    if hasattr(query_filter, "key"):
+        value = payload.get(query_filter.key)
+        match = query_filter.match
+        if match is not None:
+            if hasattr(match, "any"):
+                return value in match.any
+            return value == match.value
+        condition = query_filter.range
+        if condition is not None:
+            return value is not None and all([
+                condition.gt is None or value > condition.gt,
+                condition.gte is None or value >= condition.gte,
+                condition.lt is None or value < condition.lt,
+                condition.lte is None or value <= condition.lte,
+            ])
+        raise ValueError(f"Unsupported condition for the local index: {query_filter}")
+    if query_filter.must and not all(payload_matches(payload, condition) for condition in query_filter.must):
+        return False
+    if query_filter.should and not any(payload_matches(payload, condition) for condition in query_filter.should):
+        return False
+    if query_filter.must_not and any(payload_matches(payload, condition) for condition in query_filter.must_not):
+        return False
+    return True
+
+
+# Offline stand-in for AsyncQdrantClient over a LocalIndex for tests and benchmarks. Implements
+# the calls the retrieval service makes (search, scroll, retrieve, close) on a single collection.
+class LocalQdrant:
+    def __init__(self, index: LocalIndex, payloads: List[Dict[str, Any]], collection_name: str = "legal_paragraphs_updated",
+                 mask_cache_size: int = 32):
+        self.index = index
+        self.payloads = payloads
+        self.collection_name = collection_name
+        # Filters with per-query values (ids, staleURLs) would each add a mask, only the recent ones are kept
+        self._masks: LRUCache = LRUCache(maxsize=mask_cache_size)
+
+    def _mask(self, query_filter) -> Optional[np.ndarray]:
+        if query_filter is None:
+            return None
+        key = repr(query_filter)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = np.fromiter((payload_matches(payload, query_filter) for payload in self.payloads),
+                               dtype=bool, count=len(self.payloads))
+            self._masks[key] = mask
+        return mask
+
+    # Answer an unknown collection the way Qdrant does, callers tell "not found" from other errors by the 404
+    def _check_collection(self, collection_name: str):
+        from qdrant_client.http.exceptions import UnexpectedResponse
+        if collection_name != self.collection_name:
+            raise UnexpectedResponse(status_code=404, reason_phrase="Not Found",
+                                     content=f"Collection {collection_name} not found".encode("utf-8"), headers={})
+
+    async def search(self, collection_name: str, query_vector, limit: int = 10, query_filter=None,
+                     with_payload: bool = True, search_params=None, **kwargs):
+        from qdrant_client.http.models import ScoredPoint
+        self._check_collection(collection_name)
+        # Same meaning as in Qdrant: exact skips the approximate index, quantization.ignore the codes
+        quantization = getattr(search_params, "quantization", None)
+        exact = bool(getattr(search_params, "exact", False)) or bool(quantization and quantization.ignore)
+        rows, scores = self.index.search_batch([query_vector], limit, mask=self._mask(query_filter), exact=exact,
+                                               oversampling=quantization.oversampling if quantization else None,
+                                               rescore=quantization.rescore is not False if quantization else True)
+        return [ScoredPoint(id=self.index.ids[row], version=0, score=float(score),
+                            payload=self.payloads[row] if with_payload else None)
+                for row, score in zip(rows[0], scores[0]) if np.isfinite(score)]
+
+    async def scroll(self, collection_name: str, scroll_filter=None, limit: int = 10, offset=None,
+                     with_payload: bool = True, with_vectors: bool = False, **kwargs):
+        from qdrant_client.http.models import Record
+        self._check_collection(collection_name)
+        mask = self._mask(scroll_filter)
+        rows = np.flatnonzero(mask) if mask is not None else np.arange(len(self.payloads))
+        start = offset or 0
+        page = rows[start:start + limit]
+        next_offset = start + limit if start + limit < len(rows) else None
+        return [Record(id=self.index.ids[row], payload=self.payloads[row] if with_payload else None) for row in page], next_offset
+
+    async def retrieve(self, collection_name: str, ids, with_payload: bool = True, **kwargs):
+        from qdrant_client.http.models import Record
+        self._check_collection(collection_name)
+        rows = [self.index.rows[point_id] for point_id in ids if point_id in self.index.rows]
+        return [Record(id=self.index.ids[row], payload=self.payloads[row] if with_payload else None) for row in rows]
+
+    async def close(self):
+        pass
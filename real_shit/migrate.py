@@ -1,6 +1,7 @@
 import os
 from qdrant_client import QdrantClient
 from dotenv import load_dotenv
+from collection_schema import provision_collection
 
 load_dotenv()
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
@@ -13,4 +14,6 @@ cloud_client = QdrantClient(
 )
 
 local_client = QdrantClient("localhost",port=6333)
-local_client.migrate(cloud_client,[collection_name],batch_size = 100, recreate_on_collision=True)
\ No newline at end of file
+local_client.migrate(cloud_client,[collection_name],batch_size = 100, recreate_on_collision=True)
+# The migration copies points only, declare the payload indexes and index settings on the target
+provision_collection(cloud_client, collection_name)
@@ -0,0 +1,86 @@
+import os
+import logging
+import threading
+from typing import List, Optional, Union
+from pymongo import MongoClient, ASCENDING, InsertOne, UpdateOne, UpdateMany, DeleteOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+BULK_BATCH_SIZE = 1000
+
+_client: Optional[MongoClient] = None
+_client_lock = threading.Lock()
+
+
+# One pooled client per process, MongoClient is thread-safe and keeps its own connection pool
+def get_mongo_client() -> MongoClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MongoClient(MONGO_URI, maxPoolSize=50)
+        return _client
+
+
+# Paragraph collections of a database, without the sync state and other bookkeeping collections
+def paragraph_collections(db) -> List[str]:
+    return sorted(name for name in db.list_collection_names() if not name.startswith("_"))
+
+
+# Compound index the paragraph upserts filter on
+def ensure_paragraph_indexes(collection: Collection):
+    collection.create_index([("staleURL", ASCENDING), ("cislo", ASCENDING)], name="staleURL_cislo")
+
+
+class BulkWriteStats:
+    def __init__(self):
+        self.batches = 0
+        self.inserted = 0
+        self.upserted = 0
+        self.modified = 0
+        self.deleted = 0
+        self.errors = 0
+
+
+# Buffers write operations and sends them as unordered bulk_write batches
+class BulkWriter:
+    def __init__(self, collection: Collection, batch_size: int = BULK_BATCH_SIZE):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.operations: List[Union[InsertOne, UpdateOne, UpdateMany, DeleteOne]] = []
+        self.stats = BulkWriteStats()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def add(self, operation: Union[InsertOne, UpdateOne, UpdateMany, DeleteOne]):
+        self.operations.append(operation)
+        if len(self.operations) >= self.batch_size:
+            self.flush()
+
+    def upsert(self, filter: dict, document: dict):
+        self.add(UpdateOne(filter, {"$set": document}, upsert=True))
+
+    def insert(self, document: dict):
+        self.add(InsertOne(document))
+
+    def flush(self):
+        if not self.operations:
+            return
+        operations, self.operations = self.operations, []
+        try:
+            result = self.collection.bulk_write(operations, ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            # Unordered writes keep going past failed operations, log and count them
+            details = e.details
+            self.stats.errors += len(details.get("writeErrors", []))
+            logging.error(f"{len(details.get('writeErrors', []))} failed writes in bulk write to '{self.collection.name}'")
+        self.stats.batches += 1
+        self.stats.inserted += details.get("nInserted", 0)
+        self.stats.upserted += details.get("nUpserted", 0)
+        self.stats.modified += details.get("nModified", 0)
+        self.stats.deleted += details.get("nRemoved", 0)
@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from typing import Dict, List, Sequence, Set, Tuple
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import Record
+from qdrant_client.models import Filter, FieldCondition, MatchAny, MatchValue
+from collection_schema import point_cislo
+
+
+# Group the cislo windows of all hits by law: staleURL -> set of cislo labels
+def neighbour_windows(hits: Sequence[Tuple[str, int]], radius: int) -> "OrderedDict[str, Set[str]]":
+    windows: "OrderedDict[str, Set[str]]" = OrderedDict()
+    for staleURL, cislo in hits:
+        window = windows.setdefault(staleURL, set())
+        for neighbour in range(max(1, cislo - radius), cislo + radius + 1):
+            window.add(str(neighbour))
+    return windows
+
+
+# Matches on the indexed integer cislo_num, which also brings in lettered paragraphs (5a next to 5).
+# Points stored before cislo_num existed are matched by their cislo label.
+def neighbour_filter(windows: Dict[str, Set[str]]) -> Filter:
+    return Filter(should=[
+        Filter(must=[
+            FieldCondition(key="staleURL", match=MatchValue(value=staleURL)),
+            Filter(should=[
+                FieldCondition(key="cislo_num", match=MatchAny(any=sorted(int(cislo) for cislo in cisla))),
+                FieldCondition(key="cislo", match=MatchAny(any=sorted(cisla))),
+            ]),
+        ])
+        for staleURL, cisla in windows.items()
+    ])
+
+
+# Order neighbours by law (in hit order) and cislo, dropping duplicate points
+def order_neighbours(records: List[Record], windows: Dict[str, Set[str]]) -> List[Record]:
+    law_order = {staleURL: i for i, staleURL in enumerate(windows)}
+    unique = {record.id: record for record in records}
+    return sorted(unique.values(), key=lambda record: (law_order.get(record.payload["staleURL"], len(law_order)),
+                                                       point_cislo(record.payload), str(record.payload["cislo"])))
+
+
+# Fetch the paragraphs around every hit with a single filtered scroll instead of one request per neighbour.
+# `hits` are (staleURL, cislo) pairs, the window is cislo - radius .. cislo + radius.
+def query_paragraph_range(client: QdrantClient, hits: Sequence[Tuple[str, int]], radius: int = 2,
+                          collection_name: str = "legal_paragraphs_updated") -> List[Record]:
+    windows = neighbour_windows(hits, radius)
+    if not windows:
+        return []
+    # Laws can repeat a cislo (e.g. § 5 and § 5a), leave room for that so one page is enough
+    limit = 2 * sum(len(cisla) for cisla in windows.values())
+    records, offset = [], None
+    while True:
+        page, offset = client.scroll(
+            collection_name=collection_name,
+            scroll_filter=neighbour_filter(windows),
+            with_vectors=False,
+            with_payload=True,
+            limit=limit,
+            offset=offset
+        )
+        records.extend(page)
+        if offset is None:
+            break
+    return order_neighbours(records, windows)
+
+
+# Same as query_paragraph_range for AsyncQdrantClient
+async def aquery_paragraph_range(client, hits: Sequence[Tuple[str, int]], radius: int = 2,
+                                 collection_name: str = "legal_paragraphs_updated") -> List[Record]:
+    windows = neighbour_windows(hits, radius)
+    if not windows:
+        return []
+    limit = 2 * sum(len(cisla) for cisla in windows.values())
+    records, offset = [], None
+    while True:
+        page, offset = await client.scroll(
+            collection_name=collection_name,
+            scroll_filter=neighbour_filter(windows),
+            with_vectors=False,
+            with_payload=True,
+            limit=limit,
+            offset=offset
+        )
+        records.extend(page)
+        if offset is None:
+            break
+    return order_neighbours(records, windows)
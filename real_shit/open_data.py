@@ -1,9 +1,9 @@
-import requests
 import json
 import os
-import re
+import asyncio
 from typing import Any, List
 from pydantic import BaseModel
+from esbirka import EsbirkaClient, fetch_laws, sign_from_link
 
 class Paragraf(BaseModel):
     cislo: str
@@ -28,59 +28,26 @@ def load_from_json(filename: str) -> Any:
         data = json.load(f)
     return data['data']
 
-def get_laws(dir_name: str):
-    num_pattern = r'\d+'
-    text_pattern = r'<[^>]+>'
-    headers = {"esel-api-access-key": "0zIAcHQyAcqhlxxExaJqjsAeiZaocXgVKifkIAtuuzqgtmwgclGDCQbtsyovsBIij"}
+async def _get_laws(dir_name: str, concurrency: int, rate_limit: float, transport=None):
     files = os.listdir("data")
-    for file_num, file in enumerate(files):
-        data = load_from_json(f"data/{file}")
-        field = file.removesuffix(".json")
-        laws = Laws(field=field, laws=[])
-        for law_num, law_data in enumerate(data):
-            print(f"processing {file_num+1}/{len(files)}: {law_num+1}/{len(data)}", end="\r")
-            sign = law_data['link']
-            val = sign.split('/')[-1]
-            sign = val.split('-')
-            sign = "%2Fsb%2F"+sign[0]+"%2F"+sign[1]+"%2F0000-00-00"
-            try:
-                res = requests.get("https://api.e-sbirka.cz/dokumenty-sbirky/"+sign, headers=headers).json()
-            except Exception as e:
-                print(f"Failed to fetch law details for {sign}")
-                continue
-            if res.get('nazev') is None:
-                continue
-            nazev = res['nazev']
-            staleURL = res['staleUrl']
-            law = Law(nazev=nazev, staleURL=staleURL, paragrafy=[])
-            for i in range(50):
-                response = requests.get("https://api.e-sbirka.cz/dokumenty-sbirky/"+sign+"/fragmenty?cisloStranky="+str(i), headers=headers).json()
-                if response.get('chyby') is not None:
-                    break
-                fragments = response['seznam']
-                current_paragraph_number = None
-                current_paragraph_text = ""
-                for fragment in fragments:
-                    if fragment['kodTypuFragmentu'] == 'Paragraf':
-                        if current_paragraph_number is not None:
-                            # Save the current paragraph before starting a new one
-                            law.paragrafy.append(Paragraf(cislo=current_paragraph_number, zneni=current_paragraph_text.strip()))
-                        # Start a new paragraph
-                        match = re.search(num_pattern, fragment['xhtml'])
-                        if match is None:
-                            raise ValueError("Paragraf number not found")
-                        current_paragraph_number = match.group()
-                        current_paragraph_text = ""
-                    else:
-                        # Append fragment text to the current paragraph
-                        cleaned_text = re.sub(text_pattern, '', fragment.get('xhtml', ''))
-                        current_paragraph_text += cleaned_text + "\n"
-                # Save the last paragraph if it exists
-                if current_paragraph_number is not None:
-                    law.paragrafy.append(Paragraf(cislo=current_paragraph_number, zneni=current_paragraph_text.strip()))
-            laws.laws.append(law)
-        save_data_to_json(laws, f"{dir_name}/{field}.json")
-            
+    async with EsbirkaClient(concurrency=concurrency, rate_limit=rate_limit, transport=transport) as client:
+        for file_num, file in enumerate(files):
+            data = load_from_json(f"data/{file}")
+            field = file.removesuffix(".json")
+            print(f"processing {file_num+1}/{len(files)}: {len(data)} laws")
+            laws = Laws(field=field, laws=[])
+            results = await fetch_laws([sign_from_link(law_data['link']) for law_data in data], client)
+            for result in results:
+                if result is None:
+                    continue
+                law = Law(nazev=result['detail']['nazev'], staleURL=result['detail']['staleUrl'], paragrafy=[
+                    Paragraf(cislo=cislo, zneni=zneni) for cislo, zneni in result['paragraphs']
+                ])
+                laws.laws.append(law)
+            save_data_to_json(laws, f"{dir_name}/{field}.json")
+
+def get_laws(dir_name: str, concurrency: int = 16, rate_limit: float = 20.0, transport=None):
+    asyncio.run(_get_laws(dir_name, concurrency, rate_limit, transport))
 
 if __name__ == '__main__':
     output_dir = "open_data/laws"
@@ -2,8 +2,10 @@ import json
 import os
 import re
 import hashlib
+import argparse
+from datetime import datetime
 from typing import Any, List
-from pymongo import MongoClient
+from mongo_writer import BulkWriter, ensure_paragraph_indexes, get_mongo_client as get_pooled_client
 from pydantic import BaseModel, ValidationError
 
 # Define your data models
@@ -22,11 +24,12 @@ class Law(BaseModel):
 class Laws(BaseModel):
     field: str
     laws: List[Law]
+    # Laws of the file that failed validation and were left out
+    skipped: int = 0
 
 # Connect to MongoDB
 def get_mongo_client():
-    client = MongoClient("mongodb://localhost:27017/")
-    return client
+    return get_pooled_client()
 
 # Wipe the database
 def wipe_database(db_name="law_database"):
@@ -47,16 +50,43 @@ def save_data_to_mongodb(data: Laws, db_name="law_database"):
     db = client[db_name]
     
     collection = db[data.field]
+    ensure_paragraph_indexes(collection)
+    # A fresh collection (e.g. after --wipe) only needs plain inserts
+    fresh = collection.estimated_document_count() == 0
+    # Upsert instead of wiping, so unchanged paragraphs keep their fingerprint and the
+    # incremental Qdrant sync only sees real changes
+    load_id = datetime.utcnow().isoformat()
+    # One document per (staleURL, cislo) in both paths, a repeated cislo keeps its last text as the
+    # upserts would. Unordered bulk writes would not apply repeated upserts of one key in order anyway.
+    paragraf_docs = {}
     for law in data.laws:
         for paragraf in law.paragrafy:
-            paragraf_doc = {
+            paragraf_docs[(law.staleURL, paragraf.cislo)] = {
                 "cislo": paragraf.cislo,
                 "zneni": paragraf.zneni,
                 "law_name": law.nazev,
-                "year": law.year
+                "year": law.year,
+                "staleURL": law.staleURL,
+                "loadId": load_id
             }
-            collection.insert_one(paragraf_doc)
-            print(f"Paragraph {paragraf.cislo} from law '{law.nazev}' saved to collection '{data.field}'.")
+    with BulkWriter(collection) as writer:
+        for (staleURL, cislo), paragraf_doc in paragraf_docs.items():
+            if fresh:
+                writer.insert(paragraf_doc)
+            else:
+                writer.upsert({"staleURL": staleURL, "cislo": cislo}, paragraf_doc)
+    # Paragraphs that were not part of this load no longer exist in the source. After failed writes the
+    # load is incomplete and nothing is removed; whole laws are only removed when every law of the
+    # file validated, a skipped law would otherwise lose all of its paragraphs.
+    removed = 0
+    if writer.stats.errors:
+        print(f"{writer.stats.errors} failed writes to collection '{data.field}', keeping paragraphs missing from this load.")
+    else:
+        loaded = [law.staleURL for law in data.laws]
+        removed = collection.delete_many({"staleURL": {"$in": loaded}, "loadId": {"$ne": load_id}}).deleted_count
+        if not data.skipped:
+            removed += collection.delete_many({"staleURL": {"$nin": loaded}}).deleted_count
+    print(f"Saved {len(paragraf_docs)} paragraphs to collection '{data.field}', removed {removed}.")
 
 # Load data from JSON file and validate it against the Pydantic model
 def load_from_json(filename: str) -> Laws:
@@ -64,6 +94,7 @@ def load_from_json(filename: str) -> Laws:
         data = json.load(f)
     
     laws_list = []
+    skipped = 0
     for law_data in data['laws']:
         try:
             year = extract_year(law_data['staleURL'])
@@ -77,8 +108,9 @@ def load_from_json(filename: str) -> Laws:
             laws_list.append(law)
         except (ValidationError, ValueError) as e:
             print(f"Validation error for law data in file '{filename}': {e}")
+            skipped += 1
     
-    return Laws(field=data['field'], laws=laws_list)
+    return Laws(field=data['field'], laws=laws_list, skipped=skipped)
 
 # Function to process and save all JSON files in the specified directory to MongoDB
 def process_and_save_json_files(dir_name: str):
@@ -94,6 +126,10 @@ def process_and_save_json_files(dir_name: str):
                 print(f"Validation error while processing file '{file}': {e}")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--wipe", action="store_true", help="drop the database before loading (full rebuild)")
+    args = parser.parse_args()
     output_dir = "../open_data/laws"  # Specify your output directory here
-    wipe_database()  # Wipe the database before processing
+    if args.wipe:
+        wipe_database()
     process_and_save_json_files(output_dir)
@@ -1,11 +1,17 @@
+import argparse
 import voyageai
 import logging
-from typing import List
+from typing import List, Optional
 from pymongo import MongoClient
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import PointStruct
 from pydantic import BaseModel
-from qdrant_client.models import VectorParams, Distance
+from embeddings.embedders import VoyageEmbedder
+from embeddings.cache import CachedEmbedder, flush_all
+from ingest_pipeline import EmbeddingPipeline, PipelineItem, PipelineStats
+from query_cache import bump_collection_version
+from quantization import QUANTIZATION_KINDS
+from collection_schema import paragraph_payload, provision_collection
+from sync import paragraph_point_id, paragraph_source_key, sync_mongo_to_qdrant, sync_state_collection
 
 DIMENSION = 1024
 vo = voyageai.Client()
@@ -22,6 +28,9 @@ class Paragraf(BaseModel):
     zneni: str
     law_name: str
     year: str
+    staleURL: Optional[str] = None
+    isValid: bool = True
+    field: Optional[str] = None
 
 def embed(text, input_type="document"):
     try:
@@ -46,7 +55,10 @@ def load_paragraphs_from_mongodb(db_name: str) -> List[Paragraf]:
                     cislo=doc['cislo'],
                     zneni=doc['zneni'],
                     law_name=doc['law_name'],
-                    year=doc['year']
+                    year=doc['year'],
+                    staleURL=doc.get('staleURL'),
+                    isValid=doc.get('isValid', True),
+                    field=collection_name
                 )
                 paragraphs.append(paragraph)
         return paragraphs
@@ -55,60 +67,63 @@ def load_paragraphs_from_mongodb(db_name: str) -> List[Paragraf]:
         raise
 
 # Function to process and embed paragraphs, then save to Qdrant
-def process_and_save_to_qdrant(paragraphs: List[Paragraf], collection_name: str, qdrant_host: str = "localhost", qdrant_port: int = 6333):
+def process_and_save_to_qdrant(paragraphs: List[Paragraf], collection_name: str, qdrant_host: str = "localhost", qdrant_port: int = 6333,
+                               embedder=None, client: QdrantClient = None, embed_workers: int = 4, upsert_workers: int = 2,
+                               upsert_batch_size: int = 512, quantization: str = "none", db_name: str = "law_database",
+                               mongo_client: MongoClient = None) -> PipelineStats:
     try:
-        client = QdrantClient(host=qdrant_host, port=qdrant_port)
-        vectors_config = VectorParams(
-            size=DIMENSION,
-            distance=Distance.COSINE,
-        )
-        # Ensure the collection exists
-        if not client.get_collection(collection_name):
-            client.create_collection(collection_name, vectors_config=vectors_config)
-        else:
-            client.delete_collection(collection_name)
-            client.create_collection(collection_name, vectors_config=vectors_config)
-
-        total_paragraphs = len(paragraphs)
-        processed_paragraphs = 0
+        client = client or QdrantClient(host=qdrant_host, port=qdrant_port)
+        embedder = embedder or CachedEmbedder(VoyageEmbedder(client=vo))
+        # Start from an empty collection with the declared schema and payload indexes
+        provision_collection(client, collection_name, dimension=embedder.dimension, quantization=quantization, recreate=True)
+        # The state of the last incremental sync describes the dropped points, a later --incremental run
+        # would never remove the rebuilt ones. Without it that run re-checks every paragraph.
+        sync_state_collection(mongo_client or MongoClient("mongodb://localhost:27017/"), db_name, collection_name).drop()
 
-        for i, paragraph in enumerate(paragraphs):
-            if paragraph.zneni is None or paragraph.zneni == "":
-                logging.warning(f"Skipping empty paragraph: {paragraph}")
-                continue
-            try:
-                embedding = embed(paragraph.zneni)
-                point = PointStruct(
-                    id=i+1,
-                    vector=embedding,
-                    payload={
-                        "cislo": paragraph.cislo,
-                        "zneni": paragraph.zneni,
-                        "law_name": paragraph.law_name,
-                        "year": paragraph.year
-                    }
-                )
-                client.upsert(collection_name=collection_name, points=[point])
-                processed_paragraphs += 1
-                logging.info(f"Processed {processed_paragraphs}/{total_paragraphs} paragraphs")
-            except Exception as e:
-                logging.error(f"Error processing paragraph {i+1}: {e}")
-        
-        logging.info(f"Finished inserting {processed_paragraphs} paragraphs into collection '{collection_name}'.")
+        items = (
+            PipelineItem(
+                id=paragraph_point_id(paragraph_source_key(paragraph.model_dump()), paragraph.cislo),
+                text=paragraph.zneni or "",
+                payload=paragraph_payload(paragraph.model_dump(exclude_none=True))
+            )
+            for paragraph in paragraphs
+        )
+        pipeline = EmbeddingPipeline(embedder, client, collection_name, embed_workers=embed_workers,
+                                     upsert_workers=upsert_workers, upsert_batch_size=upsert_batch_size)
+        stats = pipeline.run(items)
+        flush_all()
+        bump_collection_version(client, collection_name)
+        logging.info(f"Finished inserting {stats.paragraphs}/{len(paragraphs)} paragraphs into collection '{collection_name}'.")
+        return stats
 
     except Exception as e:
         logging.error(f"Error setting up Qdrant collection: {e}")
         raise
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--embed-workers", type=int, default=4)
+    parser.add_argument("--upsert-workers", type=int, default=2)
+    parser.add_argument("--upsert-batch-size", type=int, default=512)
+    parser.add_argument("--quantization", choices=QUANTIZATION_KINDS, default="none",
+                        help="keep int8 (scalar) or 1-bit (binary) vectors in RAM and the originals on disk")
+    parser.add_argument("--incremental", action="store_true", help="apply only the changes since the last sync")
+    args = parser.parse_args()
+
     mongo_db_name = "law_database"  # Specify your MongoDB database name here
     qdrant_collection_name = "legal_paragraphs"  # Specify your Qdrant collection name here
 
     try:
-        # Load data from MongoDB
-        paragraphs = load_paragraphs_from_mongodb(mongo_db_name)
-        
-        # Process and save to Qdrant
-        process_and_save_to_qdrant(paragraphs, qdrant_collection_name)
+        if args.incremental:
+            sync_mongo_to_qdrant(mongo_db_name, qdrant_collection_name,
+                                 quantization=args.quantization if args.quantization != "none" else None)
+        else:
+            # Load data from MongoDB
+            paragraphs = load_paragraphs_from_mongodb(mongo_db_name)
+
+            # Process and save to Qdrant
+            process_and_save_to_qdrant(paragraphs, qdrant_collection_name, embed_workers=args.embed_workers,
+                                       upsert_workers=args.upsert_workers, upsert_batch_size=args.upsert_batch_size,
+                                       quantization=args.quantization, db_name=mongo_db_name)
     except Exception as e:
         logging.error(f"Error in main execution: {e}")
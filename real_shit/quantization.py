@@ -0,0 +1,31 @@
+import os
+from typing import Optional
+from qdrant_client.models import (BinaryQuantization, BinaryQuantizationConfig, QuantizationSearchParams,
+                                  ScalarQuantization, ScalarQuantizationConfig, ScalarType, SearchParams)
+
+# "scalar" keeps one int8 per dimension (4x smaller), "binary" one bit per dimension (32x smaller).
+# The full-precision vectors move to disk and are only read to rescore the oversampled candidates.
+QUANTIZATION_KINDS = ("none", "scalar", "binary")
+# Binary codes lose more ranking detail and need a wider candidate pool before rescoring
+DEFAULT_OVERSAMPLING = {"none": None, "scalar": 2.0, "binary": 3.0}
+
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "none")
+QDRANT_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING", 0)) or DEFAULT_OVERSAMPLING.get(QDRANT_QUANTIZATION)
+
+
+def quantization_config(kind: str = "none", quantile: float = 0.99, always_ram: bool = True):
+    if kind == "none":
+        return None
+    if kind == "scalar":
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=quantile, always_ram=always_ram))
+    if kind == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=always_ram))
+    raise ValueError(f"Unknown quantization: {kind}, expected one of {QUANTIZATION_KINDS}")
+
+
+# Search over the quantized vectors, fetching `oversampling` times more candidates and rescoring
+# them with the original vectors. Collections without quantization ignore these parameters.
+def quantization_search_params(oversampling: Optional[float] = QDRANT_OVERSAMPLING, rescore: bool = True) -> Optional[SearchParams]:
+    if not oversampling:
+        return None
+    return SearchParams(quantization=QuantizationSearchParams(ignore=False, rescore=rescore, oversampling=oversampling))
@@ -1,27 +1,45 @@
-from voyageai import Client
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import ScoredPoint
 from qdrant_client.models import Filter, FieldCondition, MatchValue
-from typing import Any, List, Optional
-from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
+from typing import Any, Dict, List, Optional, Tuple
 import os
+from embeddings.cache import cached_embed
+from concurrent.futures import ThreadPoolExecutor
+from quantization import QDRANT_OVERSAMPLING, quantization_search_params
 
 DIMENSION = 1024
-vo = Client()
+# The Voyage and Qdrant clients are created on first use and reused, the LLM libraries are
+# only imported by run_gpt
+_vo = None
+_qdrant_clients: Dict[Tuple[str, int], QdrantClient] = {}
+# Runs the judgments search next to the law search
+_search_pool = ThreadPoolExecutor(max_workers=4)
+JUDGMENTS_TOP_N = 10
+
+
+def voyage_client():
+    global _vo
+    if _vo is None:
+        from voyageai import Client
+        _vo = Client()
+    return _vo
+
+
+def qdrant_client(host: str = "localhost", port: int = 6333) -> QdrantClient:
+    if (host, port) not in _qdrant_clients:
+        _qdrant_clients[(host, port)] = QdrantClient(host=host, port=port)
+    return _qdrant_clients[(host, port)]
+
 
 def embed(text, input_type="query"):
     try:
-        result = vo.embed(text, model="voyage-multilingual-2", input_type=input_type)
-        return result.embeddings[0]
+        return cached_embed("voyage-multilingual-2", DIMENSION, input_type, text,
+                            lambda missing: voyage_client().embed(missing, model="voyage-multilingual-2", input_type=input_type).embeddings)
     except Exception as e:
         raise
 
 def rerank(query: str, documents: List[str], model: str, top_k: Optional[int] = None, truncation: bool = True):
     try:
-        reranking_object = vo.rerank(
+        reranking_object = voyage_client().rerank(
             query=query,
             documents=documents,
             model=model,
@@ -32,22 +50,34 @@ def rerank(query: str, documents: List[str], model: str, top_k: Optional[int] =
     except Exception as e:
         raise
 
-def query_and_rerank(query_text, collection_name="legal_paragraphs_updated", top_n=100, rerank_top_k=5, qdrant_host="localhost", qdrant_port=6333):
-    client = QdrantClient(host=qdrant_host, port=qdrant_port)
+def search(client, collection_name, query_embedding, limit, oversampling=QDRANT_OVERSAMPLING):
+    return client.search(
+        collection_name=collection_name,
+        query_vector=query_embedding,
+        limit=limit,
+        query_filter=Filter(must=[
+        FieldCondition(key="isValid", match=MatchValue(value=True))
+    ]),
+        # Oversample on the quantized vectors and rescore with the originals
+        search_params=quantization_search_params(oversampling)
+    )
+
+# With a judgments collection the laws and the court decisions are searched at the same time and
+# reranked together, the decision chunks only add judgments_top_n candidates
+def query_and_rerank(query_text, collection_name="legal_paragraphs_updated", top_n=100, rerank_top_k=5, qdrant_host="localhost", qdrant_port=6333,
+                     oversampling=QDRANT_OVERSAMPLING, judgments_collection=None, judgments_top_n=JUDGMENTS_TOP_N):
+    client = qdrant_client(qdrant_host, qdrant_port)
     
     try:
         # Embed the query
         query_embedding = embed(query_text)
         
         # Search for the top N most similar paragraphs
-        search_result = client.search(
-            collection_name=collection_name,
-            query_vector=query_embedding,
-            limit=top_n,
-            query_filter=Filter(must=[
-            FieldCondition(key="isValid", match=MatchValue(value=True))
-        ])
-        )
+        if judgments_collection:
+            judgments_future = _search_pool.submit(search, client, judgments_collection, query_embedding, judgments_top_n, oversampling)
+        search_result = search(client, collection_name, query_embedding, top_n, oversampling)
+        if judgments_collection:
+            search_result = search_result + judgments_future.result()
 
         # Prepare documents (as texts) for reranking
         documents = [point.payload["zneni"] for point in search_result]
@@ -56,7 +86,8 @@ def query_and_rerank(query_text, collection_name="legal_paragraphs_updated", top
         reranked_results = rerank(query_text, documents, model="rerank-1", top_k=rerank_top_k)
 
         # Map reranked results back to the original paragraphs
-        top_paragraphs = [next(point for point in search_result if point.payload["zneni"] == result.document) for result in reranked_results]
+        # Rerank results carry the index of the document they rank
+        top_paragraphs = [search_result[result.index] for result in reranked_results]
         
         return top_paragraphs
     
@@ -64,6 +95,8 @@ def query_and_rerank(query_text, collection_name="legal_paragraphs_updated", top
         raise
 
 def run_gpt(question: str):
+    from langchain_openai import ChatOpenAI
+    from langchain_anthropic import ChatAnthropic
     llm = ChatOpenAI(model="gpt-4o", temperature=0.7)
     llm = ChatAnthropic(temperature=0.7, model_name="claude-3-5-sonnet-20240620")
     print(f"Původní dotaz: {question}")
@@ -0,0 +1,113 @@
+import time
+import uuid
+import hashlib
+import threading
+from datetime import datetime
+from typing import Any, Dict, Hashable, Optional
+import numpy as np
+from cachetools import TTLCache
+from qdrant_client.http.models import PointStruct
+from qdrant_client.models import VectorParams, Distance
+from qdrant_client.http.exceptions import UnexpectedResponse
+from embeddings.cache import normalize_text
+
+# Small Qdrant collection holding one version point per data collection. Ingest scripts bump the
+# version, query services compare it to invalidate cached search results.
+VERSIONS_COLLECTION = "collection_versions"
+
+
+def _version_point_id(collection_name: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"collection-version#{collection_name}"))
+
+
+def bump_collection_version(client, collection_name: str) -> str:
+    if not client.collection_exists(VERSIONS_COLLECTION):
+        client.create_collection(VERSIONS_COLLECTION, vectors_config=VectorParams(size=1, distance=Distance.DOT))
+    version = datetime.utcnow().isoformat()
+    client.upsert(collection_name=VERSIONS_COLLECTION, points=[
+        PointStruct(id=_version_point_id(collection_name), vector=[0.0],
+                    payload={"collection": collection_name, "version": version})
+    ], wait=True)
+    return version
+
+
+async def aget_collection_version(client, collection_name: str) -> Optional[str]:
+    try:
+        records = await client.retrieve(VERSIONS_COLLECTION, ids=[_version_point_id(collection_name)], with_payload=True)
+    except UnexpectedResponse as e:
+        if e.status_code != 404:
+            raise
+        # No versions collection yet, the data was never re-ingested with versioning
+        return None
+    return records[0].payload["version"] if records else None
+
+
+# One TTL + LRU cache level that counts its hits and misses
+class CacheLevel:
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        with self._lock:
+            value = self.cache.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        if self.cache.maxsize <= 0:
+            return
+        with self._lock:
+            self.cache[key] = value
+
+    def clear(self):
+        with self._lock:
+            self.cache.clear()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {"size": len(self.cache), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0}
+
+
+def question_key(question: str, model_name: str):
+    return model_name, normalize_text(question).casefold()
+
+
+def vector_hash(vector) -> str:
+    return hashlib.sha1(np.asarray(vector, dtype=np.float32).tobytes()).hexdigest()
+
+
+# Rephrases by normalized question, query embeddings by rephrased text and reranked top-k by
+# (embedding hash, filters, collection version, search parameters)
+class QueryCache:
+    def __init__(self, maxsize: int = 10_000, rephrase_ttl: float = 24 * 3600, embedding_ttl: float = 24 * 3600,
+                 results_ttl: float = 3600, version_ttl: float = 30):
+        self.rephrase = CacheLevel("rephrase", maxsize, rephrase_ttl)
+        self.embedding = CacheLevel("embedding", maxsize, embedding_ttl)
+        self.results = CacheLevel("results", maxsize, results_ttl)
+        self.version_ttl = version_ttl
+        self.version: Optional[str] = None
+        self.version_checked_at = 0.0
+
+    def version_is_stale(self) -> bool:
+        return time.monotonic() - self.version_checked_at > self.version_ttl
+
+    # Remember the collection version, dropping cached results when the collection was re-ingested
+    def set_version(self, version: Optional[str]):
+        if version != self.version:
+            self.results.clear()
+            self.version = version
+        self.version_checked_at = time.monotonic()
+
+    def results_key(self, vector, filters: str, top_n: int, top_k: int, query_text: str):
+        return vector_hash(vector), filters, self.version, top_n, top_k, normalize_text(query_text)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {level.name: level.stats() for level in (self.rephrase, self.embedding, self.results)}
@@ -1,11 +1,12 @@
 import json
 import os
 import re
-import requests
-from urllib.parse import quote
+import asyncio
 from typing import Any, List
-from pymongo import MongoClient
+from mongo_writer import BulkWriter, ensure_paragraph_indexes, get_mongo_client as get_pooled_client
 from pydantic import BaseModel, ValidationError
+from pymongo import UpdateOne
+from validity import refresh_validity
 
 # Define your data models
 class Paragraf(BaseModel):
@@ -27,8 +28,7 @@ class Laws(BaseModel):
 
 # Connect to MongoDB
 def get_mongo_client():
-    client = MongoClient("mongodb://localhost:27017/")
-    return client
+    return get_pooled_client()
 
 # Function to extract the year from staleURL
 def extract_year(staleURL: str) -> str:
@@ -43,20 +43,22 @@ def save_data_to_mongodb(data: Laws, db_name="law_database"):
     db = client[db_name]
     
     collection = db[data.field]
-    for law in data.laws:
-        for paragraf in law.paragrafy:
-            paragraf_doc = {
-                "cislo": paragraf.cislo,
-                "zneni": paragraf.zneni,
-                "law_name": law.nazev,
-                "year": law.year,
-                "staleURL": law.staleURL,
-                "isValid": paragraf.isValid
-            }
-            collection.update_one(
-                {"cislo": paragraf.cislo, "law_name": law.nazev, "year": law.year, "staleURL": law.staleURL},
-                {"$set": paragraf_doc})
-            print(f"Paragraph {paragraf.cislo} from law '{law.nazev}' updated to collection '{data.field}'.")
+    ensure_paragraph_indexes(collection)
+    with BulkWriter(collection) as writer:
+        for law in data.laws:
+            for paragraf in law.paragrafy:
+                paragraf_doc = {
+                    "cislo": paragraf.cislo,
+                    "zneni": paragraf.zneni,
+                    "law_name": law.nazev,
+                    "year": law.year,
+                    "staleURL": law.staleURL,
+                    "isValid": paragraf.isValid
+                }
+                writer.add(UpdateOne(
+                    {"staleURL": law.staleURL, "cislo": paragraf.cislo, "law_name": law.nazev, "year": law.year},
+                    {"$set": paragraf_doc}))
+    print(f"Updated {writer.stats.modified} paragraphs in collection '{data.field}' in {writer.stats.batches} bulk writes.")
 
 # Load data from JSON file and validate it against the Pydantic model
 def load_from_json(filename: str) -> Laws:
@@ -93,42 +95,16 @@ def process_and_save_json_files(dir_name: str):
             except ValidationError as e:
                 print(f"Validation error while processing file '{file}': {e}")
 
-# Function to validate records using the API
-def validate_records(db_name="law_database"):
-    client = get_mongo_client()
-    db = client[db_name]
-    
-    collections = db.list_collection_names()
-    headers = {"esel-api-access-key": "0zIAcHQyAcqhlxxExaJqjsAeiZaocXgVKifkIAtuuzqgtmwgclGDCQbtsyovsBIij"}
-    processed_staleURLs = set()  # Set to keep track of checked staleURLs
-
-    for collection_name in collections:
-        collection = db[collection_name]
-        valid_records = collection.find({"isValid": True})
-
-        for record in valid_records:
-            staleURL = record['staleURL']
-
-            if staleURL in processed_staleURLs:
-                continue  # Skip this record if the staleURL was already checked
-
-            encoded_staleURL = quote(staleURL, safe='')  # Encode the staleURL
-            api_url = f"https://api.e-sbirka.cz/dokumenty-sbirky/{encoded_staleURL}/souvislosti"
-            
-            response = requests.get(api_url, headers=headers)
-            if response.status_code == 200:
-                data = response.json()
-                for item in data['souvislosti']:
-                    if item['typ'] == "UPLNA_ZNENI_REPUBLIKOVAN":
-                        for doc in item['dokumentySbirky']:
-                            if doc['stavDokumentuSbirky'] == "ZRUSENY":
-                              collection.update_many({"staleURL": staleURL}, {"$set": {"isValid": False}})
-                              print(f"Updated isValid to False for records with staleURL: {staleURL}")
-
-                # Mark this staleURL as processed
-                processed_staleURLs.add(staleURL)
-            else:
-                print(f"Failed to fetch data from API for staleURL: {staleURL}")
+# Function to validate records using the API. Laws are checked concurrently, see validity.py.
+# Qdrant is updated too: later runs only check laws Mongo still has as valid, so a law flipped in
+# Mongo alone would stay searchable
+def validate_records(db_name="law_database", qdrant_collection="legal_paragraphs_updated"):
+    report = asyncio.run(refresh_validity(db_name, qdrant_collection, mongo_client=get_mongo_client()))
+    for staleURL in sorted(report.repealed):
+        print(f"Updated isValid to False for records with staleURL: {staleURL}")
+    for staleURL in report.failed:
+        print(f"Failed to fetch data from API for staleURL: {staleURL}")
+    return report
 
 if __name__ == '__main__':
     validate_records()  # Validate records using the API
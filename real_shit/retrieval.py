@@ -0,0 +1,470 @@
+import os
+import time
+import asyncio
+import logging
+import importlib
+import threading
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence
+from pydantic import BaseModel
+from dotenv import load_dotenv
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import Filter, FieldCondition, MatchValue
+from embeddings.utils import embed, rerank, serve_async_client
+from embeddings.cache import normalize_text
+from neighbours import aquery_paragraph_range
+from collection_schema import JUDGMENTS_COLLECTION, is_judgment, point_cislo
+from query_cache import QueryCache, aget_collection_version, question_key
+from quantization import QDRANT_OVERSAMPLING, quantization_search_params
+from lexical_index import LexicalIndex, load_lexical_index, reciprocal_rank_fusion
+from context_packer import CONTEXT_TOKEN_BUDGET, PackedContext, get_encoding, pack_context
+
+load_dotenv()
+QDRANT_API_KEY = os.getenv("QDRANT_API_KEY", None)
+QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
+# Seconds to wait for the reranker before falling back to the search order
+RERANK_TIMEOUT = float(os.getenv("RERANK_TIMEOUT", 5.0))
+# Court decision chunks added to the law candidates of every search. Kept small: the one rerank
+# over both sets is the slowest stage and grows with the number of documents.
+JUDGMENTS_TOP_N = int(os.getenv("JUDGMENTS_TOP_N", 10))
+
+REPHRASE_PROMPT = """You will get a question from a lawyer in Czech language who needs an answer to his question.
+In order to be able to answer him, you first need to know the relevant paragraphs from
+the relevant laws from Czech law. Your task is to rephrase the query into a question, using which to further
+to find the relevant sections. Always answer a question with a rephrased question only, no additional text!
+As a rule, answer in Czech language only."""
+
+ANSWER_PROMPT = """You are a highly qualified lawyer with many years of experience.
+Your task is to answer the following question, to answer which you will be given
+the context of the relevant sections to the question along with its number,
+its wording and the law it is from. For your answer, use exclusively the attached
+context. Always properly cite the law and the paragraph number that you used to
+answer the question. The context can also contain parts of court decisions, cite those
+by the court and the spisová značka. Make sure that the answer includes only the information that is
+relevant to the question.
+
+You must always answer in Czech language only."""
+
+
+# "§ 2978 zákona č. 89/2012 Sb." for a point from /sb/2012/89/..., "Nejvyšší soud, sp. zn. 21 Cdo 1234/2019"
+# for a court decision
+def citation(paragraph: Any) -> str:
+    if is_judgment(paragraph.payload):
+        payload = paragraph.payload
+        return f"{payload['court_name']}, sp. zn. {payload['spisova_znacka']}" if payload.get("spisova_znacka") \
+            else f"{payload['court_name']}, {payload['law_name']}"
+    parts = paragraph.payload['staleURL'].split("/")
+    numbering = "/".join(parts[-3:-1][::-1])
+    return f"§ {paragraph.payload['cislo']} zákona č. {numbering} Sb."
+
+
+# Rolling per-stage latency samples of the retrieval service
+class StageTimings:
+    def __init__(self, window: int = 1000):
+        self.samples: Dict[str, deque] = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, stage: str, seconds: float):
+        self.samples[stage].append(seconds)
+
+    def percentile(self, stage: str, q: float) -> float:
+        values = sorted(self.samples[stage])
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {stage: {"count": len(values), "p50": self.percentile(stage, 0.5), "p95": self.percentile(stage, 0.95)}
+                for stage, values in self.samples.items()}
+
+
+class RetrievalResult(BaseModel):
+    question: str
+    rephrased_question: str
+    top_paragraphs: List[Any]
+    extended_paragraphs: List[Any] = []
+    timings: Dict[str, float] = {}
+    # The reranker timed out and the candidates are in search order
+    degraded: bool = False
+
+
+# Holds the pooled async Qdrant, Voyage and LLM clients for the lifetime of the process and
+# runs the retrieval stages, overlapping the ones that do not depend on each other
+class RetrievalService:
+    def __init__(self, collection_name: str = "legal_paragraphs_updated", qdrant_url: str = QDRANT_HOST,
+                 qdrant_api_key: Optional[str] = QDRANT_API_KEY, rerank_model: str = "rerank-1",
+                 cache: Optional[QueryCache] = None, qdrant: Optional[AsyncQdrantClient] = None,
+                 embed_fn: Optional[Callable[[str], Awaitable[List[float]]]] = None,
+                 rerank_fn: Optional[Callable[..., Awaitable[List[Any]]]] = None,
+                 llm_factory: Optional[Callable[[str], Any]] = None, oversampling: Optional[float] = QDRANT_OVERSAMPLING,
+                 lexical: Optional[LexicalIndex] = None, rerank_timeout: Optional[float] = RERANK_TIMEOUT,
+                 answer_temperature: float = 0.6, context_budget: int = CONTEXT_TOKEN_BUDGET,
+                 judgments_collection: Optional[str] = JUDGMENTS_COLLECTION, judgments_top_n: int = JUDGMENTS_TOP_N):
+        self.collection_name = collection_name
+        # Court decisions searched next to the laws, once the collection exists (see refresh_version)
+        self.judgments_collection = judgments_collection
+        self.judgments_top_n = judgments_top_n
+        self.judgments_ready = False
+        self.rerank_model = rerank_model
+        self.qdrant = qdrant or AsyncQdrantClient(url=qdrant_url, api_key=qdrant_api_key)
+        # The embedder, reranker and LLM can be swapped for local stand-ins (see benchmarks/)
+        self.embed_fn = embed_fn or embed
+        self.rerank_fn = rerank_fn or rerank
+        self.llm_factory = llm_factory or self._default_llm_factory
+        self.llms: Dict[Any, Any] = {}
+        self.timings = StageTimings()
+        self.cache = cache or QueryCache()
+        # Oversampling + rescoring for quantized collections, None searches the stored vectors as they are
+        self.search_params = quantization_search_params(oversampling)
+        # BM25 index searched next to Qdrant, its hits are fused with the dense ones before the rerank
+        self.lexical = lexical
+        self.rerank_timeout = rerank_timeout
+        self.answer_temperature = answer_temperature
+        self.context_budget = context_budget
+        # Prompt tokens of the packed contexts, next to the stage latencies
+        self.context_tokens = StageTimings()
+
+    def llm(self, model_name: str):
+        if model_name not in self.llms:
+            self.llms[model_name] = self.llm_factory(model_name)
+        return self.llms[model_name]
+
+    # The answering model runs at its own temperature, stand-in factories serve both roles
+    def answer_llm(self, model_name: str):
+        key = ("answer", model_name)
+        if key not in self.llms:
+            if self.llm_factory is self._default_llm_factory:
+                from langchain_openai import ChatOpenAI
+                self.llms[key] = ChatOpenAI(model=model_name, temperature=self.answer_temperature)
+            else:
+                self.llms[key] = self.llm_factory(model_name)
+        return self.llms[key]
+
+    @staticmethod
+    def _default_llm_factory(model_name: str):
+        # langchain and openai take a good part of the cold start, they load with the first LLM
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(model=model_name, temperature=0.7)
+
+    @asynccontextmanager
+    async def _stage(self, name: str, timings: Dict[str, float]):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[name] = time.perf_counter() - start
+            self.timings.record(name, timings[name])
+
+    # Open the Qdrant connection, create the Voyage client and import and create the LLM clients and
+    # the tokenizer before the first request needs them. Imports run on a worker thread so the loop
+    # keeps serving; a failed step is logged and simply happens again on first use.
+    async def warmup(self, model_names: Sequence[str] = ("gpt-4o", "gpt-4o-mini")) -> Dict[str, float]:
+        timings: Dict[str, float] = {}
+
+        async def step(name: str, coro):
+            start = time.perf_counter()
+            try:
+                await coro
+            except Exception as e:
+                logging.warning(f"Warmup of {name} failed: {e}")
+            timings[name] = time.perf_counter() - start
+
+        async def qdrant():
+            await self.qdrant.get_collection(self.collection_name)
+            await self.refresh_version()
+
+        async def llms():
+            if self.llm_factory is self._default_llm_factory:
+                await asyncio.to_thread(importlib.import_module, "langchain_openai")
+            for model_name in model_names:
+                self.llm(model_name)
+                self.answer_llm(model_name)
+
+        steps = [step("qdrant", qdrant()), step("llm", llms()), step("tokenizer", asyncio.to_thread(get_encoding))]
+        if self.embed_fn is embed:
+            steps.append(step("voyage", asyncio.to_thread(serve_async_client)))
+        await asyncio.gather(*steps)
+        logging.info(f"Warmed up in {', '.join(f'{name} {seconds:.2f}s' for name, seconds in timings.items())}")
+        return timings
+
+    # Cached results depend on both collections. Whether the judgments collection exists is checked
+    # along with the versions, so it is searched from the first refresh after its first ingest.
+    # A failed check keeps the previous version, and so the cached results, and is retried on the next query.
+    async def refresh_version(self):
+        if not self.cache.version_is_stale():
+            return
+        try:
+            if not self.judgments_collection or not self.judgments_top_n:
+                self.cache.set_version(await aget_collection_version(self.qdrant, self.collection_name))
+                return
+            version, judgments_version, self.judgments_ready = await asyncio.gather(
+                aget_collection_version(self.qdrant, self.collection_name),
+                aget_collection_version(self.qdrant, self.judgments_collection),
+                self.qdrant.collection_exists(self.judgments_collection))
+        except Exception as e:
+            logging.warning(f"Collection version check failed, keeping version {self.cache.version}: {e}")
+            return
+        self.cache.set_version(f"{version}|{judgments_version}" if self.judgments_ready else version)
+
+    async def rephrase(self, question: str, model_name: str, timings: Dict[str, float]) -> str:
+        async with self._stage("rephrase", timings):
+            response = await self.llm(model_name).ainvoke([
+                {"role": "system", "content": REPHRASE_PROMPT},
+                {"role": "user", "content": question}
+            ])
+            self.cache.rephrase.set(question_key(question, model_name), response.content)
+            return response.content
+
+    async def embed(self, text: str, timings: Dict[str, float], stage: str = "embed") -> List[float]:
+        # Case is kept: the embedding of "Zákon" and "zákon" differ, only whitespace and Unicode form are normalized
+        key = ("query", normalize_text(text))
+        vector = self.cache.embedding.get(key)
+        if vector is None:
+            async with self._stage(stage, timings):
+                vector = await self.embed_fn(text)
+            self.cache.embedding.set(key, vector)
+        return vector
+
+    async def search(self, vector: List[float], top_n: int, timings: Dict[str, float], stage: str = "search",
+                     collection_name: Optional[str] = None):
+        async with self._stage(stage, timings):
+            return await self.qdrant.search(
+                collection_name=collection_name or self.collection_name,
+                query_vector=vector,
+                limit=top_n,
+                query_filter=Filter(must=[
+                    FieldCondition(key="isValid", match=MatchValue(value=True))
+                ]),
+                search_params=self.search_params,
+                with_payload=True
+            )
+
+    async def lexical_search(self, query_text: str, top_n: int, timings: Dict[str, float], stage: str = "lexical") -> List[str]:
+        async with self._stage(stage, timings):
+            hits = await asyncio.to_thread(self.lexical.search, query_text, top_n)
+            return [point_id for point_id, _ in hits]
+
+    # Law candidates followed by the court decision chunks, both searched at the same time. The decisions
+    # are only added, the one rerank that follows orders laws and decisions together; a failed
+    # judgments search leaves the laws alone. Stage timings are named with `prefix`, so the speculative
+    # search can run next to the main one.
+    async def hybrid_search(self, vector: List[float], query_text: str, top_n: int, timings: Dict[str, float],
+                            prefix: str = ""):
+        if not self.judgments_ready:
+            return await self.law_search(vector, query_text, top_n, timings, prefix)
+        judgments_task = asyncio.create_task(self.search(vector, self.judgments_top_n, timings, stage=f"{prefix}judgments_search",
+                                                         collection_name=self.judgments_collection))
+        try:
+            points = await self.law_search(vector, query_text, top_n, timings, prefix)
+        except Exception:
+            judgments_task.cancel()
+            raise
+        try:
+            return points + await judgments_task
+        except Exception as e:
+            logging.error(f"Judgments search failed, using the laws only: {e}")
+            return points
+
+    # Dense search, and with a lexical index also BM25 at the same time, fused by reciprocal rank.
+    # Lexical hits the dense search missed are fetched from Qdrant by id.
+    async def law_search(self, vector: List[float], query_text: str, top_n: int, timings: Dict[str, float],
+                         prefix: str = ""):
+        if self.lexical is None:
+            return await self.search(vector, top_n, timings, stage=f"{prefix}search")
+        lexical_task = asyncio.create_task(self.lexical_search(query_text, top_n, timings, stage=f"{prefix}lexical"))
+        points = await self.search(vector, top_n, timings, stage=f"{prefix}search")
+        try:
+            lexical_ids = await lexical_task
+        except Exception as e:
+            logging.error(f"Lexical search failed, using the dense hits only: {e}")
+            return points
+        async with self._stage(f"{prefix}fusion", timings):
+            by_id = {point.id: point for point in points}
+            missing = [point_id for point_id in lexical_ids if point_id not in by_id]
+            if missing:
+                for record in await self.qdrant.retrieve(self.collection_name, ids=missing, with_payload=True):
+                    # The dense search filters on isValid, the lexical index can lag behind it
+                    if record.payload.get("isValid") is True:
+                        by_id[record.id] = record
+            fused = reciprocal_rank_fusion([[point.id for point in points], lexical_ids])
+            return [by_id[point_id] for point_id, _ in fused if point_id in by_id][:top_n]
+
+    # A reranker slower than rerank_timeout (or failing) degrades to the top_k candidates in search
+    # order; this is marked with a "rerank_degraded" timing and such results are not cached.
+    async def rerank(self, query_text: str, points: List[Any], top_k: int, timings: Dict[str, float]) -> List[Any]:
+        async with self._stage("rerank", timings):
+            documents = [point.payload["zneni"] for point in points]
+            try:
+                reranked_results = await asyncio.wait_for(
+                    self.rerank_fn(query_text, documents, model=self.rerank_model, top_k=top_k), self.rerank_timeout)
+            except Exception as e:
+                logging.error(f"Rerank failed, using the search order: {type(e).__name__} {e}")
+                timings["rerank_degraded"] = 1.0
+                return points[:top_k]
+            # Rerank results carry the index of the document they rank
+            return [points[result.index] for result in reranked_results]
+
+    # Paragraphs around the law hits and chunks around the decision hits, from their own collections
+    async def neighbours(self, points: List[Any], radius: int, timings: Dict[str, float]) -> List[Any]:
+        async with self._stage("neighbours", timings):
+            lookups = []
+            for collection_name, judgment in ((self.collection_name, False), (self.judgments_collection, True)):
+                hits = [(point.payload["staleURL"], point_cislo(point.payload)) for point in points
+                        if is_judgment(point.payload) == judgment]
+                if hits:
+                    lookups.append(aquery_paragraph_range(self.qdrant, hits, radius=radius, collection_name=collection_name))
+            return [record for records in await asyncio.gather(*lookups) for record in records]
+
+    # Part of the results cache key describing how the candidates were found
+    def _filters(self) -> str:
+        filters = "isValid|lexical" if self.lexical is not None else "isValid"
+        return f"{filters}|judgments:{self.judgments_top_n}" if self.judgments_ready else filters
+
+    # The same hybrid search as the rephrased question gets, its hits may be the only candidates
+    async def _speculative_search(self, question: str, top_n: int, timings: Dict[str, float]):
+        vector = await self.embed(question, timings, stage="speculative_embed")
+        return await self.hybrid_search(vector, question, top_n, timings, prefix="speculative_")
+
+    async def query_and_rerank(self, query_text: str, top_n: int = 100, rerank_top_k: int = 5,
+                               neighbours_paragraph: int = 0, timings: Optional[Dict[str, float]] = None):
+        timings = {} if timings is None else timings
+        await self.refresh_version()
+        vector = await self.embed(query_text, timings)
+        key = self.cache.results_key(vector, self._filters(), top_n, rerank_top_k, query_text)
+        top_paragraphs = self.cache.results.get(key)
+        if top_paragraphs is None:
+            points = await self.hybrid_search(vector, query_text, top_n, timings)
+            top_paragraphs = await self.rerank(query_text, points, rerank_top_k, timings)
+            if "rerank_degraded" not in timings:
+                self.cache.results.set(key, top_paragraphs)
+        extended_paragraphs = []
+        if neighbours_paragraph:
+            extended_paragraphs = await self.neighbours(top_paragraphs, neighbours_paragraph, timings)
+        return top_paragraphs, extended_paragraphs
+
+    # Rephrase the question and, at the same time, embed and search with the raw question.
+    # The speculative hits are merged into the candidates of the rephrased search before the
+    # rerank, and are used alone when the rephrase fails. Rephrases, query embeddings and
+    # reranked results are served from the query cache when possible.
+    async def retrieve(self, question: str, model_name: str = "gpt-4o", top_n: int = 50, rerank_top_k: int = 3,
+                       neighbours_paragraph: int = 0, speculative: bool = True) -> RetrievalResult:
+        timings: Dict[str, float] = {}
+        start = time.perf_counter()
+        await self.refresh_version()
+        speculative_task = None
+        rephrased_question = self.cache.rephrase.get(question_key(question, model_name))
+        try:
+            if rephrased_question is None:
+                if speculative:
+                    speculative_task = asyncio.create_task(self._speculative_search(question, top_n, timings))
+                try:
+                    rephrased_question = await self.rephrase(question, model_name, timings)
+                except Exception as e:
+                    if speculative_task is None:
+                        raise
+                    logging.error(f"Rephrasing failed, searching with the original question: {e}")
+                    rephrased_question = question
+
+            if rephrased_question == question and speculative_task is not None:
+                candidates = await speculative_task
+                speculative_task = None
+            else:
+                candidates = None
+            vector = await self.embed(rephrased_question, timings)
+            filters = f"{self._filters()}|speculative:{question_key(question, model_name)[1]}" if speculative else self._filters()
+            key = self.cache.results_key(vector, filters, top_n, rerank_top_k, rephrased_question)
+            top_paragraphs = self.cache.results.get(key)
+
+            if top_paragraphs is not None:
+                if speculative_task is not None:
+                    speculative_task.cancel()
+            else:
+                if candidates is None:
+                    if speculative and speculative_task is None:
+                        speculative_task = asyncio.create_task(self._speculative_search(question, top_n, timings))
+                    candidates = await self.hybrid_search(vector, rephrased_question, top_n, timings)
+                    if speculative_task is not None:
+                        try:
+                            seen = {point.id for point in candidates}
+                            candidates += [point for point in await speculative_task if point.id not in seen]
+                        except Exception as e:
+                            logging.error(f"Speculative search failed: {e}")
+                top_paragraphs = await self.rerank(rephrased_question, candidates, rerank_top_k, timings)
+                if "rerank_degraded" not in timings:
+                    self.cache.results.set(key, top_paragraphs)
+        finally:
+            # A failure on the way leaves the speculative search running or its error unread
+            if speculative_task is not None:
+                if not speculative_task.done():
+                    speculative_task.cancel()
+                elif not speculative_task.cancelled():
+                    speculative_task.exception()
+
+        extended_paragraphs = []
+        if neighbours_paragraph:
+            extended_paragraphs = await self.neighbours(top_paragraphs, neighbours_paragraph, timings)
+        timings["total"] = time.perf_counter() - start
+        self.timings.record("total", timings["total"])
+        return RetrievalResult(question=question, rephrased_question=rephrased_question, top_paragraphs=top_paragraphs,
+                               extended_paragraphs=extended_paragraphs, timings=timings,
+                               degraded="rerank_degraded" in timings)
+
+    # Reranked paragraphs and their neighbours packed into the token budget of the answer prompt
+    def answer_context(self, result: RetrievalResult, budget: Optional[int] = None) -> PackedContext:
+        packed = pack_context(result.rephrased_question, result.top_paragraphs, result.extended_paragraphs,
+                              budget=budget or self.context_budget)
+        self.context_tokens.record("context", packed.tokens)
+        logging.debug(f"Packed context: {packed.usage()}")
+        return packed
+
+    # Stream the answer to a question from the packed context, token by token
+    async def astream_answer(self, question: str, context: PackedContext, model_name: str = "gpt-4o") -> AsyncIterator[str]:
+        messages = [
+            {"role": "system", "content": ANSWER_PROMPT},
+            {"role": "user", "content": f"QUESTION: {question}\nCONTEXT: {context.text}"},
+        ]
+        async for chunk in self.answer_llm(model_name).astream(messages):
+            yield chunk.content
+
+    async def close(self):
+        await self.qdrant.close()
+
+
+# The async clients are bound to the event loop they were created on. UIs that start a new loop per
+# request (Streamlit reruns asyncio.run(main()) on every interaction) share one service that lives
+# on a background loop and submit work to it with run().
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_service: Optional[RetrievalService] = None
+_lock = threading.Lock()
+
+
+def _service_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="retrieval-loop", daemon=True).start()
+        return _loop
+
+
+def get_service() -> RetrievalService:
+    global _service
+    loop = _service_loop()
+    with _lock:
+        if _service is None:
+            async def create():
+                return RetrievalService(lexical=load_lexical_index())
+            _service = asyncio.run_coroutine_threadsafe(create(), loop).result()
+        return _service
+
+
+# Await a coroutine on the service loop from any other event loop
+async def run(coro):
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, _service_loop()))
+
+
+# Create the shared service and warm it up on its loop without waiting for it. Call at process
+# start; .result() on the returned future waits for the warmup.
+def warmup():
+    service = get_service()
+    return asyncio.run_coroutine_threadsafe(service.warmup(), _service_loop())
@@ -0,0 +1,156 @@
+import uuid
+import hashlib
+import logging
+import argparse
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel
+from pymongo import MongoClient, UpdateOne, DeleteOne
+from qdrant_client import QdrantClient
+from qdrant_client.http.models import PointIdsList, PointStruct
+from embeddings.embedders import VoyageEmbedder, VOYAGE_DIMENSION
+from embeddings.cache import CachedEmbedder, flush_all
+from ingest_pipeline import EmbeddingPipeline, PipelineItem
+from query_cache import bump_collection_version
+from lexical_index import update_lexical_validity
+from collection_schema import PAYLOAD_SCHEMA_VERSION, ZNENI_TOKENS_FIELD, ZNENI_TOKENS_HASH_FIELD, paragraph_payload, provision_collection
+
+# Payload fields copied from the Mongo paragraph documents into Qdrant
+PAYLOAD_FIELDS = ["cislo", "zneni", "law_name", "year", "staleURL", "isValid", ZNENI_TOKENS_FIELD, ZNENI_TOKENS_HASH_FIELD]
+SYNC_COLLECTION_PREFIX = "_sync_"
+DELETE_BATCH_SIZE = 1000
+
+
+# Deterministic Qdrant point id of a paragraph, stable across re-ingests
+def paragraph_point_id(staleURL: str, cislo: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{staleURL}#{cislo}"))
+
+
+# Older collections have no staleURL, the law name and year identify the law there
+def paragraph_source_key(doc: Dict[str, Any]) -> str:
+    return doc.get("staleURL") or f"{doc.get('law_name')}|{doc.get('year')}"
+
+
+# Fingerprint of everything that ends up in the Qdrant point
+def content_fingerprint(doc: Dict[str, Any], collection_name: Optional[str] = None) -> str:
+    digest = hashlib.sha1(f"v{PAYLOAD_SCHEMA_VERSION}\x00{collection_name}\x01".encode("utf-8"))
+    for field in PAYLOAD_FIELDS:
+        digest.update(f"{field}\x00{doc.get(field)}\x01".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class SyncPlan(BaseModel):
+    added: List[PipelineItem] = []
+    changed: List[PipelineItem] = []
+    removed: List[str] = []
+    unchanged: int = 0
+    # point id -> (fingerprint, source collection) of every upserted paragraph
+    fingerprints: Dict[str, List[str]] = {}
+
+
+def sync_state_collection(mongo_client: MongoClient, db_name: str, qdrant_collection: str):
+    return mongo_client[db_name][SYNC_COLLECTION_PREFIX + qdrant_collection]
+
+
+# Compare the Mongo paragraphs with what was last synced into `qdrant_collection`
+def compute_sync_plan(mongo_client: MongoClient, db_name: str, qdrant_collection: str,
+                      collection_names: Optional[List[str]] = None) -> SyncPlan:
+    db = mongo_client[db_name]
+    state = sync_state_collection(mongo_client, db_name, qdrant_collection)
+    synced = {doc["_id"]: doc["fingerprint"] for doc in state.find({}, {"fingerprint": 1})}
+    if collection_names is None:
+        collection_names = [name for name in db.list_collection_names() if not name.startswith(SYNC_COLLECTION_PREFIX)]
+    # A law in several field collections belongs to the first one, list_collection_names has no fixed
+    # order and a changing owner would flip the field payload and fingerprint on every run
+    collection_names = sorted(collection_names)
+
+    plan = SyncPlan()
+    seen = set()
+    projection = {field: 1 for field in PAYLOAD_FIELDS}
+    for collection_name in collection_names:
+        for doc in db[collection_name].find({}, projection):
+            if not doc.get("zneni"):
+                continue
+            point_id = paragraph_point_id(paragraph_source_key(doc), doc["cislo"])
+            if point_id in seen:
+                continue
+            seen.add(point_id)
+            fingerprint = content_fingerprint(doc, collection_name)
+            previous = synced.get(point_id)
+            if previous == fingerprint:
+                plan.unchanged += 1
+                continue
+            item = PipelineItem(id=point_id, text=doc["zneni"], payload=paragraph_payload(doc, collection_name))
+            (plan.added if previous is None else plan.changed).append(item)
+            plan.fingerprints[point_id] = [fingerprint, collection_name]
+    plan.removed = [point_id for point_id in synced if point_id not in seen]
+    return plan
+
+
+# Apply only the difference between Mongo and Qdrant. Unchanged texts of changed
+# paragraphs are served by the embedding cache, so payload-only changes cost no API call.
+def apply_sync_plan(plan: SyncPlan, mongo_client: MongoClient, db_name: str, qdrant_client: QdrantClient,
+                    qdrant_collection: str, embedder=None, embed_workers: int = 4, upsert_workers: int = 2):
+    state = sync_state_collection(mongo_client, db_name, qdrant_collection)
+
+    for start in range(0, len(plan.removed), DELETE_BATCH_SIZE):
+        batch = plan.removed[start:start + DELETE_BATCH_SIZE]
+        qdrant_client.delete(collection_name=qdrant_collection, points_selector=PointIdsList(points=batch), wait=True)
+        state.bulk_write([DeleteOne({"_id": point_id}) for point_id in batch], ordered=False)
+    if plan.removed:
+        logging.info(f"Removed {len(plan.removed)} paragraphs from '{qdrant_collection}'")
+
+    def record(points: List[PointStruct]):
+        now = datetime.utcnow()
+        state.bulk_write([
+            UpdateOne({"_id": point.id},
+                      {"$set": {"fingerprint": plan.fingerprints[point.id][0],
+                                "collection": plan.fingerprints[point.id][1],
+                                "staleURL": point.payload.get("staleURL"),
+                                "cislo": point.payload.get("cislo"),
+                                "synced_at": now}},
+                      upsert=True)
+            for point in points
+        ], ordered=False)
+
+    items = plan.added + plan.changed
+    if items:
+        embedder = embedder or CachedEmbedder(VoyageEmbedder())
+        pipeline = EmbeddingPipeline(embedder, qdrant_client, qdrant_collection, embed_workers=embed_workers,
+                                     upsert_workers=upsert_workers, on_stored=record)
+        stats = pipeline.run(items)
+        flush_all()
+        logging.info(f"Upserted {stats.paragraphs}/{len(items)} added or changed paragraphs into '{qdrant_collection}'")
+        # isValid may have flipped with the payload, keep the BM25 filter in step
+        update_lexical_validity({item.id: item.payload.get("isValid", True) for item in items})
+    if items or plan.removed:
+        # Make query services drop cached results for this collection
+        bump_collection_version(qdrant_client, qdrant_collection)
+
+
+def sync_mongo_to_qdrant(db_name: str, qdrant_collection: str, mongo_client: MongoClient = None,
+                         qdrant_client: QdrantClient = None, embedder=None, dry_run: bool = False,
+                         quantization: Optional[str] = None) -> SyncPlan:
+    mongo_client = mongo_client or MongoClient("mongodb://localhost:27017/")
+    qdrant_client = qdrant_client or QdrantClient(host="localhost", port=6333)
+    dimension = embedder.dimension if embedder else VOYAGE_DIMENSION
+    if provision_collection(qdrant_client, qdrant_collection, dimension=dimension, quantization=quantization):
+        # A new collection holds nothing, forget whatever was synced before
+        sync_state_collection(mongo_client, db_name, qdrant_collection).drop()
+
+    plan = compute_sync_plan(mongo_client, db_name, qdrant_collection)
+    logging.info(f"Sync plan for '{qdrant_collection}': {len(plan.added)} added, {len(plan.changed)} changed, "
+                 f"{len(plan.removed)} removed, {plan.unchanged} unchanged")
+    if not dry_run:
+        apply_sync_plan(plan, mongo_client, db_name, qdrant_client, qdrant_collection, embedder=embedder)
+    return plan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="law_database")
+    parser.add_argument("--collection", default="legal_paragraphs_updated")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sync_mongo_to_qdrant(args.db, args.collection, dry_run=args.dry_run)
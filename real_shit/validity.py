@@ -0,0 +1,211 @@
+# Refresh the isValid flag of the paragraphs. A law is no longer valid once e-Sbírka lists a
+# republished full version of it as repealed. Every distinct law is checked once, concurrently,
+# the flips are pushed to Qdrant as payload updates and to the lexical index, then written to Mongo
+# in one bulk write per collection, so no paragraph has to be re-embedded.
+#   python validity.py --db law_database --collection legal_paragraphs_updated
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Set
+from pymongo import MongoClient, UpdateMany
+from qdrant_client import QdrantClient
+from qdrant_client.models import FieldCondition, Filter, MatchAny
+from esbirka import EsbirkaClient
+from mongo_writer import BulkWriter, get_mongo_client, paragraph_collections
+from query_cache import bump_collection_version
+from lexical_index import update_lexical_validity
+
+CACHE_PATH = os.getenv("VALIDITY_CACHE_PATH", "validity_cache.json")
+# A repealed law stays repealed, only laws found valid are asked again after the TTL
+CACHE_TTL = float(os.getenv("VALIDITY_CACHE_TTL", 7 * 24 * 3600))
+QDRANT_BATCH_SIZE = 100
+
+
+# The souvislosti response of a law says whether a republished full version of it was repealed
+def is_repealed(souvislosti: Dict[str, Any]) -> bool:
+    for item in souvislosti.get('souvislosti') or []:
+        if item.get('typ') == "UPLNA_ZNENI_REPUBLIKOVAN":
+            for doc in item.get('dokumentySbirky') or []:
+                if doc.get('stavDokumentuSbirky') == "ZRUSENY":
+                    return True
+    return False
+
+
+# staleURL -> {"repealed": bool, "checked_at": unix time}, stored as one JSON file
+class ValidityCache:
+    def __init__(self, path: str = CACHE_PATH, ttl: float = CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+
+    def get(self, staleURL: str) -> Optional[bool]:
+        entry = self.entries.get(staleURL)
+        if entry is None:
+            return None
+        if not entry["repealed"] and time.time() - entry["checked_at"] > self.ttl:
+            return None
+        return entry["repealed"]
+
+    def set(self, staleURL: str, repealed: bool):
+        self.entries[staleURL] = {"repealed": repealed, "checked_at": time.time()}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+
+@dataclass
+class ValidityReport:
+    checked: int = 0
+    cached: int = 0
+    failed: List[str] = field(default_factory=list)
+    repealed: Set[str] = field(default_factory=set)
+    modified: int = 0
+
+
+# Distinct staleURLs of the still valid paragraphs, per collection
+def valid_stale_urls(db, collection_names: Optional[Iterable[str]] = None) -> Dict[str, Set[str]]:
+    if collection_names is None:
+        collection_names = paragraph_collections(db)
+    return {name: set(db[name].distinct("staleURL", {"isValid": True})) for name in collection_names}
+
+
+# Ask e-Sbírka about every staleURL the cache has no fresh answer for. Failed checks are
+# reported and leave the paragraphs as they are.
+async def check_validity(stale_urls: Iterable[str], client: EsbirkaClient, cache: ValidityCache,
+                         report: ValidityReport) -> Set[str]:
+    pending = []
+    for staleURL in stale_urls:
+        repealed = cache.get(staleURL)
+        if repealed is None:
+            pending.append(staleURL)
+        else:
+            report.cached += 1
+            if repealed:
+                report.repealed.add(staleURL)
+
+    async def check(staleURL: str):
+        try:
+            souvislosti = await client.get_souvislosti(staleURL)
+        except Exception as e:
+            logging.error(f"Failed to fetch data from API for staleURL {staleURL}: {e}")
+            report.failed.append(staleURL)
+            return
+        if souvislosti.get('chyby') is not None:
+            logging.error(f"API error for staleURL {staleURL}: {souvislosti['chyby']}")
+            report.failed.append(staleURL)
+            return
+        repealed = is_repealed(souvislosti)
+        cache.set(staleURL, repealed)
+        report.checked += 1
+        if repealed:
+            report.repealed.add(staleURL)
+
+    await asyncio.gather(*[check(staleURL) for staleURL in pending])
+    return report.repealed
+
+
+# One bulk write per collection flipping isValid of all paragraphs of the repealed laws
+def invalidate_in_mongo(db, repealed_by_collection: Dict[str, Set[str]]) -> int:
+    modified = 0
+    for collection_name, stale_urls in repealed_by_collection.items():
+        if not stale_urls:
+            continue
+        with BulkWriter(db[collection_name]) as writer:
+            for staleURL in sorted(stale_urls):
+                writer.add(UpdateMany({"staleURL": staleURL, "isValid": True}, {"$set": {"isValid": False}}))
+        modified += writer.stats.modified
+        logging.info(f"Invalidated {writer.stats.modified} paragraphs of {len(stale_urls)} laws in '{collection_name}'")
+    return modified
+
+
+# Set isValid False on the Qdrant points of the repealed laws, selected by the staleURL payload index
+def invalidate_in_qdrant(client: QdrantClient, collection_name: str, stale_urls: Iterable[str],
+                         batch_size: int = QDRANT_BATCH_SIZE):
+    stale_urls = sorted(stale_urls)
+    for start in range(0, len(stale_urls), batch_size):
+        batch = stale_urls[start:start + batch_size]
+        client.set_payload(
+            collection_name=collection_name,
+            payload={"isValid": False},
+            points=Filter(must=[FieldCondition(key="staleURL", match=MatchAny(any=batch))]),
+            wait=True,
+        )
+    if stale_urls:
+        # Make query services drop cached results for this collection
+        bump_collection_version(client, collection_name)
+
+
+# Point ids of the paragraphs of the repealed laws, as the sync and the lexical index assign them
+def repealed_point_ids(db, repealed_by_collection: Dict[str, Set[str]]) -> List[str]:
+    from sync import paragraph_point_id, paragraph_source_key
+    point_ids = []
+    for collection_name, stale_urls in repealed_by_collection.items():
+        if stale_urls:
+            for doc in db[collection_name].find({"staleURL": {"$in": sorted(stale_urls)}}, {"staleURL": 1, "cislo": 1}):
+                point_ids.append(paragraph_point_id(paragraph_source_key(doc), doc["cislo"]))
+    return point_ids
+
+
+async def refresh_validity(db_name: str = "law_database", qdrant_collection: Optional[str] = None,
+                           mongo_client: MongoClient = None, qdrant_client: QdrantClient = None,
+                           esbirka_client: EsbirkaClient = None, cache: ValidityCache = None,
+                           dry_run: bool = False) -> ValidityReport:
+    db = (mongo_client or get_mongo_client())[db_name]
+    cache = cache or ValidityCache()
+    report = ValidityReport()
+
+    by_collection = valid_stale_urls(db)
+    stale_urls = set().union(*by_collection.values())
+    logging.info(f"Checking {len(stale_urls)} laws with valid paragraphs in {len(by_collection)} collections")
+    client = esbirka_client or EsbirkaClient()
+    try:
+        repealed = await check_validity(stale_urls, client, cache, report)
+    finally:
+        if esbirka_client is None:
+            await client.aclose()
+        cache.save()
+    logging.info(f"{report.checked} laws checked, {report.cached} cached, {len(report.failed)} failed, "
+                 f"{len(repealed)} repealed")
+
+    if dry_run or not repealed:
+        return report
+    repealed_by_collection = {name: urls & repealed for name, urls in by_collection.items()}
+    # Search first: the next run only checks laws Mongo still has as valid, so Mongo is flipped last
+    # and a failed Qdrant update is retried then
+    if qdrant_collection:
+        invalidate_in_qdrant(qdrant_client or QdrantClient(host="localhost", port=6333), qdrant_collection, repealed)
+    update_lexical_validity({point_id: False for point_id in repealed_point_ids(db, repealed_by_collection)})
+    report.modified = invalidate_in_mongo(db, repealed_by_collection)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="law_database")
+    parser.add_argument("--collection", default="legal_paragraphs_updated",
+                        help="Qdrant collection to update, empty to update Mongo only")
+    parser.add_argument("--cache", default=CACHE_PATH)
+    parser.add_argument("--ttl", type=float, default=CACHE_TTL, help="Seconds a 'still valid' answer is reused")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate-limit", type=float, default=20.0, help="Requests per second")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    async def main():
+        async with EsbirkaClient(concurrency=args.concurrency, rate_limit=args.rate_limit) as client:
+            await refresh_validity(args.db, args.collection or None, esbirka_client=client,
+                                   cache=ValidityCache(args.cache, args.ttl), dry_run=args.dry_run)
+
+    asyncio.run(main())
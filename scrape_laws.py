@@ -1,83 +1,271 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from selenium.common.exceptions import InvalidArgumentException, WebDriverException
-from time import sleep
+# Crawler of the e-Sbírka collections: every prefix/year/number document is fetched from the
+# e-Sbírka API (real_shit/esbirka.py) instead of rendering its page in Chrome. Years and prefixes
+# run in parallel, the numbers of one series in concurrent windows. Records are appended to a real
+# JSONL file as they come and a checkpoint of the finished ranges lets an interrupted crawl resume.
+# Chrome is only used as a fallback for documents the API cannot serve (--browser-fallback).
+#   python scrape_laws.py --years 1948 2024 --output laws.jsonl
+#   python scrape_laws.py --mock 50                                  # in-process mock API
+#   python scrape_laws.py --api-url http://localhost:8081            # real_shit/esbirka_mock.py server
+import os
+import sys
 import json
+import asyncio
 import logging
+import argparse
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import quote
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "real_shit"))
+from esbirka import API_URL, EsbirkaClient
+from crawl_common import JsonlWriter
 
-# Set up Selenium WebDriver
-options = webdriver.ChromeOptions()
-options.add_argument("--window-size=1920,1080")
-options.add_argument("--disable-extensions")
-options.add_argument("--proxy-server='direct://'")
-options.add_argument("--proxy-bypass-list=*")
-options.add_argument("--start-maximized")
-options.add_argument('--headless')
-options.add_argument('--disable-gpu')
-options.add_argument('--disable-dev-shm-usage')
-options.add_argument('--no-sandbox')
-options.add_argument('--ignore-certificate-errors')
+PREFIXES = ['sb', 'sm', 'ul0', 'ul1', 'ul2', 'ul3']
+SUFFIXES = ['', 'n']
+FIRST_YEAR = 1948
+LAST_YEAR = 2024
+MAX_NUMBER = 10000
+# Numbers fetched concurrently within one series
+WINDOW = 20
+# A series ends after this many missing numbers in a row, single numbers are sometimes left out
+MAX_GAP = 10
+# A series is stopped after this many failed numbers in a row (API down, unexpected responses) and
+# resumed from the first of them on the next run
+MAX_FAILURES = 2 * WINDOW
 
+TEXT_XPATH = '/html/body/esel-app/esel-app-main/div/main/esel-detail-predpisu-page/div/div/esel-left-or-slide-panel/div/main/esel-text-predpisu/div/div/esel-fragment-view/div'
 
 logging.basicConfig(
     filename='logs.log',  # Log file path
     filemode='a',            # Append to the log file on each run
-    format='%(asctime)s - %(levelname)s - %(message)s'  # Log message format
+    format='%(asctime)s - %(levelname)s - %(message)s',  # Log message format
+    level=logging.INFO
 )
 
 
-def log_to_file(message):
-    with open('logs.log', 'a') as file:
-        file.write(message + '\n')
+def document_key(prefix: str, year: int, number: str) -> str:
+    return f'{prefix}/{year}/{number}'
 
 
-def fetch_data(year):
-    driver = webdriver.Chrome(service=Service(
-        ChromeDriverManager().install()), options=options)
-    prefixes = ['sb', 'sm', 'ul0', 'ul1', 'ul2', 'ul3']
-    suffixes = ['', 'n']
-    # Ensure that the data dictionary for the year is initialized
-    data = {year: {}}
+# API sign of a document: /sb/2012/89/0000-00-00, quoted
+def document_sign(key: str) -> str:
+    return quote(f"/{key}/0000-00-00", safe='')
 
+
+# Page text of a document rendered in headless Chrome, for documents the API does not serve.
+# One browser, used by one thread at a time; selenium is only imported when it is needed.
+class BrowserFallback:
+    def __init__(self, timeout: float = 10.0):
+        self.timeout = timeout
+        self.driver = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+        from webdriver_manager.chrome import ChromeDriverManager
+        options = webdriver.ChromeOptions()
+        for argument in ["--window-size=1920,1080", "--disable-extensions", "--proxy-server='direct://'",
+                         "--proxy-bypass-list=*", "--headless", "--disable-gpu", "--disable-dev-shm-usage",
+                         "--no-sandbox", "--ignore-certificate-errors"]:
+            options.add_argument(argument)
+        self.driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+
+    def _fetch_text(self, key: str) -> Optional[str]:
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.common.exceptions import TimeoutException
+        with self.lock:
+            if self.driver is None:
+                self._start()
+            self.driver.get(f'https://www.e-sbirka.cz/{key}')
+            try:
+                # Wait for the rendered text instead of a fixed sleep
+                elements = WebDriverWait(self.driver, self.timeout).until(
+                    expected_conditions.presence_of_all_elements_located((By.XPATH, TEXT_XPATH)))
+            except TimeoutException:
+                return None
+            return ' '.join([element.text for element in elements])
+
+    async def fetch_text(self, key: str) -> Optional[str]:
+        return await asyncio.to_thread(self._fetch_text, key)
+
+    def close(self):
+        if self.driver is not None:
+            self.driver.quit()
+
+
+# Per-series progress: the next number to fetch, the current run of missing numbers and whether the
+# series is finished, plus the documents that failed and are retried on the next run
+class Checkpoint:
+    def __init__(self, path: str):
+        self.path = path
+        self.state: Dict[str, Any] = {"series": {}, "failed": []}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+
+    def series(self, key: str) -> Dict[str, Any]:
+        return self.state["series"].setdefault(key, {"next": 1, "gap": 0, "done": False})
+
+    @property
+    def failed(self) -> List[str]:
+        return self.state["failed"]
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+
+def law_record(key: str, result: Dict[str, Any]) -> Dict[str, Any]:
+    detail = result["detail"]
+    prefix, year, number = key.split('/')
+    return {
+        "key": key,
+        "prefix": prefix,
+        "year": year,
+        "number": number,
+        "nazev": detail["nazev"],
+        "staleURL": detail.get("staleUrl"),
+        "datumZruseni": detail.get("datumZruseni"),
+        "paragrafy": [{"cislo": cislo, "zneni": zneni} for cislo, zneni in result["paragraphs"]],
+    }
+
+
+# ("found", record), ("missing", None) or ("failed", None) for one document
+async def fetch_document(client: EsbirkaClient, key: str,
+                         fallback: Optional[BrowserFallback] = None) -> Tuple[str, Optional[Dict[str, Any]]]:
     try:
-        driver = webdriver.Chrome(service=Service(
-            ChromeDriverManager().install()), options=options)  # ensure driver is defined
-        for prefix in prefixes:
-            for suffix in suffixes:
-                for i in range(1, 10000):
-                    url = f'https://www.e-sbirka.cz/{prefix}/{year}/{suffix+str(i)}'
-                    driver.get(url)
-                    sleep(2)
-
-                    text_elements = driver.find_elements(
-                        By.XPATH, '/html/body/esel-app/esel-app-main/div/main/esel-detail-predpisu-page/div/div/esel-left-or-slide-panel/div/main/esel-text-predpisu/div/div/esel-fragment-view/div')
-                    text_content = ' '.join(
-                        [element.text for element in text_elements])
-                    if text_elements == []:
-                        log_to_file(
-                            f'ending run for {prefix}/{year}/{suffix+str(i)}')
-                        break
-                    data[year][f'{prefix}/{year}/{suffix+str(i)}'] = text_content
-                    log_to_file(
-                        f'{prefix}/{year}/{suffix+str(i)}')
+        result = await client.get_law(document_sign(key))
     except Exception as e:
-        print(f"Unexpected error occurred: {str(e)}")
-    finally:
-        driver.quit()
-        return data
+        logging.error(f"API failed for {key}: {e}")
+        if fallback is None:
+            return "failed", None
+        text = await fallback.fetch_text(key)
+        if text is None:
+            return "missing", None
+        return "found", {"key": key, "text": text}
+    if result is None:
+        return "missing", None
+    record = law_record(key, result)
+    if not record["paragrafy"] and fallback is not None:
+        record["text"] = await fallback.fetch_text(key)
+    return "found", record
+
+
+class Crawler:
+    def __init__(self, client: EsbirkaClient, writer: JsonlWriter, checkpoint: Checkpoint,
+                 fallback: Optional[BrowserFallback] = None, window: int = WINDOW, max_gap: int = MAX_GAP,
+                 max_failures: int = MAX_FAILURES):
+        self.client = client
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.fallback = fallback
+        self.window = window
+        self.max_gap = max_gap
+        self.max_failures = max_failures
+
+    async def crawl_series(self, prefix: str, suffix: str, year: int):
+        state = self.checkpoint.series(f'{prefix}/{year}/{suffix}')
+        # (number, key) of the failed numbers since the last one with a known status
+        failing: List[Tuple[int, str]] = []
+        while not state["done"]:
+            numbers = range(state["next"], min(state["next"] + self.window, MAX_NUMBER))
+            keys = [document_key(prefix, year, f'{suffix}{number}') for number in numbers]
+            results = await asyncio.gather(*[fetch_document(self.client, key, self.fallback) for key in keys])
+            gap = state["gap"]
+            for number, key, (status, record) in zip(numbers, keys, results):
+                if status == "found":
+                    self.writer.write(record)
+                    gap = 0
+                    failing = []
+                elif status == "missing":
+                    gap += 1
+                    failing = []
+                else:
+                    # Unknown, it may exist: the gap is left as it is and the key retried on the next run
+                    self.checkpoint.failed.append(key)
+                    failing.append((number, key))
+            self.writer.flush()
+            if len(failing) >= self.max_failures:
+                # Nothing is known about these numbers, the next run continues from the first of them
+                failed_keys = {key for _, key in failing}
+                self.checkpoint.state["failed"] = [key for key in self.checkpoint.failed if key not in failed_keys]
+                state.update(next=failing[0][0], gap=gap)
+                self.checkpoint.save()
+                logging.error(f'stopping {prefix}/{year}/{suffix} after {len(failing)} failed numbers in a row '
+                              f'at {failing[0][0]}')
+                return
+            state.update(next=numbers[-1] + 1 if numbers else MAX_NUMBER, gap=gap,
+                         done=gap >= self.max_gap or not numbers or numbers[-1] + 1 >= MAX_NUMBER)
+            self.checkpoint.save()
+        logging.info(f'ending run for {prefix}/{year}/{suffix} at {state["next"]}')
 
+    async def retry_failed(self):
+        keys, self.checkpoint.state["failed"] = self.checkpoint.failed, []
+        results = await asyncio.gather(*[fetch_document(self.client, key, self.fallback) for key in keys])
+        for key, (status, record) in zip(keys, results):
+            if status == "found":
+                self.writer.write(record)
+            elif status == "failed":
+                self.checkpoint.failed.append(key)
+        self.writer.flush()
+        self.checkpoint.save()
 
-def save_data_to_json(data: dict):
-    with open(f'laws.jsonl', 'a', encoding='utf-8-sig') as file:
-        json.dump(data, file, ensure_ascii=False, indent=4)
+    # Crawl every prefix/suffix/year series, `workers` series at a time
+    async def crawl(self, years: List[int], prefixes: List[str] = PREFIXES, suffixes: List[str] = SUFFIXES,
+                    workers: int = 8):
+        if self.checkpoint.failed:
+            await self.retry_failed()
+        semaphore = asyncio.Semaphore(workers)
+
+        async def run(prefix: str, suffix: str, year: int):
+            async with semaphore:
+                await self.crawl_series(prefix, suffix, year)
+
+        await asyncio.gather(*[run(prefix, suffix, year) for year in years for prefix in prefixes for suffix in suffixes])
+
+
+async def main(args):
+    transport = None
+    if args.mock:
+        from esbirka_mock import MockEsbirka, generate_collection
+        years = list(range(args.years[0], args.years[1] + 1))
+        transport = MockEsbirka(generate_collection(years, args.mock, args.prefixes), latency=0.01).transport()
+    writer = JsonlWriter(args.output)
+    checkpoint = Checkpoint(args.checkpoint)
+    fallback = BrowserFallback() if args.browser_fallback else None
+    try:
+        async with EsbirkaClient(base_url=args.api_url, concurrency=args.concurrency, rate_limit=args.rate_limit,
+                                 transport=transport) as client:
+            crawler = Crawler(client, writer, checkpoint, fallback, args.window, args.max_gap,
+                              args.max_failures)
+            await crawler.crawl(list(range(args.years[0], args.years[1] + 1)), args.prefixes, args.suffixes, args.workers)
+    finally:
+        writer.close()
+        if fallback is not None:
+            fallback.close()
+    print(f"Wrote {writer.written} documents to {args.output}, {len(checkpoint.failed)} failed")
 
 
 if __name__ == "__main__":
-    data = {}
-    for year in range(1948, 2025):
-        print("starting year: ", year)
-        data = fetch_data(year)
-        save_data_to_json(data)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, nargs=2, default=[FIRST_YEAR, LAST_YEAR], metavar=("FIRST", "LAST"))
+    parser.add_argument("--prefixes", nargs="+", default=PREFIXES)
+    parser.add_argument("--suffixes", nargs="+", default=SUFFIXES)
+    parser.add_argument("--output", default="laws.jsonl")
+    parser.add_argument("--checkpoint", default="laws.checkpoint.json")
+    parser.add_argument("--workers", type=int, default=8, help="Series crawled in parallel")
+    parser.add_argument("--window", type=int, default=WINDOW)
+    parser.add_argument("--max-gap", type=int, default=MAX_GAP)
+    parser.add_argument("--max-failures", type=int, default=MAX_FAILURES,
+                        help="Failed numbers in a row that stop a series until the next run")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate-limit", type=float, default=20.0, help="Requests per second")
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--browser-fallback", action="store_true")
+    parser.add_argument("--mock", type=int, default=0, help="Crawl an in-process mock with up to this many documents per series")
+    asyncio.run(main(parser.parse_args()))
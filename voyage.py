@@ -4,14 +4,17 @@ from dotenv import load_dotenv
 from tqdm import tqdm
 import numpy as np
 import os
+from real_shit.embeddings.cache import cached_embed
 load_dotenv()
 
 vo = voyageai.Client()
+VOYAGE_MODEL = "voyage-multilingual-2"
+DIMENSION = 1024
 
 
 def embed(text, input_type="document"):
-    result = vo.embed(text, model="voyage-multilingual-2", input_type=input_type)
-    return result.embeddings[0]
+    return cached_embed(VOYAGE_MODEL, DIMENSION, input_type, text,
+                        lambda missing: vo.embed(missing, model=VOYAGE_MODEL, input_type=input_type).embeddings)
 
 def rerank(query, documents, top_k=3):
     reranking_object = vo.rerank(query, documents, model="rerank-1", top_k=top_k)